@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+
+"""Benchmarks the stages of a render on a generated world
+
+Generates a world of Anvil region files with the given size, terrain
+density, number of different blocks and share of corrupt chunks, then times
+the chunk scan, get_chunk(), the C render loop for each rendermode and the
+drawing functions it uses, compositing, encoding and whole renders with a
+few process counts. The results are written as JSON, so runs on different
+commits or machines can be compared with --compare.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy
+from PIL import Image
+import PIL
+
+# incantation to be able to import overviewer_core
+if not hasattr(sys, "frozen"):
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.split(__file__)[0], '..')))
+
+from overviewer_core import (c_overviewer, cache, dispatcher, nbt, observer, rendermodes,
+                             textures, tileset, util, world)
+from overviewer_core.c_overviewer import resize_half
+
+STAGES = ["scan", "get_chunk", "render_loop", "primitives", "composite", "encode", "render"]
+
+# bumped whenever the results change in a way that makes them incomparable
+# with older ones
+FORMAT = 1
+
+
+##
+## Writing the world
+##
+
+def _nbt_payload(value):
+    """Returns (tagtype, payload bytes) of a value. Lists hold values of one
+    type, int32 arrays become TAG_Int_Array and int64 arrays
+    TAG_Long_Array."""
+    if isinstance(value, dict):
+        data = b"".join(_nbt_tag(name, v) for name, v in value.items())
+        return 10, data + b"\0"
+    elif isinstance(value, list):
+        items = [_nbt_payload(v) for v in value]
+        tagtype = items[0][0] if items else 0
+        return 9, struct.pack(">bI", tagtype, len(items)) + b"".join(data for _, data in items)
+    elif isinstance(value, str):
+        value = value.encode("utf-8")
+        return 8, struct.pack(">H", len(value)) + value
+    elif isinstance(value, bytes):
+        return 7, struct.pack(">I", len(value)) + value
+    elif isinstance(value, numpy.ndarray):
+        if value.dtype == numpy.int64:
+            return 12, struct.pack(">I", len(value)) + value.astype(">i8").tobytes()
+        return 11, struct.pack(">I", len(value)) + value.astype(">i4").tobytes()
+    elif isinstance(value, float):
+        return 6, struct.pack(">d", value)
+    else:
+        return 3, struct.pack(">i", value)
+
+
+def _nbt_tag(name, value):
+    tagtype, data = _nbt_payload(value)
+    name = name.encode("utf-8")
+    return struct.pack(">bH", tagtype, len(name)) + name + data
+
+
+def pack_blockstates(values, bits):
+    """Packs the given 4096 palette indices the way 1.13 to 1.15 do, with
+    values spanning the longs, and returns them as an int64 array"""
+    shifts = numpy.arange(bits, dtype=numpy.uint16)
+    bitarray = ((values.astype(numpy.uint16)[:, None] >> shifts) & 1).astype(numpy.uint8)
+    return numpy.frombuffer(numpy.packbits(bitarray.ravel(), bitorder="little").tobytes(),
+                            dtype="<i8").astype(numpy.int64)
+
+
+def pack_nibbles(values):
+    """Packs a 4096 array of light levels two to a byte"""
+    values = values.astype(numpy.uint8).ravel()
+    return ((values[1::2] << 4) | values[0::2]).tobytes()
+
+
+def get_palette_names(size, rnd):
+    """Picks size different block names that the world code knows about and
+    that don't need any block states"""
+    rset = world.RegionSet(tempfile.gettempdir(), "region", filenames=[])
+    names = []
+    for name in sorted(rset._blockmap):
+        try:
+            if rset._get_block({"Name": name})[0] != 0:
+                names.append(name)
+        except KeyError:
+            pass
+    if size > len(names):
+        raise ValueError("There are only %d different blocks to choose from" % len(names))
+    return [names[i] for i in sorted(rnd.choice(len(names), size, replace=False))]
+
+
+def make_chunk(cx, cz, options, palette, rnd):
+    """Returns the NBT data of the chunk at cx, cz. The terrain is rolling
+    hills, filled with random blocks from the palette"""
+    height = options.sections * 16
+    # the surface height of each column, continuing across chunk borders
+    x = numpy.arange(16) + cx * 16
+    z = (numpy.arange(16) + cz * 16)[:, None]
+    mean = options.density * height
+    amplitude = min(mean, height - mean) / 2
+    surface = mean + amplitude * (numpy.sin(x / 11.0) + numpy.cos(z / 7.0)) / 2
+    surface = surface.astype(numpy.int32)
+
+    bits = max(4, (len(palette) - 1).bit_length())
+    sections = []
+    for y in range(options.sections):
+        # in Y, Z, X order like the chunk arrays
+        blocky = (numpy.arange(16) + y * 16)[:, None, None]
+        solid = blocky < surface[None, :, :]
+        values = numpy.where(solid, rnd.randint(1, len(palette), size=(16, 16, 16)), 0)
+        sections.append({
+            "Y": y,
+            "Palette": [{"Name": name} for name in palette],
+            "BlockStates": pack_blockstates(values.ravel(), bits),
+            "SkyLight": pack_nibbles(numpy.where(solid, 0, 15)),
+            "BlockLight": pack_nibbles(numpy.zeros((4096,), dtype=numpy.uint8)),
+        })
+    return {
+        "DataVersion": 2230,
+        "Level": {
+            "xPos": cx,
+            "zPos": cz,
+            "Status": "full",
+            "LastUpdate": 0,
+            "Biomes": numpy.ones((256,), dtype=numpy.int32),
+            "Sections": sections,
+            "Entities": [],
+            "TileEntities": [],
+        },
+    }
+
+
+def write_region(path, chunks, timestamp):
+    """Writes a region file. chunks maps the chunk coordinates within the
+    region to their compressed data"""
+    locations = [0] * 1024
+    sectors = []
+    offset = 2
+    for (x, z), data in sorted(chunks.items()):
+        data = struct.pack(">IB", len(data) + 1, 2) + data
+        data += b"\0" * (-len(data) % 4096)
+        locations[x + z * 32] = (offset << 8) | (len(data) // 4096)
+        offset += len(data) // 4096
+        sectors.append(data)
+    timestamps = [timestamp if loc else 0 for loc in locations]
+    with open(path, "wb") as f:
+        f.write(struct.pack(">1024I", *locations))
+        f.write(struct.pack(">1024I", *timestamps))
+        for data in sectors:
+            f.write(data)
+
+
+def generate_world(path, options):
+    """Generates a world in the directory path, which must not exist yet,
+    and returns a dictionary describing it"""
+    rnd = numpy.random.RandomState(options.seed)
+    palette = ["minecraft:air"] + get_palette_names(options.palette, rnd)
+    os.makedirs(os.path.join(path, "region"))
+    timestamp = int(time.time())
+
+    with gzip.open(os.path.join(path, "level.dat"), "wb") as f:
+        f.write(_nbt_tag("", {"Data": {
+            "version": 19133, "DataVersion": 2230, "LevelName": "Benchmark %d" % options.seed,
+            "SpawnX": 0, "SpawnY": 64, "SpawnZ": 0, "LastPlayed": 0}}))
+
+    regions = {}
+    corrupt = 0
+    for cx in range(options.chunks):
+        for cz in range(options.chunks):
+            data = zlib.compress(_nbt_tag("", make_chunk(cx, cz, options, palette, rnd)))
+            if rnd.random_sample() < options.corruption:
+                data = rnd.bytes(len(data))
+                corrupt += 1
+            regions.setdefault((cx // 32, cz // 32), {})[cx % 32, cz % 32] = data
+    for (rx, rz), chunks in regions.items():
+        write_region(os.path.join(path, "region", "r.%d.%d.mca" % (rx, rz)), chunks, timestamp)
+
+    return {"path": path, "chunks": options.chunks ** 2, "corrupt": corrupt,
+            "palette": palette[1:]}
+
+
+##
+## Textures
+##
+
+class SyntheticTextures(textures.Textures):
+    """Textures made of plain coloured blocks, so the benchmark doesn't
+    need a Minecraft jar. Every block and data value gets one of a few
+    sprites, like the real textures where many share an image."""
+    def load_grass_color(self):
+        if not hasattr(self, "grasscolor"):
+            self.grasscolor = list(Image.new("RGB", (256, 256), (120, 180, 80)).getdata())
+        return self.grasscolor
+
+    def load_foliage_color(self):
+        if not hasattr(self, "foliagecolor"):
+            self.foliagecolor = list(Image.new("RGB", (256, 256), (90, 160, 60)).getdata())
+        return self.foliagecolor
+
+    def load_water_color(self):
+        if not hasattr(self, "watercolor"):
+            self.watercolor = list(Image.new("RGB", (256, 256), (60, 90, 200)).getdata())
+        return self.watercolor
+
+    def load_light_color(self):
+        if not hasattr(self, "lightcolor"):
+            self.lightcolor = [(i, i, min(255, i + 20)) for i in range(256)]
+        return self.lightcolor
+
+    def generate(self):
+        rnd = numpy.random.RandomState(0)
+        sprites = []
+        for i in range(32):
+            top, side = [Image.new("RGBA", (16, 16), tuple(int(c) for c in rnd.randint(40, 255, 3)))
+                         for j in range(2)]
+            sprites.append(self.generate_texture_tuple(self.build_block(top, side)))
+
+        self.biome_grass_texture = sprites[0][0]
+        self.blockmap = [None] * textures.max_blockid * textures.max_data
+        for i, (blockid, data) in enumerate(sorted(textures.blockmap_generators)):
+            self.blockmap[blockid * textures.max_data + data] = sprites[i % len(sprites)]
+        self.build_atlas()
+        self.generated = True
+
+
+def get_textures(texturepath):
+    if texturepath:
+        tex = textures.Textures(texturepath=texturepath)
+    else:
+        tex = SyntheticTextures()
+    tex.generate()
+    return tex
+
+
+##
+## The benchmarks
+##
+
+class PreloadedRegionSet(object):
+    """Hands out chunks decoded beforehand, so the render loop can be timed
+    on its own"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def get_chunk(self, x, z):
+        try:
+            return self.chunks[x, z]
+        except KeyError:
+            raise world.ChunkDoesntExist("Chunk %s,%s doesn't exist" % (x, z))
+
+
+class _Assets(object):
+    """Stands in for the AssetManager of a first render"""
+    def get_tileset_config(self, name):
+        return {}
+
+
+def timeit(func, repeat):
+    """Runs func repeat times and returns the wall times of the runs, and
+    the number of items it reports having done"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        items = func()
+        times.append(time.perf_counter() - start)
+    return times, items
+
+
+def result(times, items, unit, **extra):
+    best = min(times)
+    d = {"unit": unit, "items": items, "times": times, "best": best,
+         "median": statistics.median(times), "per_item": best / items if items else None}
+    d.update(extra)
+    return d
+
+
+def open_regionset(worlddir, quarantine):
+    return world.World(worlddir, quarantine=quarantine).get_regionset(None)
+
+
+def bench_scan(worlddir, quarantine):
+    def run():
+        return len(list(open_regionset(worlddir, quarantine).iterate_chunks()))
+    return run
+
+
+def bench_get_chunk(worlddir, quarantine):
+    def run():
+        rset = open_regionset(worlddir, quarantine)
+        n = 0
+        for x, z, mtime in rset.iterate_chunks():
+            try:
+                rset.get_chunk(x, z)
+                n += 1
+            except (world.ChunkDoesntExist, nbt.CorruptionError):
+                pass
+        return n
+    return run
+
+
+def load_chunks(worlddir, quarantine):
+    """Returns all the readable chunks of the world, decoded, and how many
+    blocks that aren't air they have"""
+    rset = open_regionset(worlddir, quarantine)
+    chunks = {}
+    blocks = 0
+    for x, z, mtime in rset.iterate_chunks():
+        try:
+            chunks[x, z] = rset.get_chunk(x, z)
+        except (world.ChunkDoesntExist, nbt.CorruptionError):
+            continue
+        for section in chunks[x, z]["Sections"]:
+            blocks += int(numpy.count_nonzero(section["Blocks"]))
+    return chunks, blocks
+
+
+def bench_render_loop(worldobj, chunks, rendermode, tex, images):
+    """Draws each chunk on an image of its own, big enough for all of it.
+    The images are kept in images, for the compositing and encoding
+    benchmarks"""
+    rset = PreloadedRegionSet(chunks)
+
+    def run():
+        del images[:]
+        for (x, z), chunk in sorted(chunks.items()):
+            top = max([section["Y"] for section in chunk["Sections"]] or [0])
+            # each section is 192 pixels high, plus 192 for the top face
+            img = Image.new("RGBA", (384, (top + 2) * 192), tex.bgcolor)
+            for section in chunk["Sections"]:
+                c_overviewer.render_loop(worldobj, rset, x, section["Y"], z, img, 0,
+                                         (top - section["Y"]) * 192, rendermode, tex)
+            images.append(img)
+        return len(chunks)
+    return run
+
+
+def get_profile(rendermode, blocks):
+    """Returns the counters of the primitives of a rendermode made by
+    create_rendermode, and resets them. blocks is the number of blocks
+    drawn since the last reset. Returns None if the C extension was built
+    without them (see setup.py)"""
+    profile = c_overviewer.rendermode_profile(rendermode, True)
+    if profile is None:
+        return None
+    result = []
+    for name, occluded_calls, occluded_ticks, draw_calls, draw_ticks in profile:
+        ticks = occluded_ticks + draw_ticks
+        result.append({"primitive": name,
+                       "occluded_calls": occluded_calls, "occluded_ticks": occluded_ticks,
+                       "draw_calls": draw_calls, "draw_ticks": draw_ticks,
+                       "ticks_per_block": ticks / blocks if blocks else None})
+    return result
+
+
+# the drawing functions the render loop spends its time in, and what to
+# draw with them: a block's top face for the triangles, like smooth lighting
+PRIMITIVES = ["alpha_over", "tint_with_mask", "draw_triangle", "resize_half"]
+TRIANGLE = (0, 6, 12, 0, 24, 6)
+
+
+def bench_primitive(name, tex, tile):
+    """Returns a function that runs one of the C drawing functions many
+    times, on a block sprite (or for resize_half, a tile), and the number
+    of pixels it goes over each time"""
+    sprite, mask = [t for t in tex.blockmap if isinstance(t, tuple)][0]
+    dest = Image.new("RGBA", (384, 384), tex.bgcolor)
+    if name == "alpha_over":
+        arg, pixels = sprite, sprite.size[0] * sprite.size[1]
+    elif name == "tint_with_mask":
+        arg, pixels = mask, mask.size[0] * mask.size[1]
+    elif name == "draw_triangle":
+        # it goes over the whole bounding box of the triangle
+        arg = TRIANGLE
+        pixels = ((max(TRIANGLE[0::2]) - min(TRIANGLE[0::2]) + 1) *
+                  (max(TRIANGLE[1::2]) - min(TRIANGLE[1::2]) + 1))
+    else:
+        dest = Image.new("RGBA", (192, 192), tex.bgcolor)
+        arg, pixels = tile, tile.size[0] * tile.size[1]
+    # a few nanoseconds a pixel, so around a tenth of a second each
+    iterations = max(1, 25000000 // pixels)
+
+    def run():
+        c_overviewer.repeat_primitive(name, iterations, dest, arg)
+        return iterations * pixels
+    return run
+
+
+def crop_tile(img):
+    """Returns a tile sized part of a chunk image, from the top of what was
+    drawn"""
+    bbox = img.getbbox() or (0, 0, 384, 384)
+    top = min(bbox[1], img.size[1] - 384)
+    return img.crop((0, top, 384, top + 384))
+
+
+def bench_composite(tiles, count, bgcolor):
+    """Builds count composite tiles from four of the given encoded tiles
+    each, the way TileSet._render_compositetile() does"""
+    def run():
+        for i in range(count):
+            img = Image.new("RGBA", (384, 384), bgcolor)
+            for j, pos in enumerate([(0, 0), (192, 0), (0, 192), (192, 192)]):
+                src = Image.open(io.BytesIO(tiles[(i * 4 + j) % len(tiles)]))
+                src.load()
+                quad = Image.new("RGBA", (192, 192), bgcolor)
+                resize_half(quad, src)
+                img.paste(quad, pos)
+        return count
+    return run
+
+
+def encode(img, imgformat):
+    out = io.BytesIO()
+    if imgformat == "jpg":
+        img.convert("RGB").save(out, "jpeg", quality=95, subsampling=0)
+    else:
+        img.save(out, imgformat)
+    return out.getvalue()
+
+
+def bench_encode(images, imgformat):
+    def run():
+        for img in images:
+            encode(img, imgformat)
+        return len(images)
+    return run
+
+
+def bench_render(worlddir, tex, modes, processes, outputdir):
+    """Does a whole render of all the given rendermodes, in one go like
+    overviewer.py does with sharerenders"""
+    def run():
+        shutil.rmtree(outputdir, True)
+        os.makedirs(outputdir)
+        quarantine = world.ChunkQuarantine(os.path.join(outputdir, ".corruptchunks"))
+        w = world.World(worlddir, quarantine=quarantine)
+        rset = world.CachedRegionSet(w.get_regionset(None), [cache.LRUCache(size=100)])
+        tilesets = []
+        for name, mode in modes:
+            opts = {"name": name, "bgcolor": tex.bgcolor, "imgformat": "png",
+                    "optimizeimg": 0, "rendermode": mode, "rerenderprob": 0,
+                    "renderchecks": 2, "imgquality": 95, "imglossless": True}
+            tilesets.append(tileset.TileSet(w, rset, _Assets(), tex, opts,
+                                            os.path.join(outputdir, name)))
+        for ts in tilesets:
+            ts.do_preprocessing()
+        tileset.share_renders(tilesets)
+
+        if processes == 1:
+            dispatch = dispatcher.Dispatcher()
+        else:
+            tex.share()
+            dispatch = dispatcher.MultiprocessingDispatcher(local_procs=processes)
+        try:
+            dispatch.render_all(tilesets, observer.Observer())
+        finally:
+            # closing the dispatcher is left out of the timings, it waits
+            # for the workers to shut down
+            end = time.perf_counter()
+            dispatch.close()
+            tex.unshare()
+        return end, sum(len(files) for _, _, files in os.walk(outputdir))
+
+    def timed():
+        start = time.perf_counter()
+        end, tiles = run()
+        return end - start, tiles
+    return timed
+
+
+def format_time(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e3), ("us", 1e6)]:
+        if seconds * scale >= 1:
+            return "%.2f%s" % (seconds * scale, unit)
+    return "%.1fns" % (seconds * 1e9)
+
+
+def run_benchmarks(options, worldinfo, log=print):
+    """Runs the benchmarks selected in options on the generated world
+    described by worldinfo, and returns the results as a dictionary"""
+    worlddir = worldinfo["path"]
+    workdir = tempfile.mkdtemp(prefix="overviewer-benchmark-")
+    results = {}
+
+    def record(name, times, items, unit, **extra):
+        results[name] = result(times, items, unit, **extra)
+        log("%-28s %10.4fs best %10.4fs median %12s/%s" % (
+            name, results[name]["best"], results[name]["median"],
+            format_time(results[name]["per_item"] or 0), unit))
+
+    try:
+        # corrupt chunks are retried a few times before they're given up on
+        # and quarantined, so the first read of the world pays for them
+        quarantine = world.ChunkQuarantine(os.path.join(workdir, ".corruptchunks"))
+        if "scan" in options.stages:
+            record("scan", *timeit(bench_scan(worlddir, quarantine), options.repeat), "chunk")
+        if "get_chunk" in options.stages:
+            record("get_chunk", *timeit(bench_get_chunk(worlddir, quarantine), options.repeat),
+                   "chunk")
+
+        tex = get_textures(options.texturepath)
+        modes = [(name, getattr(rendermodes, name)) for name in options.rendermodes]
+        images = []
+        if set(options.stages) & set(["render_loop", "composite", "encode"]):
+            worldobj = world.World(worlddir, quarantine=quarantine)
+            chunks, blocks = load_chunks(worlddir, quarantine)
+            for name, mode in modes:
+                if "render_loop" not in options.stages and images:
+                    break
+                rendermode = c_overviewer.create_rendermode(mode, worldobj, tex)
+                times, n = timeit(bench_render_loop(worldobj, chunks, rendermode, tex, images),
+                                  options.repeat)
+                if "render_loop" not in options.stages:
+                    continue
+                profile = get_profile(rendermode, blocks * options.repeat)
+                record("render_loop/%s" % name, times, n, "chunk", blocks=blocks,
+                       per_block=min(times) / blocks if blocks else None, profile=profile,
+                       profile_unit=getattr(c_overviewer, "profile_unit", None))
+                log("%-28s %46s/block" % ("", format_time(results["render_loop/%s" % name]
+                                                          ["per_block"] or 0)))
+                for prim in profile or []:
+                    log("    %-24s %10d occluded %10d drawn %10.1f %s/block" % (
+                        prim["primitive"], prim["occluded_calls"], prim["draw_calls"],
+                        prim["ticks_per_block"] or 0, c_overviewer.profile_unit))
+
+        images = [crop_tile(img) for img in images]
+        if "primitives" in options.stages:
+            tile = images[0] if images else Image.new("RGBA", (384, 384), tex.bgcolor)
+            for name in PRIMITIVES:
+                record("primitive/%s" % name,
+                       *timeit(bench_primitive(name, tex, tile), options.repeat), "pixel")
+        if images and "composite" in options.stages:
+            tiles = [encode(img, "png") for img in images]
+            record("composite", *timeit(bench_composite(tiles, len(tiles), tex.bgcolor),
+                                        options.repeat), "tile")
+        if images and "encode" in options.stages:
+            for imgformat in options.formats:
+                record("encode/%s" % imgformat,
+                       *timeit(bench_encode(images, imgformat), options.repeat), "tile")
+
+        if "render" in options.stages:
+            for processes in options.processes:
+                render = bench_render(worlddir, tex, modes, processes,
+                                      os.path.join(workdir, "output"))
+                runs = [render() for i in range(options.repeat)]
+                record("render/p%d" % processes, [t for t, _ in runs], runs[-1][1], "tile",
+                       processes=processes)
+    finally:
+        shutil.rmtree(workdir, True)
+    return results
+
+
+def get_environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": multiprocessing.cpu_count(),
+        "numpy": numpy.__version__,
+        "pillow": PIL.__version__,
+        "extension_version": c_overviewer.extension_version(),
+        "commit": util.findGitHash(),
+    }
+
+
+def compare(old, new, log=print):
+    """Prints how the best times of the results in common changed"""
+    if old.get("format") != new.get("format"):
+        log("The results are from different versions of the benchmark, "
+            "they can't be compared.")
+        return
+    if old.get("world") != new.get("world"):
+        log("Warning: the results are for different worlds.")
+    for name, res in sorted(new["results"].items()):
+        if name in old["results"]:
+            before = old["results"][name]["best"]
+            log("%-28s %10.4fs -> %10.4fs  %+7.1f%%" % (
+                name, before, res["best"], (res["best"] - before) / before * 100))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=8,
+                        help="generate a world of N by N chunks [default: 8]")
+    parser.add_argument("--sections", type=int, default=4,
+                        help="number of 16 block high sections in each chunk [default: 4]")
+    parser.add_argument("--density", type=float, default=0.5,
+                        help="how much of the height the terrain fills, 0 to 1 [default: 0.5]")
+    parser.add_argument("--palette", type=int, default=16,
+                        help="number of different blocks in each section [default: 16]")
+    parser.add_argument("--corruption", type=float, default=0.0,
+                        help="fraction of the chunks that are corrupt [default: 0]")
+    parser.add_argument("--seed", type=int, default=0, help="random seed [default: 0]")
+    parser.add_argument("--world", metavar="DIR",
+                        help="keep the generated world in DIR, and use the one there if it "
+                        "already exists")
+    parser.add_argument("--texturepath", metavar="PATH",
+                        help="use these textures instead of plain coloured blocks")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated list of things to time [default: %(default)s]")
+    parser.add_argument("--rendermodes", default="normal,lighting,smooth_lighting",
+                        help="comma separated list of rendermodes [default: %(default)s]")
+    parser.add_argument("--formats", default="png,jpg",
+                        help="comma separated list of image formats to encode [default: "
+                        "%(default)s]")
+    parser.add_argument("-p", "--processes", default="1,2,4",
+                        help="comma separated list of process counts for the whole renders "
+                        "[default: %(default)s]")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="number of times to run each benchmark [default: 3]")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare the results to the ones in FILE")
+    options = parser.parse_args(args)
+
+    options.stages = options.stages.split(",")
+    options.rendermodes = options.rendermodes.split(",")
+    options.formats = options.formats.split(",")
+    options.processes = [int(p) for p in options.processes.split(",")]
+    for stage in options.stages:
+        if stage not in STAGES:
+            parser.error("Unknown stage %r, choose from %s" % (stage, ", ".join(STAGES)))
+    for name in options.rendermodes:
+        if not isinstance(getattr(rendermodes, name, None), list):
+            parser.error("Unknown rendermode %r" % name)
+    if not 0 <= options.density <= 1 or not 0 <= options.corruption <= 1:
+        parser.error("--density and --corruption must be between 0 and 1")
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    params = dict((k, getattr(options, k))
+                  for k in ["chunks", "sections", "density", "palette", "corruption", "seed"])
+    tmpdir = None
+    worlddir = options.world
+    if worlddir is None:
+        tmpdir = tempfile.mkdtemp(prefix="overviewer-benchmark-world-")
+        worlddir = os.path.join(tmpdir, "world")
+    paramsfile = os.path.join(worlddir, "benchmark.json")
+    try:
+        if os.path.exists(paramsfile):
+            with open(paramsfile) as f:
+                worldinfo = json.load(f)
+            if worldinfo["params"] != params:
+                parser.error("The world in %s was generated with different options: %r" %
+                             (worlddir, worldinfo["params"]))
+            print("Using the world in %s" % worlddir)
+        else:
+            print("Generating a world of %d chunks..." % options.chunks ** 2)
+            worldinfo = generate_world(worlddir, options)
+            worldinfo["params"] = params
+            with open(paramsfile, "w") as f:
+                json.dump(worldinfo, f)
+        worldinfo["path"] = worlddir
+
+        results = run_benchmarks(options, worldinfo)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, True)
+
+    data = {
+        "format": FORMAT,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": get_environment(),
+        "world": worldinfo["params"],
+        "texturepath": options.texturepath,
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(data, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), data)
+    return data
+
+
+if __name__ == "__main__":
+    main()
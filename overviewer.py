@@ -40,7 +40,7 @@ from overviewer_core import logger
 from overviewer_core import textures
 from overviewer_core import optimizeimages, world
 from overviewer_core import config_parser, tileset, assetmanager, dispatcher
-from overviewer_core import cache
+from overviewer_core import cache, metrics
 from overviewer_core import observer
 from overviewer_core.nbt import CorruptNBTError
 
@@ -124,6 +124,9 @@ def main():
     parser.add_argument("--update-web-assets", dest='update_web_assets', action="store_true",
                         help="Update web assets. Will *not* render tiles or update "
                         "overviewerConfig.js.")
+    parser.add_argument("--trace", dest="trace", action="store", metavar="FILE",
+                        help="Write a timeline of the render to FILE, in the Chrome trace "
+                        "format. Open it in chrome://tracing or https://ui.perfetto.dev/.")
 
     # Log level options:
     parser.add_argument("-q", "--quiet", dest="quiet", action="count", default=0,
@@ -463,10 +466,34 @@ def main():
 
     tilesets = []
 
+    # the observer may report the metrics of the workers too
+    wantmetrics = config['rendermetrics']
+    if getattr(config['observer'], "wants_metrics", None) and config['observer'].wants_metrics():
+        wantmetrics = True
+
     # saves us from creating the same World object over and over again
     worldcache = {}
+    # where the worlds keep their directory listings between runs, if they do
+    listingcache = None
+    if config['worldlistingcache']:
+        listingcache = os.path.join(destdir, ".worldlisting.json")
+    # and the chunks found to be corrupt, so they aren't retried every time
+    quarantine = None
+    quarantinefile = os.path.join(destdir, ".corruptchunks")
+    if config['chunkquarantine']:
+        quarantine = world.ChunkQuarantine(quarantinefile)
+        quarantine.prune()
+    elif os.path.exists(quarantinefile):
+        logging.debug("Removing the list of corrupt chunks, %s.", quarantinefile)
+        os.remove(quarantinefile)
     # same for textures
     texcache = {}
+    # and regionsets, see below
+    rsetcache = {}
+    # and where generated textures are kept between runs
+    texcachedir = config.get('texturecache')
+    if texcachedir is None:
+        texcachedir = os.path.join(destdir, ".texturecache")
 
     # Set up the cache objects to use
     caches = []
@@ -482,7 +509,8 @@ def main():
             w = worldcache[render['world']]
         except KeyError:
             try:
-                w = world.World(render['world'])
+                w = world.World(render['world'], listingcache=listingcache,
+                                quarantine=quarantine)
             except CorruptNBTError as e:
                 logging.error("Failed to open world %r.", render['world'])
                 raise e
@@ -497,7 +525,9 @@ def main():
         texopts = util.dict_subset(render, ["texturepath", "bgcolor", "northdirection"])
         texopts_key = tuple(texopts.items())
         if texopts_key not in texcache:
-            tex = textures.Textures(**texopts)
+            tex = textures.Textures(cachedir=texcachedir or None,
+                                    lazy=config['lazytextures'] or config['texturepreflight'],
+                                    preflight=config['texturepreflight'], **texopts)
             logging.info("Generating textures...")
             tex.generate()
             logging.debug("Finished generating textures.")
@@ -522,8 +552,9 @@ def main():
 
         # Insert a layer of caching above the real regionset. Any world
         # tranformations will pull from this cache, but their results will not
-        # be cached by this layer. This uses a common pool of caches; each
-        # regionset cache pulls from the same underlying cache object.
+        # be cached by this layer (RotatedRegionSet keeps its own cache of
+        # rotated chunks). This uses a common pool of caches; each regionset
+        # cache pulls from the same underlying cache object.
         rset = world.CachedRegionSet(rset, caches)
 
         # If a crop is requested, wrap the regionset here
@@ -543,6 +574,13 @@ def main():
                 newrsets.append(r)
             rsets = newrsets
 
+        # Renders of the same world and dimension, with the same crop and
+        # rotation, share one regionset object so they can be rendered
+        # together (see tileset.share_renders)
+        for i, zone in enumerate(render.get('crop', [None])):
+            key = (render['world'], render['dimension'][1], zone, render['northdirection'])
+            rsets[i] = rsetcache.setdefault(key, rsets[i])
+
         ###############################
         # Do the final prep and create the TileSet object
 
@@ -557,6 +595,7 @@ def main():
             "dimension", "changelist", "showspawn", "overlay", "base", "poititle", "maxzoom",
             "showlocationmarker", "minzoom", "center"])
         tileSetOpts.update({"spawn": w.find_true_spawn()})  # TODO find a better way to do this
+        tileSetOpts.update({"metrics": wantmetrics, "trace": bool(args.trace)})
         for rset in rsets:
             tset = tileset.TileSet(w, rset, assetMrg, tex, tileSetOpts, tileset_dir)
             tilesets.append(tset)
@@ -571,17 +610,54 @@ def main():
     for ts in tilesets:
         ts.do_preprocessing()
 
-    # Output initial static data and configuration
-    assetMrg.initialize(tilesets)
+    if config['sharerenders']:
+        tileset.share_renders(tilesets)
 
-    # multiprocessing dispatcher
-    if config['processes'] == 1:
-        dispatch = dispatcher.Dispatcher()
-    else:
-        dispatch = dispatcher.MultiprocessingDispatcher(
-            local_procs=config['processes'])
-    dispatch.render_all(tilesets, config['observer'])
-    dispatch.close()
+    # the shared textures, the trace and the observer must be released even
+    # if the render fails or is interrupted
+    tracewriter = None
+    try:
+        for tex in texcache.values():
+            if tex.preflight:
+                # make the blocks the chunk scans found, the rest are made on
+                # demand while rendering
+                blockids = set()
+                for ts in tilesets:
+                    if ts.textures is tex:
+                        blockids.update(getattr(ts, 'seen_blockids', ()))
+                logging.info("Generating textures for %d blocks...", len(blockids))
+                tex.pregenerate(blockids, config['processes'])
+            if config['processes'] != 1 and config['sharetextures']:
+                # let the worker processes map these instead of regenerating
+                tex.share()
+
+        # Output initial static data and configuration
+        assetMrg.initialize(tilesets)
+
+        if config['rendermetrics']:
+            collector = metrics.MetricsCollector()
+            collector.register()
+        if args.trace:
+            metrics.enable_tracing()
+            tracewriter = metrics.TraceWriter(args.trace)
+            tracewriter.register()
+
+        # multiprocessing dispatcher
+        if config['processes'] == 1:
+            dispatch = dispatcher.Dispatcher()
+        else:
+            dispatch = dispatcher.MultiprocessingDispatcher(
+                local_procs=config['processes'])
+        dispatch.render_all(tilesets, config['observer'])
+        dispatch.close()
+    finally:
+        if tracewriter:
+            tracewriter.close()
+            logging.info("Wrote a trace of the render to %s", args.trace)
+        for tex in texcache.values():
+            tex.unshare()
+        if getattr(config['observer'], "close", None):
+            config['observer'].close()
 
     assetMrg.finalize(tilesets)
 
@@ -593,6 +669,9 @@ def main():
         logging.debug("Final cache stats:")
         for c in caches:
             logging.debug("\t%s: %s hits, %s misses", c.__class__.__name__, c.hits, c.misses)
+    if config['rendermetrics']:
+        collector.log_summary()
+        collector.save(os.path.join(destdir, "rendermetrics.json"))
     if args.pid:
         os.remove(args.pid)
 
@@ -9,16 +9,22 @@ POI/marker info.
 A markerSet is list of POIs to display on a tileset.  It has a display name,
 and a group name.
 
-markersDB.js holds a list of POIs in each group
+markersDB.js holds an index of the groups of POIs, and which marker tiles each
+has POIs in
+markers/r.X.Z.js holds the POIs of each group in the region X,Z, and is loaded
+by the map once that region comes into view
 markers.js holds a list of which markerSets are attached to each tileSet
 
 
 '''
 import datetime
 import gzip
+import hashlib
+import inspect
 import itertools
 import json
 import logging
+import math
 import multiprocessing
 import os
 import re
@@ -27,6 +33,7 @@ import time
 import urllib.request
 import urllib.error
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from multiprocessing import Pool
 from argparse import ArgumentParser
@@ -89,12 +96,14 @@ def jsonText(s):
 
 
 # Since functions are not pickleable, we send their names instead.
-# Here, set up worker processes to have a name -> function map
+# Here, set up worker processes to have a name -> function map, and the
+# regionsets to scan, which the tasks refer to by index
 bucketChunkFuncs = {}
+bucketRegionSets = []
 
 
-def initBucketChunks(config_path):
-    global bucketChunkFuncs
+def initBucketChunks(config_path, rsets):
+    global bucketChunkFuncs, bucketRegionSets
 
     mw_parser = config_parser.MultiWorldParser()
     mw_parser.parse(config_path)
@@ -104,48 +113,94 @@ def initBucketChunks(config_path):
         for f in render['markers']:
             ff = f['filterFunction']
             bucketChunkFuncs[ff.__name__] = ff
+    bucketRegionSets = rsets
 
 
-# yes there's a double parenthesis here
-# see below for when this is called, and why we do this
-# a smarter way would be functools.partial, but that's broken on python 2.6
-# when used with multiprocessing
-# TODO: Do the smarter way
-def parseBucketChunks(task_tuple):
-    global bucketChunkFuncs
+class FilterIndex(object):
+    """
+    The filters to run over the POIs of a regionset, looked up by POI id.
 
-    bucket, rset, filters = task_tuple
-    pid = multiprocessing.current_process().pid
-    markers = defaultdict(list)
+    Each filter is (name, filter function, ids, crops). ids is a collection
+    of the POI ids the filter wants to see, or None for all of them. crops
+    is a list of (xmin, zmin, xmax, zmax) chunk boxes the POIs must be in,
+    or None for the whole regionset.
+    """
+    def __init__(self, filters):
+        self.filters = filters
+        self.anyid = []
+        self.byid = {}
+        for f in filters:
+            if f[2] is None:
+                self.anyid.append(f)
+        for f in filters:
+            if f[2] is not None:
+                for poiid in f[2]:
+                    self.byid.setdefault(poiid, list(self.anyid)).append(f)
+
+    def get_filters(self, poiid):
+        return self.byid.get(poiid, self.anyid)
+
+
+def poiChunk(poi):
+    """Returns the coordinates of the chunk a POI is in"""
+    if 'Pos' in poi:
+        x, z = poi['Pos'][0], poi['Pos'][2]
+    else:
+        x, z = poi['x'], poi['z']
+    return int(math.floor(x)) // 16, int(math.floor(z)) // 16
 
-    i = 0
-    cnt = 0
-    for b in bucket:
-        try:
-            data = rset.get_chunk(b[0], b[1])
-            for poi in itertools.chain(data.get('TileEntities', []), data.get('Entities', [])):
-                if poi['id'] == 'Sign' or poi['id'] == 'minecraft:sign':
-                    poi = signWrangler(poi)
-                for name, filter_function in filters:
-                    ff = bucketChunkFuncs[filter_function]
-                    result = ff(poi)
-                    if result:
-                        d = create_marker_from_filter_result(poi, result)
-                        markers[name].append(d)
-        except nbt.CorruptChunkError:
-            logging.warning("Ignoring POIs in corrupt chunk %d,%d.", b[0], b[1])
-        except world.ChunkDoesntExist:
-            pass
 
-        # Perhaps only on verbose ?
-        i = i + 1
-        if i == 250:
-            i = 0
-            cnt = 250 + cnt
-            logging.info("Found %d markers in thread %d so far at %d chunks.",
-                         sum(len(v) for v in markers.values()), pid, cnt)
+def parseChunk(rset, x, z, filterindex):
+    """
+    Runs the filters of the given FilterIndex over the POIs in a chunk.
+
+    Returns a dict mapping the names of the filters that found something to
+    the lists of markers they made, or None if the chunk is corrupt.
+    """
+    try:
+        data = rset.get_chunk_entities(x, z)
+    except nbt.CorruptChunkError:
+        logging.warning("Ignoring POIs in corrupt chunk %d,%d.", x, z)
+        return None
+    except world.ChunkDoesntExist:
+        # iterate_chunks() doesn't inspect chunks and filter out
+        # placeholder ones. It's okay for this chunk to not exist.
+        return {}
+
+    found = {}
+    for poi in itertools.chain(data.get('TileEntities', []), data.get('Entities', [])):
+        filters = filterindex.get_filters(poi['id'])
+        if not filters:
+            continue
+        if poi['id'] == 'Sign' or poi['id'] == 'minecraft:sign':    # kill me
+            poi = signWrangler(poi)
+        chunk = None
+        for name, filter_function, __, crops in filters:
+            if crops is not None:
+                if chunk is None:
+                    chunk = poiChunk(poi)
+                if not world.in_bounds(chunk[0], chunk[1], crops):
+                    continue
+            result = filter_function(poi)
+            if result:
+                d = create_marker_from_filter_result(poi, result)
+                found.setdefault(name, []).append(d)
+    return found
+
 
-    return markers
+def parseRegionChunks(task):
+    """
+    Runs in a worker process: parses the given chunks of one region.
+
+    task is (index, rsetindex, filters, chunks), with the filter functions
+    given by name. Returns the index along with a list of (x, z, mtime,
+    markers) for the chunks, see parseChunk().
+    """
+    index, rsetindex, filters, chunks = task
+    rset = bucketRegionSets[rsetindex]
+    filterindex = FilterIndex([(name, bucketChunkFuncs[filter_function], ids, crops)
+                               for name, filter_function, ids, crops in filters])
+    return index, [(x, z, mtime, parseChunk(rset, x, z, filterindex)) for x, z, mtime in chunks]
 
 
 def signWrangler(poi):
@@ -157,72 +212,308 @@ def signWrangler(poi):
     return poi
 
 
-def handleEntities(rset, config, config_path, filters, markers):
+def filterHash(filter_function):
+    """
+    Returns a hash of a filter function's source, to tell whether the markers
+    it made on an earlier run can still be used.
+    """
+    try:
+        source = inspect.getsource(filter_function)
+    except (OSError, TypeError):
+        # no source to be found, so go by its bytecode instead
+        code = filter_function.__code__
+        source = repr((code.co_code, code.co_consts, code.co_names))
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+def shortHash(*values):
+    """
+    Returns four hex digits hashed from the given values, unlike hash() the
+    same in every process.
+    """
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[-4:]
+
+
+class MarkerCache(object):
+    """
+    Keeps the markers found in each chunk between genPOI runs, so that only
+    the chunks changed since then have to be read again.
+
+    The chunks are kept per regionset and set of filters. A chunk's markers
+    are used as long as its timestamp hasn't changed, and neither has the
+    source of any of the filters.
+    """
+    def __init__(self, outputdir):
+        self.outputdir = outputdir
+        self.cache_file = os.path.join(outputdir, "poicache.dat")
+        # what was loaded, and what will be saved: only the regionsets and
+        # filters used on this run are kept
+        self.old = {}
+        self.new = {}
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with closing(gzip.GzipFile(self.cache_file)) as gz:
+                self.old = json.loads(gz.read().decode("utf-8"))
+            logging.info("Loaded the POI cache from %r.", self.cache_file)
+        except (ValueError, IOError, EOFError):
+            logging.warning("Failed to load the POI cache -- it might be corrupt. "
+                            "Scanning every chunk.")
+            self.old = {}
+
+    def save(self):
+        caps = get_fs_caps(self.outputdir)
+        with FileReplacer(self.cache_file, caps) as cache_file_name:
+            with closing(gzip.GzipFile(cache_file_name, "wb")) as gz:
+                gz.write(json.dumps(self.new, separators=(",", ":")).encode())
+        logging.info("Wrote the POI cache with %d chunks.",
+                     sum(len(chunks) for chunks in self.new.values()))
+
+    def get_chunks(self, rset, filters):
+        """
+        Returns the (old, new) dicts of cached chunks for the given regionset
+        and filters (as for FilterIndex). Both map "x,z" to [timestamp] or
+        [timestamp, {name: markers}]; chunks put in new are saved.
+        """
+        key = "%s|%s" % (rset.regiondir, hashlib.sha1(repr(sorted(
+            (name, filterHash(filter_function), sorted(ids) if ids is not None else None,
+             sorted(crops) if crops is not None else None)
+            for name, filter_function, ids, crops in filters)
+        ).encode("utf-8")).hexdigest())
+        return self.old.get(key, {}), self.new.setdefault(key, {})
+
+
+def groupEntityFilters(filters, filter_ids):
+    """
+    Groups the filters by the regionset they're for, so that each regionset
+    is only scanned once however many renders and crops use it. Crops are
+    applied to each POI instead.
+
+    filter_ids maps filter names to the POI ids they want to see, for those
+    that said. Returns a list of (rset, filters) pairs for handleEntities(),
+    with the filters as for FilterIndex.
+    """
+    groups = {}
+    for name, __, filter_function, rset, __, __ in filters:
+        crop = None
+        if isinstance(rset, world.CroppedRegionSet):
+            crop = (rset.xmin, rset.zmin, rset.xmax, rset.zmax)
+            rset = rset._r
+        group = groups.setdefault(rset, {})
+        if name not in group:
+            group[name] = [filter_function, filter_ids.get(name), []]
+        if crop is None:
+            group[name][2] = None
+        elif group[name][2] is not None:
+            group[name][2].append(crop)
+    # the filters come in a set, so sort the crops to have them in the same
+    # order (and the same cache key) every time
+    return [(rset, [(name, ff, ids, sorted(crops) if crops is not None else None)
+                    for name, (ff, ids, crops) in sorted(group.items())])
+            for rset, group in groups.items()]
+
+
+def handleEntities(groups, config, config_path, markers, cache=None, observer=None):
     """
     Add markers for Entities or TileEntities.
 
-    For this every chunk of the regionset is parsed and filtered using multiple
-    processes, if so configured.
+    groups is a list of (rset, filters) pairs, see groupEntityFilters(). For
+    this every chunk of each regionset that's inside a crop of one of its
+    filters is parsed and filtered, a region at a time, using one pool of
+    multiple processes for all of them, if so configured. If a MarkerCache
+    is given, the chunks that haven't changed since it was saved aren't
+    parsed again. Progress is reported to the observer, if given.
     This function will not return anything, but it will update the parameter
     `markers`.
     """
-    logging.info("Looking for entities in %r...", rset)
-
-    numbuckets = config['processes']
-    if numbuckets < 0:
-        numbuckets = multiprocessing.cpu_count()
-
-    if numbuckets == 1:
-        for (x, z, mtime) in rset.iterate_chunks():
-            try:
-                data = rset.get_chunk(x, z)
-                for poi in itertools.chain(data.get('TileEntities', []), data.get('Entities', [])):
-                    if poi['id'] == 'Sign' or poi['id'] == 'minecraft:sign':    # kill me
-                        poi = signWrangler(poi)
-                    for name, __, filter_function, __, __, __ in filters:
-                        result = filter_function(poi)
-                        if result:
-                            d = create_marker_from_filter_result(poi, result)
-                            markers[name]['raw'].append(d)
-            except nbt.CorruptChunkError:
-                logging.warning("Ignoring POIs in corrupt chunk %d,%d.", x, z)
-            except world.ChunkDoesntExist:
-                # iterate_chunks() doesn't inspect chunks and filter out
-                # placeholder ones. It's okay for this chunk to not exist.
-                pass
+    numprocs = config['processes']
+    if numprocs < 0:
+        numprocs = multiprocessing.cpu_count()
+
+    # one task for each region with chunks to parse, as (rsetindex, filters,
+    # newchunks, chunks)
+    tasks = []
+    # every region with chunks, as (newchunks, chunks, taskindex): chunks are
+    # (x, z, mtime, found) with found None for those parsed by the task
+    allregions = []
+    rsets = []
+    ncached = 0
+    for rset, filters in groups:
+        logging.info("Looking for entities in %r...", rset)
+        if cache is not None:
+            oldchunks, newchunks = cache.get_chunks(rset, filters)
+        else:
+            oldchunks, newchunks = {}, {}
+
+        # only the chunks inside any of the crops need to be read
+        bounds = []
+        for __, __, __, crops in filters:
+            if crops is None:
+                bounds = None
+                break
+            bounds.extend(crops)
+
+        regions = defaultdict(list)
+        for (x, z, mtime) in rset.iterate_chunks(bounds):
+            cached = oldchunks.get("%d,%d" % (x, z))
+            if cached is not None and cached[0] == mtime:
+                found = cached[1] if len(cached) > 1 else {}
+                ncached += 1
+            else:
+                found = None
+            regions[(x // 32, z // 32)].append((x, z, mtime, found))
+
+        rsets.append(rset)
+        for region in sorted(regions):
+            chunks = regions[region]
+            toparse = [(x, z, mtime) for x, z, mtime, found in chunks if found is None]
+            if toparse:
+                allregions.append((newchunks, chunks, len(tasks)))
+                tasks.append((len(rsets) - 1, filters, newchunks, toparse))
+            else:
+                allregions.append((newchunks, chunks, None))
+
+    if cache is not None:
+        logging.info("%d chunks are unchanged since the last run, %d to scan.",
+                     ncached, sum(len(chunks) for __, __, __, chunks in tasks))
+
+    if observer is not None:
+        observer.start(len(tasks))
+    results = [None] * len(tasks)
+    if numprocs == 1 or len(tasks) <= 1:
+        filterindexes = {}
+        for i, (rsetindex, filters, __, chunks) in enumerate(tasks):
+            if rsetindex not in filterindexes:
+                filterindexes[rsetindex] = FilterIndex(filters)
+            results[i] = [(x, z, mtime, parseChunk(rsets[rsetindex], x, z,
+                                                   filterindexes[rsetindex]))
+                          for x, z, mtime in chunks]
+            if observer is not None:
+                observer.add(1)
     else:
-        buckets = [[] for i in range(numbuckets)]
+        # The workers get the regionsets once, up front, and the regions are
+        # handed out one at a time as they finish the previous ones, so one
+        # busy region doesn't hold everything up.
+        pool = Pool(processes=numprocs, initializer=initBucketChunks,
+                    initargs=(config_path, rsets))
+        try:
+            # simplify the filters, so pickle doesn't have to do so much
+            worktasks = ((i, rsetindex,
+                          [(name, ff.__name__, ids, crops) for name, ff, ids, crops in filters],
+                          chunks)
+                         for i, (rsetindex, filters, __, chunks) in enumerate(tasks))
+            for i, chunk_results in pool.imap_unordered(parseRegionChunks, worktasks):
+                results[i] = chunk_results
+                if observer is not None:
+                    observer.add(1)
+        finally:
+            pool.close()
+            pool.join()
+    if observer is not None:
+        observer.finish()
+
+    # in order, so the markers come out the same way every time, whichever
+    # chunks were cached
+    for newchunks, chunks, taskindex in allregions:
+        parsed = iter(results[taskindex] if taskindex is not None else [])
+        for x, z, mtime, found in chunks:
+            if found is None:
+                x, z, mtime, found = next(parsed)
+            addMarkers(markers, newchunks, x, z, mtime, found)
 
-        for (x, z, mtime) in rset.iterate_chunks():
-            i = x // 32 + z // 32
-            i = i % numbuckets
-            buckets[i].append([x, z])
+    logging.info("Done.")
 
-        for b in buckets:
-            logging.info("Buckets has %d entries.", len(b))
 
-        # Create a pool of processes and run all the functions
-        pool = Pool(processes=numbuckets, initializer=initBucketChunks, initargs=(config_path,))
+def addMarkers(markers, newchunks, x, z, mtime, found):
+    """
+    Adds the markers found in a chunk (see parseChunk()) to `markers`, and
+    to the chunks to be cached.
+    """
+    if found is None:
+        # corrupt, so try it again next time
+        return
+    for name, marker_list in found.items():
+        markers[name]['raw'].extend(marker_list)
+    newchunks["%d,%d" % (x, z)] = [mtime, found] if found else [mtime]
 
-        # simplify the filters dict, so pickle doesn't have to do so much
-        filters = [(name, filter_function.__name__) for name, __, filter_function, __, __, __
-                   in filters]
 
-        results = pool.map(parseBucketChunks, ((buck, rset, filters) for buck in buckets))
+class UserCacheNameSource(object):
+    """
+    Looks up player names in a server's usercache.json, which maps the UUIDs
+    of the players that have logged on to their names.
+    """
+    def __init__(self, path):
+        self.path = path
 
-        logging.info("All the threads completed.")
+    def lookup(self, uuids):
+        """Returns a dict mapping those of the given UUIDs (without dashes)
+        that were found to player names"""
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            names = dict((entry['uuid'].replace('-', ''), entry['name']) for entry in entries)
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            logging.warning("Couldn't read player names from %r.", self.path)
+            return {}
+        return dict((uuid, names[uuid]) for uuid in uuids if uuid in names)
 
-        for marker_dict in results:
-            for name, marker_list in marker_dict.items():
-                markers[name]['raw'].extend(marker_list)
 
-    logging.info("Done.")
+class MojangNameSource(object):
+    """
+    Looks up player names with Mojang's session server, a few at a time.
+
+    After the first lookup that fails because there's no network or because
+    of rate limiting, the rest of them aren't tried at all. UUIDs the server
+    doesn't know, like those of offline mode players, just don't get a name.
+    """
+    def __init__(self, threads=8, timeout=10):
+        self.threads = threads
+        self.timeout = timeout
+        self.failed = False
+
+    def _lookup_one(self, uuid):
+        if self.failed:
+            return None
+        try:
+            body = urllib.request.urlopen(UUID_LOOKUP_URL + uuid, timeout=self.timeout).read()
+        except urllib.error.HTTPError as e:
+            if e.code != 429:
+                logging.debug("No name for player %s: %s", uuid, e)
+                return None
+            error = e
+        except (urllib.error.URLError, OSError) as e:
+            error = e
+        else:
+            # an unknown UUID gets an empty 204 response
+            try:
+                return json.loads(body.decode("utf-8")).get('name') if body else None
+            except (ValueError, AttributeError):
+                logging.debug("Bad profile for player %s: %r", uuid, body)
+                return None
+        if not self.failed:
+            self.failed = True
+            logging.warning("Unable to look up the name of player %s, not looking up any "
+                            "more of them.", uuid)
+            logging.debug("Error was: %s", error)
+        return None
+
+    def lookup(self, uuids):
+        uuids = list(uuids)
+        if not uuids:
+            return {}
+        logging.info("Looking up the names of %d players...", len(uuids))
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            names = list(executor.map(self._lookup_one, uuids))
+        return dict((uuid, name) for uuid, name in zip(uuids, names) if name)
 
 
 class PlayerDict(dict):
     use_uuid = False
     _name = ''
     uuid_cache = None   # A cache for the UUID->profile lookups
+    uuid_cache_changed = False
 
     @classmethod
     def load_cache(cls, outputdir):
@@ -251,6 +542,8 @@ class PlayerDict(dict):
 
     @classmethod
     def save_cache(cls, outputdir):
+        if not cls.uuid_cache_changed:
+            return
         cache_file = os.path.join(outputdir, "uuidcache.dat")
         caps = get_fs_caps(outputdir)
 
@@ -259,6 +552,28 @@ class PlayerDict(dict):
                 gz.write(json.dumps(cls.uuid_cache).encode())
                 logging.info("Wrote UUID cache with %d entries.",
                              len(cls.uuid_cache.keys()))
+        cls.uuid_cache_changed = False
+
+    @classmethod
+    def resolve_names(cls, players, sources):
+        """
+        Looks up the names of all the given players whose names aren't in the
+        cache (or were cached before they last logged off) at once, in each
+        of the given name sources in turn, and caches them.
+        """
+        missing = set()
+        for player in players:
+            if player.use_uuid and player.get_cached_name() is None:
+                missing.add(player._name.replace('-', ''))
+        for source in sources:
+            if not missing:
+                break
+            found = source.lookup(missing)
+            now = time.mktime(time.localtime())
+            for uuid, name in found.items():
+                cls.uuid_cache[uuid] = dict(id=uuid, name=name, retrievedAt=now)
+                cls.uuid_cache_changed = True
+            missing.difference_update(found)
 
     def __getitem__(self, item):
         if item == "EntityId":
@@ -269,31 +584,42 @@ class PlayerDict(dict):
                     super(PlayerDict, self).__setitem__("EntityId", self._name)
         return super(PlayerDict, self).__getitem__(item)
 
-    def get_name_from_uuid(self):
+    def get_cached_name(self):
         sname = self._name.replace('-', '')
         try:
             profile = PlayerDict.uuid_cache[sname]
-            if profile['retrievedAt'] > time.mktime(self['time']):
+            if profile['retrievedAt'] >= time.mktime(self['time']):
                 return profile['name']
         except (KeyError,):
             pass
+        return None
 
-        try:
-            profile = json.loads(urllib.request.urlopen(UUID_LOOKUP_URL + sname).read().decode("utf-8"))
-            if 'name' in profile:
-                profile['retrievedAt'] = time.mktime(time.localtime())
-                PlayerDict.uuid_cache[sname] = profile
-                return profile['name']
-        except (ValueError, urllib.error.URLError):
+    def get_name_from_uuid(self):
+        # the names were looked up by resolve_names() already
+        name = self.get_cached_name()
+        if name is None:
             logging.warning("Unable to get player name for UUID %s.", self._name)
+        return name
+
+
+def loadPlayerFile(path):
+    """
+    Reads a player file, possibly in a worker process. Returns its NBT data
+    and mtime, or None if it can't be read.
+    """
+    try:
+        return nbt.load(path)[1], os.path.getmtime(path)
+    except (IOError, TypeError, nbt.CorruptionError):
+        return None
 
 
-def handlePlayers(worldpath, filters, markers):
+def handlePlayers(worldpath, filters, markers, processes=1, sources=()):
     """
     Add markers for players to the list of markers.
 
-    For this the player files under the given `worldpath` are parsed and
-    filtered.
+    For this the player files under the given `worldpath` are parsed, using
+    the given number of processes, and filtered. The players' names are
+    looked up in the given name sources (see PlayerDict.resolve_names()).
     This function will not return anything, but it will update the parameter
     `markers`.
     """
@@ -311,9 +637,23 @@ def handlePlayers(worldpath, filters, markers):
         playerfiles = [os.path.join(worldpath, "level.dat")]
         isSinglePlayer = True
 
-    for playerfile in playerfiles:
+    paths = [os.path.join(playerdir, playerfile) for playerfile in playerfiles]
+    if processes > 1 and len(paths) > 100:
+        pool = Pool(processes=processes)
         try:
-            data = PlayerDict(nbt.load(os.path.join(playerdir, playerfile))[1])
+            loaded = pool.map(loadPlayerFile, paths, chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        loaded = [loadPlayerFile(path) for path in paths]
+
+    players = []
+    for playerfile, result in zip(playerfiles, loaded):
+        try:
+            if result is None:
+                raise IOError()
+            data = PlayerDict(result[0])
             data.use_uuid = useUUIDs
             if isSinglePlayer:
                 data = data['Data']['Player']
@@ -334,9 +674,10 @@ def handlePlayers(worldpath, filters, markers):
         data['y'] = int(data['Pos'][1])
         data['z'] = int(data['Pos'][2])
         # Time at last logout, calculated from last time the player's file was modified
-        data['time'] = time.localtime(os.path.getmtime(os.path.join(playerdir, playerfile)))
+        data['time'] = time.localtime(result[1])
 
         # Spawn position (bed or main spawn)
+        spawn = None
         if "SpawnX" in data:
             # Spawn position (bed or main spawn)
             spawn = PlayerDict()
@@ -346,7 +687,13 @@ def handlePlayers(worldpath, filters, markers):
             spawn["x"] = data['SpawnX']
             spawn["y"] = data['SpawnY']
             spawn["z"] = data['SpawnZ']
+            # for looking up the name like the player's
+            spawn["time"] = data['time']
+        players.append((data, spawn))
+
+    PlayerDict.resolve_names([data for data, spawn in players], sources)
 
+    for data, spawn in players:
         for name, __, filter_function, rset, __, __ in filters:
             # get the dimension for the filter
             # This has do be done every time, because we have filters for
@@ -363,7 +710,7 @@ def handlePlayers(worldpath, filters, markers):
                     d = create_marker_from_filter_result(data, result)
                     markers[name]['raw'].append(d)
 
-            if dimension == 0 and "SpawnX" in data:
+            if dimension == 0 and spawn is not None:
                 result = filter_function(spawn)
                 if result:
                     d = create_marker_from_filter_result(spawn, result)
@@ -437,6 +784,52 @@ def create_marker_from_filter_result(poi, result):
     return d
 
 
+def writeMarkers(destdir, markers):
+    """
+    Writes out the markers, split up by region into marker tiles in the
+    markers directory, and the index of them, markersDB.js. Each file is
+    written out as compact JSON as it goes, one tile at a time.
+    """
+    tiledir = os.path.join(destdir, "markers")
+    if not os.path.isdir(tiledir):
+        os.mkdir(tiledir)
+    caps = get_fs_caps(tiledir)
+
+    # the markers of each group in each tile, keyed by "x.z"
+    tiles = defaultdict(lambda: defaultdict(list))
+    index = {}
+    for name, group in markers.items():
+        grouptiles = set()
+        for marker in group['raw']:
+            tile = "%d.%d" % (int(math.floor(marker['x'])) // 512,
+                              int(math.floor(marker['z'])) // 512)
+            tiles[tile][name].append(marker)
+            grouptiles.add(tile)
+        index[name] = dict(created=group['created'], name=group['name'], raw=[],
+                           tiles=sorted(grouptiles))
+
+    for tile, groups in tiles.items():
+        with FileReplacer(os.path.join(tiledir, "r.%s.js" % tile), caps) as tilepath:
+            with open(tilepath, "w") as output:
+                output.write("overviewer.util.loadMarkerTile(%s," % json.dumps(tile))
+                json.dump(groups, output, separators=(",", ":"))
+                output.write(");\n")
+
+    # and get rid of the tiles left over from earlier runs
+    for filename in os.listdir(tiledir):
+        match = re.match(r"^r\.(-?\d+\.-?\d+)\.js$", filename)
+        if match and match.group(1) not in tiles:
+            os.remove(os.path.join(tiledir, filename))
+
+    with FileReplacer(os.path.join(destdir, "markersDB.js"), caps) as dbpath:
+        with open(dbpath, "w") as output:
+            output.write("var markersDB=")
+            json.dump(index, output, separators=(",", ":"))
+            output.write(";\n")
+    logging.info("Wrote %d markers in %d marker tiles.",
+                 sum(len(group['raw']) for group in markers.values()), len(tiles))
+
+
 def main():
     if os.path.basename(sys.argv[0]) == "genPOI.py":
         prog_name = "genPOI.py"
@@ -453,6 +846,14 @@ def main():
                         help="Skip scanning for entities when using GenPOI")
     parser.add_argument("--skip-players", dest="skipplayers", action="store_true",
                         help="Skip getting player data when using GenPOI")
+    parser.add_argument("--usercache", dest="usercache", action="append", default=[],
+                        help="A usercache.json file to look up player names in, in addition "
+                        "to the one next to each world, if there is one")
+    parser.add_argument("--no-uuid-lookups", dest="nouuidlookups", action="store_true",
+                        help="Don't look up player names online")
+    parser.add_argument("--ignore-cache", dest="ignorecache", action="store_true",
+                        help="Scan every chunk again, instead of reusing the markers of the "
+                        "chunks that haven't changed since the last run")
 
     args = parser.parse_args()
 
@@ -474,8 +875,19 @@ def main():
     destdir = config['outputdir']
     # saves us from creating the same World object over and over again
     worldcache = {}
+    # shares the corrupt chunks found with the renders
+    quarantine = None
+    quarantinefile = os.path.join(destdir, ".corruptchunks")
+    if config['chunkquarantine']:
+        quarantine = world.ChunkQuarantine(quarantinefile)
+        quarantine.prune()
+    elif os.path.exists(quarantinefile):
+        logging.debug("Removing the list of corrupt chunks, %s.", quarantinefile)
+        os.remove(quarantinefile)
 
     filters = set()
+    # the POI ids each filter wants to see, if it said
+    filter_ids = {}
     marker_groups = defaultdict(list)
 
     # collect all filters and get regionsets
@@ -493,7 +905,7 @@ def main():
 
         # find or create the world object
         if (render['world'] not in worldcache):
-            w = world.World(render['world'])
+            w = world.World(render['world'], quarantine=quarantine)
             worldcache[render['world']] = w
         else:
             w = worldcache[render['world']]
@@ -513,14 +925,17 @@ def main():
             rsets.append(rset)
 
         # find filters for this render
-        for f in render['markers']:
-            # internal identifier for this filter
-            name = (replaceBads(f['name']) + hex(hash(f['filterFunction']))[-4:] + "_"
-                    + hex(hash(rname))[-4:])
+        for i, f in enumerate(render['markers']):
+            # internal identifier for this filter, which is the same on every
+            # run so the MarkerCache finds the filter's markers again
+            name = (replaceBads(f['name']) + shortHash(i, f['filterFunction'].__name__) + "_"
+                    + shortHash(rname))
 
             # add it to the list of filters
             for rset in rsets:
                 filters.add((name, f['name'], f['filterFunction'], rset, worldpath, rname))
+            if 'ids' in f:
+                filter_ids[name] = f['ids']
 
             # add an entry in the menu to show markers found by this filter
             group = dict(
@@ -537,12 +952,16 @@ def main():
 
     # apply filters to regionsets
     if not args.skipscan:
-        # group filters by rset
-        def keyfunc(x):
-            return x[3]
-        sfilters = sorted(filters, key=keyfunc)
-        for rset, rset_filters in itertools.groupby(sfilters, keyfunc):
-            handleEntities(rset, config, args.config, list(rset_filters), markers)
+        cache = MarkerCache(destdir)
+        if not args.ignorecache:
+            cache.load()
+        try:
+            handleEntities(groupEntityFilters(filters, filter_ids), config, args.config, markers,
+                           cache, config['observer'])
+        finally:
+            if getattr(config['observer'], "close", None):
+                config['observer'].close()
+        cache.save()
 
     # apply filters to players
     if not args.skipplayers:
@@ -553,8 +972,20 @@ def main():
         def keyfunc(x):
             return x[4]
         sfilters = sorted(filters, key=keyfunc)
+        processes = config['processes']
+        if processes < 0:
+            processes = multiprocessing.cpu_count()
         for worldpath, worldpath_filters in itertools.groupby(sfilters, keyfunc):
-            handlePlayers(worldpath, list(worldpath_filters), markers)
+            # names are looked up in the server's usercache.json first, then
+            # online
+            sources = [UserCacheNameSource(path) for path in args.usercache]
+            usercache = os.path.join(os.path.dirname(os.path.abspath(worldpath)),
+                                     "usercache.json")
+            if os.path.isfile(usercache):
+                sources.append(UserCacheNameSource(usercache))
+            if not args.nouuidlookups:
+                sources.append(MojangNameSource())
+            handlePlayers(worldpath, list(worldpath_filters), markers, processes, sources)
 
     # add manual POIs
     # group filters by name of the render, because only filter functions for
@@ -572,10 +1003,7 @@ def main():
     if not args.skipplayers:
         PlayerDict.save_cache(destdir)
 
-    with open(os.path.join(destdir, "markersDB.js"), "w") as output:
-        output.write("var markersDB=")
-        json.dump(markers, output, indent=2)
-        output.write(";\n")
+    writeMarkers(destdir, markers)
     with open(os.path.join(destdir, "markers.js"), "w") as output:
         output.write("var markers=")
         json.dump(marker_groups, output, indent=2)
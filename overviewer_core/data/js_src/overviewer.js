@@ -54,6 +54,18 @@ overviewer.collections = {
          */
         'markerInfo': {},
 
+        /**
+         * The marker groups showing each group of markers, as
+         * {layer, entry, tileset, icon} objects by group name, for adding
+         * the markers of marker tiles to once they're loaded
+         */
+        'markerLayers': {},
+
+        /**
+         * The marker tiles that are loaded (or loading)
+         */
+        'markerTiles': {},
+
         /**
          * holds a reference to the spawn marker.
          */
@@ -300,6 +300,7 @@ overviewer.util = {
                     mg.addTo(overviewer.map);
                 }
             }
+            overviewer.util.loadVisibleMarkerTiles();
             // Update overlays
             for (var olw in overviewer.collections.overlays) {
                 for (var ol in overviewer.collections.overlays[olw]) {
@@ -322,6 +323,7 @@ overviewer.util = {
 
         overviewer.map.on('moveend', function(ev) {
             overviewer.util.updateHash();
+            overviewer.util.loadVisibleMarkerTiles();
         });
 
         var tset = overviewerConfig.tilesets[0];
@@ -384,21 +386,15 @@ overviewer.util = {
                         L.Util.setOptions(marker_group, {default_checked: marker_entry.checked});
                         var icon =  L.divIcon({html: `<img class="ov-marker" src="${marker_entry.icon}">`});
 
+                        var layer = {layer: marker_group, entry: marker_entry, tileset: obj, icon: icon};
                         for (var dbidx = 0; dbidx < markersDB[marker_entry.groupName].raw.length; dbidx++) {
-                            var db = markersDB[marker_entry.groupName].raw[dbidx];
-                            var latlng = overviewer.util.fromWorldToLatLng(db.x, db.y, db.z, obj);
-                            var m_icon;
-                            if (db.icon != undefined) {
-                                m_icon = L.divIcon({html: `<img class="ov-marker" src="${db.icon}">`});
-                            } else {
-                                m_icon = icon;
-                            }
-                            let new_marker = new L.marker(latlng, {icon: m_icon, title: db.hovertext});
-                            if (marker_entry.createInfoWindow) {
-                                new_marker.bindPopup(db.text);
-                            }
-                            marker_group.addLayer(new_marker);
+                            overviewer.util.addMarker(layer, markersDB[marker_entry.groupName].raw[dbidx]);
                         }
+                        // the rest are in marker tiles, loaded as they come into view
+                        if (!(marker_entry.groupName in overviewer.collections.markerLayers)) {
+                            overviewer.collections.markerLayers[marker_entry.groupName] = [];
+                        }
+                        overviewer.collections.markerLayers[marker_entry.groupName].push(layer);
                         obj.marker_groups[marker_entry.displayName] = marker_group;
                     }
                 }
@@ -440,6 +436,93 @@ overviewer.util = {
         var s = document.getElementsByTagName('script')[0]; s.parentNode.appendChild(m);
     },
 
+    /**
+     * Adds a marker to a marker group
+     *
+     * @param layer An entry of overviewer.collections.markerLayers
+     * @param db The marker, as written by genPOI
+     */
+    'addMarker': function(layer, db) {
+        var latlng = overviewer.util.fromWorldToLatLng(db.x, db.y, db.z, layer.tileset);
+        var m_icon;
+        if (db.icon != undefined) {
+            m_icon = L.divIcon({html: `<img class="ov-marker" src="${db.icon}">`});
+        } else {
+            m_icon = layer.icon;
+        }
+        let new_marker = new L.marker(latlng, {icon: m_icon, title: db.hovertext});
+        if (layer.entry.createInfoWindow) {
+            new_marker.bindPopup(db.text);
+        }
+        layer.layer.addLayer(new_marker);
+    },
+
+    /**
+     * Called by the marker tile scripts genPOI writes, with the markers of
+     * each group in that tile
+     */
+    'loadMarkerTile': function(tile, groups) {
+        for (var groupName in groups) {
+            var layers = overviewer.collections.markerLayers[groupName] || [];
+            layers.forEach(function(layer) {
+                groups[groupName].forEach(function(db) {
+                    overviewer.util.addMarker(layer, db);
+                });
+            });
+        }
+    },
+
+    /**
+     * Loads the marker tiles of the current tileset's marker groups that are
+     * in view, and not loaded yet. Each tile has the markers of a region, 512
+     * blocks on a side.
+     */
+    'loadVisibleMarkerTiles': function() {
+        if (typeof markers === 'undefined' || typeof markersDB === 'undefined' ||
+                overviewer.current_world == null) {
+            return;
+        }
+        var currTileset = overviewer.current_layer[overviewer.current_world];
+        if (currTileset == null || !(currTileset.tileSetConfig.path in markers)) {
+            return;
+        }
+        var ovconf = currTileset.tileSetConfig;
+
+        // The world coordinates of the corners of the view. The map doesn't
+        // line up with the world's axes, and these assume y=64, so take the
+        // box around them and a region more on each side.
+        var bounds = overviewer.map.getBounds();
+        var xs = [], zs = [];
+        [bounds.getNorthWest(), bounds.getNorthEast(),
+         bounds.getSouthWest(), bounds.getSouthEast()].forEach(function(latlng) {
+            var p = overviewer.util.fromLatLngToWorld(latlng.lat, latlng.lng, ovconf);
+            xs.push(p.x);
+            zs.push(p.z);
+        });
+        var minx = Math.floor(Math.min.apply(null, xs) / 512) - 1;
+        var maxx = Math.floor(Math.max.apply(null, xs) / 512) + 1;
+        var minz = Math.floor(Math.min.apply(null, zs) / 512) - 1;
+        var maxz = Math.floor(Math.max.apply(null, zs) / 512) + 1;
+
+        markers[ovconf.path].forEach(function(marker_entry) {
+            var group = markersDB[marker_entry.groupName];
+            if (group == undefined || group.tiles == undefined) {
+                return;
+            }
+            group.tiles.forEach(function(tile) {
+                if (tile in overviewer.collections.markerTiles) {
+                    return;
+                }
+                var coords = tile.split(".");
+                var x = parseInt(coords[0]), z = parseInt(coords[1]);
+                if (minx <= x && x <= maxx && minz <= z && z <= maxz) {
+                    overviewer.collections.markerTiles[tile] = true;
+                    overviewer.util.injectMarkerScript("markers/r." + tile + ".js");
+                }
+            });
+        });
+    },
+
     /** Any polyfills needed to improve browser compatibility
      */
     'initializePolyfills': function() {
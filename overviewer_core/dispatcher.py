@@ -18,7 +18,7 @@ import multiprocessing.managers
 import queue
 import time
 
-from . import util
+from . import metrics, util
 from .signals import Signal
 
 
@@ -78,11 +78,15 @@ class Dispatcher:
             # go through these iterators round-robin style
             for tileset, (workitem, deps) in util.roundrobin(work_iterators):
                 self._pending_jobs.append((tileset, workitem, deps))
-                observer.add(self._dispatch_jobs())
+                with metrics.span("_dispatch_jobs", "dispatcher", phase=phase):
+                    observer.add(self._dispatch_jobs())
+                self._flush_metrics()
 
             # after each phase, wait for the work to finish
             while self._pending_jobs or self._running_jobs:
-                observer.add(self._dispatch_jobs())
+                with metrics.span("_dispatch_jobs", "dispatcher", phase=phase):
+                    observer.add(self._dispatch_jobs())
+                self._flush_metrics()
 
             observer.finish()
 
@@ -104,14 +108,18 @@ class Dispatcher:
                     break
             else:
                 # it isn't! all dependencies are finished
-                finished_jobs += self.dispatch(tileset, workitem)
+                with metrics.span("dispatch", "dispatcher", tileset=tileset, workitem=workitem):
+                    finished_jobs += self.dispatch(tileset, workitem)
                 self._running_jobs.append((tileset, workitem))
                 dispatched_jobs.append(pending_job)
 
         # make sure to at least get finished jobs, even if we don't
         # submit any new ones...
         if not dispatched_jobs:
-            finished_jobs += self.dispatch(None, None)
+            # everything left is waiting for its dependencies or is running
+            with metrics.span("wait", "dispatcher", pending=len(self._pending_jobs),
+                              running=len(self._running_jobs)):
+                finished_jobs += self.dispatch(None, None)
 
         # clean out the appropriate lists
         for job in finished_jobs:
@@ -121,6 +129,11 @@ class Dispatcher:
 
         return len(finished_jobs)
 
+    def _flush_metrics(self):
+        metrics.gauge("jobs.pending", len(self._pending_jobs))
+        metrics.gauge("jobs.dispatched", len(self._running_jobs))
+        metrics.flush()
+
     def close(self):
         """Close the Dispatcher. This should be called when you are
         done with the dispatcher, to ensure that it cleans up any
@@ -142,7 +155,9 @@ class Dispatcher:
         then returning completed jobs is all this function should do.
         """
         if tileset is not None:
-            tileset.do_work(workitem)
+            with metrics.work(tileset, workitem):
+                tileset.do_work(workitem)
+            metrics.flush()
             return [(tileset, workitem)]
         return []
 
@@ -263,7 +278,11 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
                     assert tv == self.tileset_version
 
                 # do job
-                ret = self.tilesets[ti].do_work(workitem)
+                with metrics.work(self.tilesets[ti], workitem):
+                    ret = self.tilesets[ti].do_work(workitem)
+                # send the metrics of this job before its result, so they're
+                # all in by the time the dispatcher knows all jobs are done
+                metrics.flush()
                 result = (ti, workitem, ret,)
                 self.result_queue.put(result, False)
             except queue.Empty:
@@ -0,0 +1,421 @@
+#    This file is part of the Minecraft Overviewer.
+#
+#    Minecraft Overviewer is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or (at
+#    your option) any later version.
+#
+#    Minecraft Overviewer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#    Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module collects timing metrics for the stages of a render. Each process
+records the wall and CPU time spent in every stage with the stage() context
+manager, and flush() sends what was recorded since the last flush to the main
+process with the report signal, where a MetricsCollector adds it all up.
+
+Stages may be nested, in which case the time spent in the inner stages isn't
+counted for the outer one. For example, render_loop() reads the chunks it
+needs itself, so the "render" stage only gets the time that wasn't spent in
+"chunkread", "nbtparse" or "decode".
+
+Nothing is recorded unless the recorder has been enabled, which TileSet does
+in every process when the rendermetrics option is set.
+
+The recorder can also keep a timeline of the stages, and of any other spans of
+time marked with span(), as trace events. They're sent to the main process
+with the trace signal, where a TraceWriter writes them to a file in the Chrome
+trace event format, for chrome://tracing or https://ui.perfetto.dev/ to show.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from .files import FileReplacer
+from .signals import Signal
+
+# the stages, in the order they're reported
+STAGES = ("chunkread", "nbtparse", "decode", "render", "composite", "encode", "optimize",
+          "write")
+
+
+class StageStats(object):
+    """Timings of one stage: the number of times it ran, the total wall and
+    CPU time in seconds, and a histogram of the wall times. Histogram bucket
+    b counts the times below 2**b microseconds that weren't in bucket b-1.
+    """
+    __slots__ = ["count", "wall", "cpu", "buckets"]
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.buckets = {}
+
+    def add(self, wall, cpu):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        b = int(wall * 1000000).bit_length()
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.wall += other.wall
+        self.cpu += other.cpu
+        for b, n in other.buckets.items():
+            self.buckets[b] = self.buckets.get(b, 0) + n
+
+    def percentile(self, p):
+        """Returns an upper bound of the given percentile of the wall times,
+        in seconds"""
+        needed = self.count * p / 100.0
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= needed:
+                return 2 ** b / 1000000.0
+        return 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            # [upper bound in seconds, count] pairs
+            "histogram": [[2 ** b / 1000000.0, self.buckets[b]] for b in sorted(self.buckets)],
+        }
+
+    def __getstate__(self):
+        return (self.count, self.wall, self.cpu, self.buckets)
+
+    def __setstate__(self, state):
+        self.count, self.wall, self.cpu, self.buckets = state
+
+
+class _StageTimer(object):
+    __slots__ = ["recorder", "stage", "label", "start_wall", "start_cpu"]
+
+    def __init__(self, recorder, stage, label):
+        self.recorder = recorder
+        self.stage = stage
+        self.label = label
+
+    def __enter__(self):
+        # the time spent in nested stages is added up here
+        self.recorder._stack.append([0.0, 0.0])
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        stack = self.recorder._stack
+        inner_wall, inner_cpu = stack.pop()
+        if stack:
+            stack[-1][0] += wall
+            stack[-1][1] += cpu
+        if self.recorder.enabled:
+            self.recorder.record(self.label, self.stage, wall - inner_wall, cpu - inner_cpu)
+        if self.recorder.tracing:
+            self.recorder.add_event(self.stage, "stage", self.start_wall, wall,
+                                    {"tileset": self.label})
+
+
+class _Span(object):
+    __slots__ = ["recorder", "name", "cat", "args", "start"]
+
+    def __init__(self, recorder, name, cat, args):
+        self.recorder = recorder
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.perf_counter() - self.start
+        args = dict((k, v if isinstance(v, (int, float)) else str(v))
+                    for k, v in self.args.items())
+        self.recorder.add_event(self.name, self.cat, self.start, duration, args)
+
+
+class _Work(object):
+    __slots__ = ["recorder", "tileset", "workitem", "start"]
+
+    def __init__(self, recorder, tileset, workitem):
+        self.recorder = recorder
+        self.tileset = tileset
+        self.workitem = workitem
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.perf_counter() - self.start
+        recorder = self.recorder
+        if recorder.enabled:
+            recorder.count("worker.busy_seconds", duration)
+            recorder.count("worker.jobs")
+        if recorder.tracing:
+            recorder.add_event("do_work", "worker", self.start, duration,
+                               {"tileset": str(self.tileset), "workitem": str(self.workitem)})
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class Recorder(object):
+    """Records stage timings, counters and gauges in one process. The timings
+    are kept per label, which is the name of the tileset being worked on."""
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.label = None
+        self.stats = {}
+        self.counters = {}
+        self.gauges = {}
+        self.events = []
+        self.pid = None
+        self._stack = []
+
+    def enable_tracing(self):
+        """Starts recording trace events in this process. This may be called
+        again in a process forked from one that was already tracing."""
+        if self.tracing and self.pid == os.getpid():
+            return
+        self.tracing = True
+        self.pid = os.getpid()
+        # events inherited from the parent process are the parent's to send
+        self.events = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": self.pid,
+                        "args": {"name": multiprocessing.current_process().name}}]
+
+    def stage(self, stage, label=None):
+        """Returns a context manager that times the given stage. label
+        defaults to the current one."""
+        if not (self.enabled or self.tracing):
+            return _null_timer
+        return _StageTimer(self, stage, label if label is not None else self.label)
+
+    def span(self, name, cat, args):
+        """Returns a context manager that adds a trace event for the time
+        spent in it, if tracing. The values of args are turned into strings
+        only then."""
+        if not self.tracing:
+            return _null_timer
+        return _Span(self, name, cat, args)
+
+    def work(self, tileset, workitem):
+        """Returns a context manager for a worker doing the given work item,
+        which counts the time it's busy and adds a trace event for it"""
+        if not (self.enabled or self.tracing):
+            return _null_timer
+        return _Work(self, tileset, workitem)
+
+    def add_event(self, name, cat, start, duration, args):
+        # perf_counter() is a system-wide monotonic clock on the platforms
+        # we run on, so the timestamps of all processes line up
+        self.events.append({"name": name, "cat": cat, "ph": "X", "pid": self.pid,
+                            "tid": self.pid, "ts": start * 1000000, "dur": duration * 1000000,
+                            "args": args})
+
+    def record(self, label, stage, wall, cpu):
+        try:
+            stats = self.stats[label, stage]
+        except KeyError:
+            stats = self.stats[label, stage] = StageStats()
+        stats.add(wall, cpu)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def flush(self):
+        """Emits the report and trace signals with everything recorded since
+        the last flush, and starts over"""
+        if self.stats or self.counters or self.gauges:
+            stats, counters, gauges = self.stats, self.counters, self.gauges
+            self.stats = {}
+            self.counters = {}
+            self.gauges = {}
+            report(os.getpid(), stats, counters, gauges)
+        if self.events:
+            events = self.events
+            self.events = []
+            trace(events)
+
+
+# emitted with the process id, a {(label, stage): StageStats} dict, a
+# {name: count} dict and a {name: value} dict of gauges
+report = Signal('Metrics', 'report')
+# emitted with a list of trace events
+trace = Signal('Metrics', 'trace')
+
+# the recorder of this process
+recorder = Recorder()
+
+
+def enable():
+    recorder.enabled = True
+
+
+def enable_tracing():
+    recorder.enable_tracing()
+
+
+def set_label(label):
+    recorder.label = label
+
+
+def stage(name, label=None):
+    return recorder.stage(name, label)
+
+
+def span(name, cat, **args):
+    return recorder.span(name, cat, args)
+
+
+def work(tileset, workitem):
+    return recorder.work(tileset, workitem)
+
+
+def count(name, n=1):
+    recorder.count(name, n)
+
+
+def gauge(name, value):
+    recorder.gauge(name, value)
+
+
+def flush():
+    recorder.flush()
+
+
+class MetricsCollector(object):
+    """Adds up the reports of all processes. Call register() before the
+    render starts to begin collecting."""
+
+    def __init__(self):
+        self.stats = {}
+        self.counters = {}
+        self.gauges = {}
+        # the seconds each process spent doing work items, by process id
+        self.busy = {}
+        self.start_time = time.time()
+
+    def register(self):
+        report.register(self.merge)
+
+    def merge(self, pid, stats, counters, gauges):
+        for key, s in stats.items():
+            try:
+                self.stats[key].merge(s)
+            except KeyError:
+                self.stats[key] = s
+        for name, n in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        self.gauges.update(gauges)
+        if "worker.busy_seconds" in counters:
+            self.busy[pid] = self.busy.get(pid, 0) + counters["worker.busy_seconds"]
+
+    def get_tilesets(self):
+        """Returns {label: {stage: StageStats}}"""
+        tilesets = {}
+        for (label, stage), s in self.stats.items():
+            tilesets.setdefault(label, {})[stage] = s
+        return tilesets
+
+    def to_dict(self):
+        return {
+            "elapsed": time.time() - self.start_time,
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "busy": dict((str(pid), busy) for pid, busy in self.busy.items()),
+            "tilesets": dict((label, dict((stage, s.to_dict()) for stage, s in stages.items()))
+                             for label, stages in self.get_tilesets().items()),
+        }
+
+    def save(self, path):
+        with FileReplacer(path) as tmppath:
+            with open(tmppath, "w") as f:
+                json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+
+    def log_summary(self):
+        """Logs a table of the stage timings and their histograms for every
+        tileset"""
+        bars = " .:-=+*#%@"
+        for label, stages in sorted(self.get_tilesets().items(), key=lambda i: str(i[0])):
+            logging.info("Render metrics for %s:", label)
+            logging.info("  %-10s %9s %10s %10s %9s %9s %9s  %s", "stage", "count", "wall(s)",
+                         "cpu(s)", "mean(ms)", "p50(ms)", "p99(ms)", "histogram (2us .. 2s)")
+            order = list(STAGES) + sorted(s for s in stages if s not in STAGES)
+            for stage in order:
+                s = stages.get(stage)
+                if s is None:
+                    continue
+                # one column per power of two microseconds, from 2us to 2s
+                columns = [0] * 21
+                for b, n in s.buckets.items():
+                    columns[min(max(b, 1), 21) - 1] += n
+                top = max(columns)
+                hist = "".join(bars[(n * (len(bars) - 1) + top - 1) // top] for n in columns)
+                logging.info("  %-10s %9d %10.2f %10.2f %9.3f %9.3f %9.3f  [%s]", stage, s.count,
+                             s.wall, s.cpu, s.wall * 1000.0 / s.count,
+                             s.percentile(50) * 1000.0, s.percentile(99) * 1000.0, hist)
+        for name, n in sorted(self.counters.items()):
+            logging.info("  %s: %s", name, n)
+
+
+class TraceWriter(object):
+    """Writes the trace events of all processes to a file as they're
+    reported. Call register() before the render starts, and close() after
+    it's done."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "w")
+        self.f.write("[")
+        self.first = True
+
+    def register(self):
+        trace.register(self.write)
+
+    def write(self, events):
+        for event in events:
+            if not self.first:
+                self.f.write(",")
+            self.f.write("\n")
+            self.f.write(json.dumps(event))
+            self.first = False
+
+    def close(self):
+        self.f.write("\n]\n")
+        self.f.close()
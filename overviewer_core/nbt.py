@@ -19,6 +19,8 @@ from io import BytesIO
 import struct
 import zlib
 
+from . import metrics
+
 
 # decorator that turns the first argument from a string into an open file
 # handle
@@ -111,6 +113,23 @@ class NBTFileReader(object):
             12: self._read_tag_long_array,
         }
 
+        # and to functions to skip over them without reading them
+        self._skip_tagmap = {
+            0: self._skip_tag_end,
+            1: self._skip_fixed(1),
+            2: self._skip_fixed(2),
+            3: self._skip_fixed(4),
+            4: self._skip_fixed(8),
+            5: self._skip_fixed(4),
+            6: self._skip_fixed(8),
+            7: self._skip_array(1),
+            8: self._skip_tag_string,
+            9: self._skip_tag_list,
+            10: self._skip_tag_compound,
+            11: self._skip_array(4),
+            12: self._skip_array(8),
+        }
+
     # These private methods read the payload only of the following types
     def _read_tag_end(self):
         # Nothing to read
@@ -188,11 +207,104 @@ class NBTFileReader(object):
 
         return tags
 
-    def read_all(self):
+    def _read_tag_compound_selected(self, select):
+        # Like _read_tag_compound(), but only reads the tags named in select
+        tags = {}
+        while True:
+            tagtype = ord(self._file.read(1))
+
+            if tagtype == 0:
+                break
+
+            name = self._read_tag_string()
+            subselect = select.get(name)
+            if subselect is None:
+                self._skip_tagmap[tagtype]()
+            elif subselect is True or tagtype not in (9, 10):
+                tags[name] = self._read_tagmap[tagtype]()
+            elif tagtype == 9:
+                tags[name] = self._read_tag_list_selected(subselect)
+            else:
+                tags[name] = self._read_tag_compound_selected(subselect)
+
+        return tags
+
+    def _read_tag_list_selected(self, select):
+        # Like _read_tag_list(), but only reads the tags named in select of
+        # each compound in the list
+        tagid = self._read_tag_byte()
+        length = self._uint.unpack(self._file.read(4))[0]
+
+        if tagid != 10:
+            read_method = self._read_tagmap[tagid]
+            return [read_method() for _ in range(length)]
+        return [self._read_tag_compound_selected(select) for _ in range(length)]
+
+    # These skip over the payload of a tag, the same way the _read_tag methods
+    # read it
+    def _skip_tag_end(self):
+        pass
+
+    def _skip_fixed(self, size):
+        def skip():
+            self._file.seek(size, 1)
+        return skip
+
+    def _skip_array(self, itemsize):
+        def skip():
+            length = self._uint.unpack(self._file.read(4))[0]
+            self._file.seek(length * itemsize, 1)
+        return skip
+
+    def _skip_tag_string(self):
+        length = self._ushort.unpack(self._file.read(2))[0]
+        self._file.seek(length, 1)
+
+    # the sizes of the tag types with a fixed size, for skipping lists of them
+    _fixed_sizes = {0: 0, 1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+
+    def _skip_tag_list(self):
+        tagid = self._read_tag_byte()
+        length = self._uint.unpack(self._file.read(4))[0]
+
+        if tagid in self._fixed_sizes:
+            self._file.seek(length * self._fixed_sizes[tagid], 1)
+        else:
+            skip_method = self._skip_tagmap[tagid]
+            for _ in range(length):
+                skip_method()
+
+    def _skip_tag_compound(self):
+        # This is where most of the skipping happens (block palettes are
+        # lists of compounds), so strings are skipped inline
+        read = self._file.read
+        seek = self._file.seek
+        ushort = self._ushort.unpack
+        skip_tagmap = self._skip_tagmap
+        while True:
+            tagtype = ord(read(1))
+
+            if tagtype == 0:
+                break
+
+            # the name, then the payload
+            seek(ushort(read(2))[0], 1)
+            if tagtype == 8:
+                seek(ushort(read(2))[0], 1)
+            else:
+                skip_tagmap[tagtype]()
+
+    def read_all(self, select=None):
         """Reads the entire file and returns (name, payload)
         name is the name of the root tag, and payload is a dictionary mapping
         names to their payloads
 
+        select, if given, is a dictionary naming the tags of the root compound
+        to read. Each name maps to True to read that whole tag, or to another
+        such dictionary to only read some of the tags of that compound (or
+        of each compound in that list). All the other tags are skipped over
+        without being parsed.
+
         """
         # Read tag type
         try:
@@ -201,7 +313,10 @@ class NBTFileReader(object):
                 raise Exception("Expected a tag compound")
             # Read the tag name
             name = self._read_tag_string()
-            payload = self._read_tag_compound()
+            if select is None:
+                payload = self._read_tag_compound()
+            else:
+                payload = self._read_tag_compound_selected(select)
             return (name, payload)
         except (struct.error, ValueError, TypeError, EOFError) as e:
             raise CorruptNBTError("could not parse nbt: %s" % (str(e),))
@@ -272,13 +387,16 @@ class MCRFileReader(object):
         z = z % 32
         return self._locations[int(x + z * 32)] >> 8 != 0
 
-    def load_chunk(self, x, z):
+    def load_chunk(self, x, z, select=None):
         """Return a (name, data) tuple for the given chunk, or
         None if the given chunk doesn't exist in this region file. If
         you provide an x or z not between 0 and 31, it will be
         modulo'd into this range (x % 32, etc.) This is so you can
         provide chunk coordinates in global coordinates, and still
-        have the chunks load out of regions properly."""
+        have the chunks load out of regions properly.
+
+        select is passed on to NBTFileReader.read_all(), to only read
+        some of the chunk's tags."""
         x = x % 32
         z = z % 32
         location = self._locations[int(x + z * 32)]
@@ -288,38 +406,40 @@ class MCRFileReader(object):
         if offset == 0:
             return None
 
-        # seek to the data
-        self._file.seek(offset)
+        with metrics.stage("chunkread"):
+            # seek to the data
+            self._file.seek(offset)
 
-        # read in the chunk data header
-        header = self._file.read(5)
-        if len(header) != 5:
-            raise CorruptChunkError("chunk header is invalid")
-        data_length, compression = self._chunk_header_format.unpack(header)
+            # read in the chunk data header
+            header = self._file.read(5)
+            if len(header) != 5:
+                raise CorruptChunkError("chunk header is invalid")
+            data_length, compression = self._chunk_header_format.unpack(header)
 
-        # figure out the compression
-        is_gzip = True
-        if compression == 1:
-            # gzip -- not used by the official client, but trivial to
-            # support here so...
+            # figure out the compression
             is_gzip = True
-        elif compression == 2:
-            # deflate -- pure zlib stream
-            is_gzip = False
-        else:
-            # unsupported!
-            raise CorruptRegionError("unsupported chunk compression type: %i "
-                                     "(should be 1 or 2)" % (compression,))
-
-        # turn the rest of the data into a BytesIO object
-        # (using data_length - 1, as we already read 1 byte for compression)
-        data = self._file.read(data_length - 1)
-        if len(data) != data_length - 1:
-            raise CorruptRegionError("chunk length is invalid")
-        data = BytesIO(data)
+            if compression == 1:
+                # gzip -- not used by the official client, but trivial to
+                # support here so...
+                is_gzip = True
+            elif compression == 2:
+                # deflate -- pure zlib stream
+                is_gzip = False
+            else:
+                # unsupported!
+                raise CorruptRegionError("unsupported chunk compression type: %i "
+                                         "(should be 1 or 2)" % (compression,))
+
+            # turn the rest of the data into a BytesIO object
+            # (using data_length - 1, as we already read 1 byte for compression)
+            data = self._file.read(data_length - 1)
+            if len(data) != data_length - 1:
+                raise CorruptRegionError("chunk length is invalid")
+            data = BytesIO(data)
 
         try:
-            return NBTFileReader(data, is_gzip=is_gzip).read_all()
+            with metrics.stage("nbtparse"):
+                return NBTFileReader(data, is_gzip=is_gzip).read_all(select)
         except CorruptionError:
             raise
         except Exception as e:
@@ -13,12 +13,16 @@
 #    You should have received a copy of the GNU General Public License along
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
+import http.server
 import json
 import logging
 import os
+import socketserver
 import sys
+import threading
 import time
 
+from . import metrics
 from . import progressbar
 from . import rcon
 
@@ -87,6 +91,16 @@ class Observer(object):
     def _set_max_value(self, max_value):
         self._max_value = max_value
 
+    def wants_metrics(self):
+        """Returns whether the worker processes should record the metrics of
+        the metrics module for this observer"""
+        return False
+
+    def close(self):
+        """Releases anything the observer holds on to, once it's no longer
+        used"""
+        pass
+
 
 class LoggingObserver(Observer):
     """Simple observer that just outputs status through logging.
@@ -395,6 +409,15 @@ class MultiplexingObserver(Observer):
             o.update(current_value)
         super(MultiplexingObserver, self).update(current_value)
 
+    def wants_metrics(self):
+        return any(getattr(o, "wants_metrics", None) and o.wants_metrics()
+                   for o in self.components)
+
+    def close(self):
+        for o in self.components:
+            if getattr(o, "close", None):
+                o.close()
+
 
 class ServerAnnounceObserver(Observer):
     """Send the output to a Minecraft server via FIFO or stdin"""
@@ -471,3 +494,175 @@ class RConObserver(Observer):
 
     def _send_output(self, output):
         self.conn.command("say", output)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.observer.get_metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _label(value):
+    return '"%s"' % str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsObserver(Observer):
+    """Serve the progress of the render and the metrics of the worker
+    processes in the Prometheus text format, over HTTP on a local port or a
+    unix socket"""
+
+    def __init__(self, port=9180, host="127.0.0.1", socket=None):
+        """Initialise observer
+
+        :port: the port to serve the metrics on, at /metrics
+        :host: the address to listen on. This is only the local host by
+               default, set it to "" to listen on all of them [optional]
+        :socket: the path of a unix socket to listen on instead of a port
+                 [optional]
+        """
+        super(MetricsObserver, self).__init__()
+        self.address = socket if socket is not None else (host, port)
+        self.server = None
+        self.collector = metrics.MetricsCollector()
+        self.lock = threading.RLock()
+        self.tiles_done = 0
+        metrics.report.register(self._merge)
+
+    def wants_metrics(self):
+        """Returns True to have the worker processes record metrics"""
+        return True
+
+    def _merge(self, *args):
+        with self.lock:
+            self.collector.merge(*args)
+
+    def _serve(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self.server = _UnixHTTPServer(self.address, _MetricsHandler)
+        else:
+            self.server = http.server.ThreadingHTTPServer(self.address, _MetricsHandler)
+        self.server.observer = self
+        thread = threading.Thread(target=self.server.serve_forever, name="MetricsObserver")
+        thread.daemon = True
+        thread.start()
+        logging.info("Serving render metrics on %s",
+                     self.address if isinstance(self.address, str) else
+                     "http://%s:%d/metrics" % self.server.server_address[:2])
+
+    def close(self):
+        """Stops serving the metrics, and removes the unix socket"""
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def start(self, max_value):
+        if self.server is None:
+            self.collector.start_time = time.time()
+            self._serve()
+        with self.lock:
+            # counts of earlier phases are kept in tiles_done
+            self.tiles_done += self.get_current_value() or 0
+            super(MetricsObserver, self).start(max_value)
+
+    def update(self, current_value):
+        with self.lock:
+            return super(MetricsObserver, self).update(current_value)
+
+    def get_metrics_text(self):
+        """Returns the current metrics in the Prometheus text format"""
+        lines = []
+
+        def add(name, kind, help, samples):
+            lines.append("# HELP overviewer_%s %s" % (name, help))
+            lines.append("# TYPE overviewer_%s %s" % (name, kind))
+            for labels, value in samples:
+                if labels:
+                    labels = "{%s}" % ",".join("%s=%s" % (k, _label(v)) for k, v in labels)
+                lines.append("overviewer_%s%s %s" % (name, labels or "", repr(float(value))))
+
+        with self.lock:
+            c = self.collector
+            elapsed = max(time.time() - c.start_time, 0.001)
+            tilesets = c.get_tilesets()
+
+            add("tiles_done_total", "counter", "Work items done in all phases so far.",
+                [((), self.tiles_done + (self.get_current_value() or 0))])
+            add("phase_tiles_done", "gauge", "Work items done in the current phase.",
+                [((), self.get_current_value() or 0)])
+            add("phase_tiles", "gauge", "Work items in the current phase, an estimate.",
+                [((), self.get_max_value() or 0)])
+            written = [(label, stages["write"].count) for label, stages in tilesets.items()
+                       if "write" in stages]
+            add("tiles_written_total", "counter", "Tiles written, by tileset.",
+                [((("tileset", label),), n) for label, n in written])
+            add("tiles_per_second", "gauge", "Tiles written per second since the render "
+                "started, by tileset.",
+                [((("tileset", label),), n / elapsed) for label, n in written])
+
+            add("worker_busy_seconds_total", "counter", "Seconds each worker process "
+                "spent doing work.",
+                [((("pid", pid),), busy) for pid, busy in sorted(c.busy.items())])
+            if c.busy:
+                add("worker_utilization", "gauge", "The fraction of the time since the "
+                    "render started the worker processes spent doing work.",
+                    [((), sum(c.busy.values()) / (elapsed * len(c.busy)))])
+            add("jobs_pending", "gauge", "Work items waiting to be dispatched.",
+                [((), c.gauges.get("jobs.pending", 0))])
+            add("jobs_dispatched", "gauge", "Work items queued for or being done by "
+                "the workers.", [((), c.gauges.get("jobs.dispatched", 0))])
+
+            hits = c.counters.get("chunkcache.hits", 0)
+            misses = c.counters.get("chunkcache.misses", 0)
+            add("chunk_cache_hits_total", "counter", "Chunks found in the chunk cache.",
+                [((), hits)])
+            add("chunk_cache_misses_total", "counter", "Chunks not found in the chunk cache.",
+                [((), misses)])
+            if hits + misses:
+                add("chunk_cache_hit_ratio", "gauge", "The fraction of chunks found in the "
+                    "chunk cache.", [((), hits / float(hits + misses))])
+            add("written_bytes_total", "counter", "Bytes of tiles written.",
+                [((), c.counters.get("bytes.written", 0))])
+
+            lines.append("# HELP overviewer_stage_seconds Wall time of each stage of "
+                         "rendering, not counting the stages inside it, by tileset.")
+            lines.append("# TYPE overviewer_stage_seconds histogram")
+            cpu = []
+            for label, stages in sorted(tilesets.items(), key=lambda i: str(i[0])):
+                for stage, s in sorted(stages.items()):
+                    labels = "tileset=%s,stage=%s" % (_label(label), _label(stage))
+                    # bucket b of the stats counts the times below 2**b
+                    # microseconds, the first bucket here includes bucket 0
+                    cumulative = s.buckets.get(0, 0)
+                    for b in range(1, 22):
+                        cumulative += s.buckets.get(b, 0)
+                        lines.append("overviewer_stage_seconds_bucket{%s,le=\"%r\"} %d"
+                                     % (labels, 2 ** b / 1000000.0, cumulative))
+                    lines.append("overviewer_stage_seconds_bucket{%s,le=\"+Inf\"} %d"
+                                 % (labels, s.count))
+                    lines.append("overviewer_stage_seconds_sum{%s} %r" % (labels, s.wall))
+                    lines.append("overviewer_stage_seconds_count{%s} %d" % (labels, s.count))
+                    cpu.append(((("tileset", label), ("stage", stage)), s.cpu))
+            add("stage_cpu_seconds_total", "counter", "CPU time of each stage of rendering, "
+                "not counting the stages inside it, by tileset.", cpu)
+        lines.append("")
+        return "\n".join(lines)
@@ -109,6 +109,22 @@ def get_default_config():
 
     conf['processes'] = Setting(required=True, validator=int, default=-1)
 
+    conf['texturecache'] = Setting(required=False, validator=validateTextureCache, default=None)
+
+    conf['sharetextures'] = Setting(required=True, validator=validateBool, default=True)
+
+    conf['lazytextures'] = Setting(required=True, validator=validateBool, default=False)
+
+    conf['texturepreflight'] = Setting(required=True, validator=validateBool, default=False)
+
+    conf['sharerenders'] = Setting(required=True, validator=validateBool, default=True)
+
+    conf['worldlistingcache'] = Setting(required=True, validator=validateBool, default=False)
+
+    conf['chunkquarantine'] = Setting(required=True, validator=validateBool, default=True)
+
+    conf['rendermetrics'] = Setting(required=True, validator=validateBool, default=False)
+
     # TODO clean up this ugly in sys.argv hack
     if platform.system() == 'Windows' or not sys.stdout.isatty() or "--simple" in sys.argv:
         obs = LoggingObserver()
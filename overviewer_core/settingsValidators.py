@@ -59,6 +59,11 @@ def validateMarkers(filterlist):
             raise ValidationException("Filter must define a filter function.")
         if not callable(x['filterFunction']):
             raise ValidationException("%r must be a function." % x['filterFunction'])
+        if "ids" in x:
+            if isinstance(x['ids'], str) or not all(isinstance(i, str) for i in x['ids']):
+                raise ValidationException("The ids of filter %r must be a list of strings."
+                                          % x['name'])
+            x['ids'] = list(x['ids'])
     return filterlist
 
 
@@ -213,6 +218,14 @@ def validateTexturePath(path):
     return path
 
 
+def validateTextureCache(path):
+    # False disables the cache, anything else is a directory to keep it in
+    if path is False:
+        return False
+    checkBadEscape(path)
+    return expand_path(path)
+
+
 def validateBool(b):
     return bool(b)
 
@@ -55,14 +55,14 @@ imaging_python_to_c(PyObject* obj) {
 /* helper function to setup s{x,y}, d{x,y}, and {x,y}size variables
    in these composite functions -- even handles auto-sizing to src! */
 static inline void
-setup_source_destination(Imaging src, Imaging dest,
+setup_source_destination(int32_t src_xsize, int32_t src_ysize, Imaging dest,
                          int32_t* sx, int32_t* sy,
                          int32_t* dx, int32_t* dy,
                          int32_t* xsize, int32_t* ysize) {
     /* handle negative/zero sizes appropriately */
     if (*xsize <= 0 || *ysize <= 0) {
-        *xsize = src->xsize;
-        *ysize = src->ysize;
+        *xsize = src_xsize;
+        *ysize = src_ysize;
     }
 
     /* set up the source position, size and destination position */
@@ -92,6 +92,111 @@ setup_source_destination(Imaging src, Imaging dest,
         *ysize = dest->ysize - *dy;
 }
 
+/* blends one row of src over out, the inner loop of the alpha_over
+ * functions. out points into an RGBA image, inmask at the first alpha
+ * byte of the mask.
+ */
+static inline void
+alpha_over_row(UINT8* out, const UINT8* in, int32_t src_has_alpha,
+               const UINT8* inmask, int32_t mask_stride,
+               UINT8 overall_alpha_int, int32_t xsize) {
+    UINT8* outmask = out + 3;
+    /* iteration variables */
+    int32_t x;
+    uint32_t i;
+    /* temporary calculation variables */
+    int32_t tmp1, tmp2, tmp3;
+
+    for (x = 0; x < xsize; x++) {
+        UINT8 in_alpha;
+
+        /* apply overall_alpha */
+        if (overall_alpha_int != 255 && *inmask != 0) {
+            in_alpha = OV_MULDIV255(*inmask, overall_alpha_int, tmp1);
+        } else {
+            in_alpha = *inmask;
+        }
+
+        /* special cases */
+        if (in_alpha == 255 || (*outmask == 0 && in_alpha > 0)) {
+            *outmask = in_alpha;
+
+            *out = *in;
+            out++, in++;
+            *out = *in;
+            out++, in++;
+            *out = *in;
+            out++, in++;
+        } else if (in_alpha == 0) {
+            /* do nothing -- source is fully transparent */
+            out += 3;
+            in += 3;
+        } else {
+            /* general case */
+            int32_t alpha = in_alpha + OV_MULDIV255(*outmask, 255 - in_alpha, tmp1);
+            for (i = 0; i < 3; i++) {
+                /* general case */
+                *out = OV_MULDIV255(*in, in_alpha, tmp1) +
+                       OV_MULDIV255(OV_MULDIV255(*out, *outmask, tmp2), 255 - in_alpha, tmp3);
+
+                *out = (*out * 255) / alpha;
+                out++, in++;
+            }
+
+            *outmask = alpha;
+        }
+
+        out++;
+        if (src_has_alpha)
+            in++;
+        outmask += 4;
+        inmask += mask_stride;
+    }
+}
+
+/* multiplies one row of out by the source color, weighted by the mask,
+ * the inner loop of the tint_with_mask functions
+ */
+static inline void
+tint_row(UINT8* out, uint8_t sr, uint8_t sg, uint8_t sb, uint8_t sa,
+         const UINT8* inmask, int32_t mask_stride, int32_t xsize) {
+    /* iteration variable */
+    int32_t x;
+    /* temporary calculation variables */
+    int32_t tmp1, tmp2;
+
+    for (x = 0; x < xsize; x++) {
+        /* special cases */
+        if (*inmask == 255) {
+            *out = OV_MULDIV255(*out, sr, tmp1);
+            out++;
+            *out = OV_MULDIV255(*out, sg, tmp1);
+            out++;
+            *out = OV_MULDIV255(*out, sb, tmp1);
+            out++;
+            *out = OV_MULDIV255(*out, sa, tmp1);
+            out++;
+        } else if (*inmask == 0) {
+            /* do nothing -- source is fully transparent */
+            out += 4;
+        } else {
+            /* general case */
+
+            /* TODO work out general case */
+            *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sr, *inmask, tmp1), tmp2);
+            out++;
+            *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sg, *inmask, tmp1), tmp2);
+            out++;
+            *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sb, *inmask, tmp1), tmp2);
+            out++;
+            *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sa, *inmask, tmp1), tmp2);
+            out++;
+        }
+
+        inmask += mask_stride;
+    }
+}
+
 /* convenience alpha_over with 1.0 as overall_alpha */
 inline PyObject* alpha_over(PyObject* dest, PyObject* src, PyObject* mask,
                             int32_t dx, int32_t dy, int32_t xsize, int32_t ysize) {
@@ -112,11 +217,8 @@ alpha_over_full(PyObject* dest, PyObject* src, PyObject* mask, float overall_alp
     int32_t src_has_alpha, mask_offset, mask_stride;
     /* source position */
     int32_t sx, sy;
-    /* iteration variables */
-    int32_t x, y;
-    uint32_t i;
-    /* temporary calculation variables */
-    int32_t tmp1, tmp2, tmp3;
+    /* iteration variable */
+    int32_t y;
     /* integer [0, 255] version of overall_alpha */
     UINT8 overall_alpha_int = 255 * overall_alpha;
 
@@ -165,7 +267,7 @@ alpha_over_full(PyObject* dest, PyObject* src, PyObject* mask, float overall_alp
     mask_stride = imMask->pixelsize;
 
     /* setup source & destination vars */
-    setup_source_destination(imSrc, imDest, &sx, &sy, &dx, &dy, &xsize, &ysize);
+    setup_source_destination(imSrc->xsize, imSrc->ysize, imDest, &sx, &sy, &dx, &dy, &xsize, &ysize);
 
     /* check that there remains any blending to be done */
     if (xsize <= 0 || ysize <= 0) {
@@ -174,59 +276,30 @@ alpha_over_full(PyObject* dest, PyObject* src, PyObject* mask, float overall_alp
     }
 
     for (y = 0; y < ysize; y++) {
-        UINT8* out = (UINT8*)imDest->image[dy + y] + dx * 4;
-        UINT8* outmask = (UINT8*)imDest->image[dy + y] + dx * 4 + 3;
-        UINT8* in = (UINT8*)imSrc->image[sy + y] + sx * (imSrc->pixelsize);
-        UINT8* inmask = (UINT8*)imMask->image[sy + y] + sx * mask_stride + mask_offset;
-
-        for (x = 0; x < xsize; x++) {
-            UINT8 in_alpha;
-
-            /* apply overall_alpha */
-            if (overall_alpha_int != 255 && *inmask != 0) {
-                in_alpha = OV_MULDIV255(*inmask, overall_alpha_int, tmp1);
-            } else {
-                in_alpha = *inmask;
-            }
-
-            /* special cases */
-            if (in_alpha == 255 || (*outmask == 0 && in_alpha > 0)) {
-                *outmask = in_alpha;
+        alpha_over_row((UINT8*)imDest->image[dy + y] + dx * 4,
+                       (UINT8*)imSrc->image[sy + y] + sx * (imSrc->pixelsize), src_has_alpha,
+                       (UINT8*)imMask->image[sy + y] + sx * mask_stride + mask_offset, mask_stride,
+                       overall_alpha_int, xsize);
+    }
 
-                *out = *in;
-                out++, in++;
-                *out = *in;
-                out++, in++;
-                *out = *in;
-                out++, in++;
-            } else if (in_alpha == 0) {
-                /* do nothing -- source is fully transparent */
-                out += 3;
-                in += 3;
-            } else {
-                /* general case */
-                int32_t alpha = in_alpha + OV_MULDIV255(*outmask, 255 - in_alpha, tmp1);
-                for (i = 0; i < 3; i++) {
-                    /* general case */
-                    *out = OV_MULDIV255(*in, in_alpha, tmp1) +
-                           OV_MULDIV255(OV_MULDIV255(*out, *outmask, tmp2), 255 - in_alpha, tmp3);
+    return dest;
+}
 
-                    *out = (*out * 255) / alpha;
-                    out++, in++;
-                }
+/* blits a native sprite (see Textures.build_atlas) onto dest, using the
+ * sprite's own alpha channel as the mask
+ */
+void alpha_over_sprite(Imaging dest, const Sprite* sprite, int32_t dx, int32_t dy) {
+    /* source position, and size */
+    int32_t sx, sy, xsize = 0, ysize = 0;
+    /* iteration variable */
+    int32_t y;
 
-                *outmask = alpha;
-            }
+    setup_source_destination(sprite->xsize, sprite->ysize, dest, &sx, &sy, &dx, &dy, &xsize, &ysize);
 
-            out++;
-            if (src_has_alpha)
-                in++;
-            outmask += 4;
-            inmask += mask_stride;
-        }
+    for (y = 0; y < ysize; y++) {
+        const UINT8* in = sprite->rgba + ((sy + y) * sprite->xsize + sx) * 4;
+        alpha_over_row((UINT8*)dest->image[dy + y] + dx * 4, in, 1, in + 3, 4, 255, xsize);
     }
-
-    return dest;
 }
 
 /* wraps alpha_over so it can be called directly from python */
@@ -289,10 +362,8 @@ tint_with_mask(PyObject* dest,
     int32_t mask_offset, mask_stride;
     /* source position */
     int32_t sx, sy;
-    /* iteration variables */
-    int32_t x, y;
-    /* temporary calculation variables */
-    int32_t tmp1, tmp2;
+    /* iteration variable */
+    int32_t y;
 
     imDest = imaging_python_to_c(dest);
     imMask = imaging_python_to_c(mask);
@@ -319,7 +390,7 @@ tint_with_mask(PyObject* dest,
     mask_stride = imMask->pixelsize;
 
     /* setup source & destination vars */
-    setup_source_destination(imMask, imDest, &sx, &sy, &dx, &dy, &xsize, &ysize);
+    setup_source_destination(imMask->xsize, imMask->ysize, imDest, &sx, &sy, &dx, &dy, &xsize, &ysize);
 
     /* check that there remains any blending to be done */
     if (xsize <= 0 || ysize <= 0) {
@@ -328,42 +399,32 @@ tint_with_mask(PyObject* dest,
     }
 
     for (y = 0; y < ysize; y++) {
-        UINT8* out = (UINT8*)imDest->image[dy + y] + dx * 4;
-        UINT8* inmask = (UINT8*)imMask->image[sy + y] + sx * mask_stride + mask_offset;
+        tint_row((UINT8*)imDest->image[dy + y] + dx * 4, sr, sg, sb, sa,
+                 (UINT8*)imMask->image[sy + y] + sx * mask_stride + mask_offset, mask_stride, xsize);
+    }
 
-        for (x = 0; x < xsize; x++) {
-            /* special cases */
-            if (*inmask == 255) {
-                *out = OV_MULDIV255(*out, sr, tmp1);
-                out++;
-                *out = OV_MULDIV255(*out, sg, tmp1);
-                out++;
-                *out = OV_MULDIV255(*out, sb, tmp1);
-                out++;
-                *out = OV_MULDIV255(*out, sa, tmp1);
-                out++;
-            } else if (*inmask == 0) {
-                /* do nothing -- source is fully transparent */
-                out += 4;
-            } else {
-                /* general case */
+    return dest;
+}
 
-                /* TODO work out general case */
-                *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sr, *inmask, tmp1), tmp2);
-                out++;
-                *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sg, *inmask, tmp1), tmp2);
-                out++;
-                *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sb, *inmask, tmp1), tmp2);
-                out++;
-                *out = OV_MULDIV255(*out, (255 - *inmask) + OV_MULDIV255(sa, *inmask, tmp1), tmp2);
-                out++;
-            }
+/* like tint_with_mask, but takes a native mask buffer of the given size,
+ * with mask_stride bytes between mask values (e.g. a sprite's light mask)
+ */
+void tint_with_native_mask(Imaging dest,
+                           uint8_t sr, uint8_t sg, uint8_t sb, uint8_t sa,
+                           const uint8_t* mask, int32_t mask_stride,
+                           int32_t mask_xsize, int32_t mask_ysize,
+                           int32_t dx, int32_t dy) {
+    /* source position, and size */
+    int32_t sx, sy, xsize = 0, ysize = 0;
+    /* iteration variable */
+    int32_t y;
+
+    setup_source_destination(mask_xsize, mask_ysize, dest, &sx, &sy, &dx, &dy, &xsize, &ysize);
 
-            inmask += mask_stride;
-        }
+    for (y = 0; y < ysize; y++) {
+        tint_row((UINT8*)dest->image[dy + y] + dx * 4, sr, sg, sb, sa,
+                 mask + ((sy + y) * mask_xsize + sx) * mask_stride, mask_stride, xsize);
     }
-
-    return dest;
 }
 
 /* draws a triangle on the destination image, multiplicatively!
@@ -651,3 +712,53 @@ resize_half_wrap(PyObject* self, PyObject* args) {
     }
     return ret;
 }
+
+/* calls one of the drawing functions above the given number of times, so
+ * they can be timed without the overhead of calling them from python:
+ *
+ *   repeat_primitive("alpha_over", n, dest, src)
+ *   repeat_primitive("tint_with_mask", n, dest, mask)
+ *   repeat_primitive("draw_triangle", n, dest, (x0, y0, x1, y1, x2, y2))
+ *   repeat_primitive("resize_half", n, dest, src)
+ *
+ * everything is drawn at the top left of dest
+ */
+PyObject*
+repeat_primitive(PyObject* self, PyObject* args) {
+    const char* name;
+    uint32_t iterations, i;
+    PyObject *dest, *arg;
+    int32_t x0, y0, x1, y1, x2, y2;
+
+    if (!PyArg_ParseTuple(args, "sIOO", &name, &iterations, &dest, &arg))
+        return NULL;
+
+    if (strcmp(name, "alpha_over") == 0) {
+        for (i = 0; i < iterations; i++) {
+            if (alpha_over_full(dest, arg, arg, 1.0f, 0, 0, 0, 0) == NULL)
+                return NULL;
+        }
+    } else if (strcmp(name, "tint_with_mask") == 0) {
+        for (i = 0; i < iterations; i++) {
+            if (tint_with_mask(dest, 200, 180, 160, 255, arg, 0, 0, 0, 0) == NULL)
+                return NULL;
+        }
+    } else if (strcmp(name, "draw_triangle") == 0) {
+        if (!PyArg_ParseTuple(arg, "iiiiii", &x0, &y0, &x1, &y1, &x2, &y2))
+            return NULL;
+        for (i = 0; i < iterations; i++) {
+            if (draw_triangle(dest, 1, x0, y0, 255, 200, 150, x1, y1, 200, 150, 255,
+                              x2, y2, 150, 255, 200, 0, 0, NULL, 0) == NULL)
+                return NULL;
+        }
+    } else if (strcmp(name, "resize_half") == 0) {
+        for (i = 0; i < iterations; i++) {
+            if (resize_half(dest, arg) == NULL)
+                return NULL;
+        }
+    } else {
+        return PyErr_Format(PyExc_ValueError, "unknown primitive: %s", name);
+    }
+
+    Py_RETURN_NONE;
+}
@@ -207,6 +207,88 @@ unload_all_chunks(RenderState* state) {
     }
 }
 
+/* fills in state->neighbours for the current section, see
+ * SectionNeighbours */
+static void
+load_section_neighbours(RenderState* state) {
+    /* the chunk columns to take blocks from, and the range of (section
+     * relative) x and z coordinates each of them covers */
+    static const int32_t columns[5][6] = {
+        /* dx, dz, x0, x1, z0, z1 */
+        {0, 0, 0, 16, 0, 16},
+        {1, 0, 16, 17, 0, 16},
+        {-1, 0, -1, 0, 0, 16},
+        {0, 1, 0, 16, 16, 17},
+        {0, -1, 0, 16, -1, 0},
+    };
+    SectionNeighbours* n = state->neighbours;
+    PyObject* texrot;
+    int32_t i, dy, x, y, z, y0, y1;
+
+    memset(n->blocks, 0, sizeof(n->blocks));
+    memset(n->data, 0, sizeof(n->data));
+
+    for (i = 0; i < 5; i++) {
+        int32_t dx = columns[i][0], dz = columns[i][1];
+        ChunkData* chunk = &(state->chunks[1 + dx][1 + dz]);
+        if (!chunk->loaded && load_chunk(state, dx, dz, 0))
+            continue;
+
+        for (dy = -1; dy <= 1; dy++) {
+            int32_t sectiony = state->chunky + dy;
+            PyArrayObject *blocks, *data;
+            if (sectiony < 0 || sectiony >= SECTIONS_PER_CHUNK)
+                continue;
+            blocks = chunk->sections[sectiony].blocks;
+            data = chunk->sections[sectiony].data;
+            if (blocks == NULL)
+                continue;
+
+            /* all of this section, or the one layer next to it */
+            y0 = dy < 0 ? -1 : dy * 16;
+            y1 = dy > 0 ? 17 : (dy + 1) * 16;
+            for (y = y0; y < y1; y++) {
+                for (z = columns[i][4]; z < columns[i][5]; z++) {
+                    for (x = columns[i][2]; x < columns[i][3]; x++) {
+                        n->blocks[y + 1][z + 1][x + 1] = getArrayShort3D(blocks, x - dx * 16, y - dy * 16, z - dz * 16);
+                        if (data != NULL)
+                            n->data[y + 1][z + 1][x + 1] = getArrayByte3D(data, x - dx * 16, y - dy * 16, z - dz * 16);
+                    }
+                }
+            }
+        }
+    }
+
+    for (y = 0; y < 16; y++) {
+        for (z = 0; z < 16; z++) {
+            for (x = 0; x < 16; x++) {
+                mc_block_t b = n->blocks[y + 1][z + 1][x + 1];
+                n->same[y][z][x] = ((n->blocks[y + 1][z + 1][x + 2] == b) << 3) |
+                                   ((n->blocks[y + 1][z + 2][x + 1] == b) << 2) |
+                                   ((n->blocks[y + 1][z + 1][x] == b) << 1) |
+                                   (n->blocks[y + 1][z][x + 1] == b) |
+                                   ((n->blocks[y + 2][z + 1][x + 1] == b) << 4);
+            }
+        }
+    }
+
+    /* need to get northdirection of the render for stairs */
+    n->northdir = 0;
+    texrot = PyObject_GetAttrString(state->textures, "rotation");
+    if (texrot != NULL) {
+        n->northdir = PyLong_AsLong(texrot);
+        Py_DECREF(texrot);
+    }
+    PyErr_Clear();
+
+    n->loaded = true;
+}
+
+/* block id and data of a block at most one block outside the current
+ * section, from state->neighbours */
+#define neighbour_block(state, x, y, z) ((state)->neighbours->blocks[(y) + 1][(z) + 1][(x) + 1])
+#define neighbour_data(state, x, y, z) ((state)->neighbours->data[(y) + 1][(z) + 1][(x) + 1])
+
 uint16_t
 check_adjacent_blocks(RenderState* state, int32_t x, int32_t y, int32_t z, mc_block_t blockid) {
     /*
@@ -223,20 +305,45 @@ check_adjacent_blocks(RenderState* state, int32_t x, int32_t y, int32_t z, mc_bl
      *         bit = 1 -> The corresponding side block has same blockid
      * Example: if the bit1 is 1 that means that there is a block with 
      * blockid in the side of the +x direction.
+     *
+     * x and z must be inside the section, y at most one block outside
+     * it. Comparing a block to its own id is precomputed in
+     * state->neighbours->same.
      */
 
     uint8_t pdata = 0;
 
-    if (get_data(state, BLOCKS, x + 1, y, z) == blockid) {
+    if (neighbour_block(state, x + 1, y, z) == blockid) {
         pdata = pdata | (1 << 3);
     }
-    if (get_data(state, BLOCKS, x, y, z + 1) == blockid) {
+    if (neighbour_block(state, x, y, z + 1) == blockid) {
         pdata = pdata | (1 << 2);
     }
-    if (get_data(state, BLOCKS, x - 1, y, z) == blockid) {
+    if (neighbour_block(state, x - 1, y, z) == blockid) {
         pdata = pdata | (1 << 1);
     }
-    if (get_data(state, BLOCKS, x, y, z - 1) == blockid) {
+    if (neighbour_block(state, x, y, z - 1) == blockid) {
+        pdata = pdata | (1 << 0);
+    }
+
+    return pdata;
+}
+
+/* like check_adjacent_blocks, but for any of the blocks in a class */
+static inline uint16_t
+check_adjacent_class(RenderState* state, int32_t x, int32_t y, int32_t z, const mc_block_t* block_class, size_t block_class_len) {
+    uint8_t pdata = 0;
+
+    if (block_class_is_subset(neighbour_block(state, x + 1, y, z), block_class, block_class_len)) {
+        pdata = pdata | (1 << 3);
+    }
+    if (block_class_is_subset(neighbour_block(state, x, y, z + 1), block_class, block_class_len)) {
+        pdata = pdata | (1 << 2);
+    }
+    if (block_class_is_subset(neighbour_block(state, x - 1, y, z), block_class, block_class_len)) {
+        pdata = pdata | (1 << 1);
+    }
+    if (block_class_is_subset(neighbour_block(state, x, y, z - 1), block_class, block_class_len)) {
         pdata = pdata | (1 << 0);
     }
 
@@ -251,16 +358,22 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
      */
     int32_t x = state->x, y = state->y, z = state->z;
     uint16_t data = 0;
+    uint8_t same;
+
+    if (!state->neighbours->loaded)
+        load_section_neighbours(state);
+    /* which neighbours have the same id as this block, 0x10 for above */
+    same = state->neighbours->same[y][z][x];
 
     if (state->block == block_grass) { /* grass */
         /* return 0x10 if grass is covered in snow */
-        if (get_data(state, BLOCKS, x, y + 1, z) == 78)
+        if (neighbour_block(state, x, y + 1, z) == 78)
             return 0x10;
         return ancilData;
     } else if (block_class_is_subset(state->block, (mc_block_t[]){block_flowing_water, block_water}, 2)) { /* water */
-        data = check_adjacent_blocks(state, x, y, z, state->block) ^ 0x0f;
+        data = (same & 0x0f) ^ 0x0f;
         /* an aditional bit for top is added to the 4 bits of check_adjacent_blocks */
-        if (get_data(state, BLOCKS, x, y + 1, z) != state->block)
+        if (!(same & 0x10))
             data |= 0x10;
         return data;
     } else if (block_class_is_subset(state->block, (mc_block_t[]){block_glass, block_ice, block_stained_glass}, 3)) { /* glass and ice and stained glass*/
@@ -268,18 +381,20 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
          * Note that stained glass encodes 16 colors using 4 bits.  this pushes us over the 8-bits of an uint8_t, 
          * forcing us to use an uint16_t to hold 16 bits of pseudo ancil data
          * */
-        if ((get_data(state, BLOCKS, x, y + 1, z) == 20) || (get_data(state, BLOCKS, x, y + 1, z) == 95)) {
+        if ((neighbour_block(state, x, y + 1, z) == 20) || (neighbour_block(state, x, y + 1, z) == 95)) {
             data = 0;
         } else {
             data = 16;
         }
-        data = (check_adjacent_blocks(state, x, y, z, state->block) ^ 0x0f) | data;
+        data = ((same & 0x0f) ^ 0x0f) | data;
         return (data << 4) | (ancilData & 0x0f);
     } else if (block_class_is_subset(state->block, block_class_fence, block_class_fence_len)) { /* fences */
         /* check for fences AND fence gates */
-        return check_adjacent_blocks(state, x, y, z, state->block) | check_adjacent_blocks(state, x, y, z, block_fence_gate) |
-               check_adjacent_blocks(state, x, y, z, block_fence_gate) | check_adjacent_blocks(state, x, y, z, block_birch_fence_gate) | check_adjacent_blocks(state, x, y, z, block_jungle_fence_gate) |
-               check_adjacent_blocks(state, x, y, z, block_dark_oak_fence_gate) | check_adjacent_blocks(state, x, y, z, block_acacia_fence_gate);
+        return (same & 0x0f) |
+               check_adjacent_class(state, x, y, z,
+                                    (mc_block_t[]){block_fence_gate, block_birch_fence_gate, block_jungle_fence_gate,
+                                                   block_dark_oak_fence_gate, block_acacia_fence_gate},
+                                    5);
 
     } else if (state->block == block_redstone_wire) { /* redstone */
         /* three addiotional bit are added, one for on/off state, and
@@ -288,12 +403,12 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
         uint8_t above_level_data = 0, same_level_data = 0, below_level_data = 0, possibly_connected = 0, final_data = 0;
 
         /* check for air in y+1, no air = no connection with upper level */
-        if (get_data(state, BLOCKS, x, y + 1, z) == 0) {
+        if (neighbour_block(state, x, y + 1, z) == 0) {
             above_level_data = check_adjacent_blocks(state, x, y + 1, z, state->block);
         } /* else above_level_data = 0 */
 
         /* check connection with same level (other redstone and trapped chests */
-        same_level_data = check_adjacent_blocks(state, x, y, z, 55) | check_adjacent_blocks(state, x, y, z, 146);
+        same_level_data = check_adjacent_class(state, x, y, z, (mc_block_t[]){55, 146}, 2);
 
         /* check the posibility of connection with y-1 level, check for air */
         possibly_connected = check_adjacent_blocks(state, x, y, z, 0);
@@ -327,7 +442,7 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
         uint8_t chest_data = 0, final_data = 0;
 
         /* search for adjacent chests of the same type */
-        chest_data = check_adjacent_blocks(state, x, y, z, state->block);
+        chest_data = same & 0x0f;
 
         if (chest_data == 1) { /* another chest in the upper-left */
             final_data = final_data | 0x10 | ancilData;
@@ -363,7 +478,7 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
 
     } else if (block_class_is_subset(state->block, (mc_block_t[]){block_portal, block_nether_brick_fence}, 2)) {
         /* portal and nether brick fences */
-        return check_adjacent_blocks(state, x, y, z, state->block);
+        return same & 0x0f;
 
     } else if (block_class_is_subset(state->block, block_class_door, block_class_door_len)) {
         /* use bottom block data format plus one bit for top/down
@@ -372,7 +487,7 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
         uint8_t data = 0;
         if ((ancilData & 0x8) == 0x8) {
             /* top door block */
-            uint8_t b_data = get_data(state, DATA, x, y - 1, z);
+            uint8_t b_data = neighbour_data(state, x, y - 1, z);
             if ((ancilData & 0x1) == 0x1) {
                 /* hinge on the left */
                 data = b_data | 0x8 | 0x10;
@@ -381,7 +496,7 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
             }
         } else {
             /* bottom door block */
-            uint8_t t_data = get_data(state, DATA, x, y + 1, z);
+            uint8_t t_data = neighbour_data(state, x, y + 1, z);
             if ((t_data & 0x1) == 0x1) {
                 /* hinge on the left */
                 data = ancilData | 0x10;
@@ -393,9 +508,9 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
     } else if (block_class_is_subset(state->block, block_class_wall, block_class_wall_len)) {
         /* check for walls and add one bit with the type of wall (mossy or cobblestone)*/
         if (ancilData == 0x1) {
-            return check_adjacent_blocks(state, x, y, z, state->block) | 0x10;
+            return (same & 0x0f) | 0x10;
         } else {
-            return check_adjacent_blocks(state, x, y, z, state->block);
+            return same & 0x0f;
         }
     } else if (state->block == block_waterlily) {
         int32_t wx, wz, wy, rotation;
@@ -452,12 +567,8 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
 
         uint8_t repair_rot[] = {0, 1, 2, 3, 2, 3, 1, 0, 1, 0, 3, 2, 3, 2, 0, 1};
 
-        /* need to get northdirection of the render */
-        /* TODO: get this just once? store in state? */
-        PyObject* texrot;
-        int32_t northdir;
-        texrot = PyObject_GetAttrString(state->textures, "rotation");
-        northdir = PyLong_AsLong(texrot);
+        /* northdirection of the render, looked up once per section */
+        int32_t northdir = state->neighbours->northdir;
 
 /* fix the rotation value for different northdirections */
 #define FIX_ROT(x) (((x) & ~0x3) | repair_rot[((x)&0x3) | (northdir << 2)])
@@ -468,14 +579,14 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
 
         /* get block & data for neighbors in this order: east, north, west, south */
         /* so we can rotate things easily */
-        stairs[0] = stairs[4] = block_class_is_subset(get_data(state, BLOCKS, x + 1, y, z), block_class_stair, block_class_stair_len);
-        stairs[1] = stairs[5] = block_class_is_subset(get_data(state, BLOCKS, x, y, z - 1), block_class_stair, block_class_stair_len);
-        stairs[2] = stairs[6] = block_class_is_subset(get_data(state, BLOCKS, x - 1, y, z), block_class_stair, block_class_stair_len);
-        stairs[3] = stairs[7] = block_class_is_subset(get_data(state, BLOCKS, x, y, z + 1), block_class_stair, block_class_stair_len);
-        neigh[0] = neigh[4] = FIX_ROT(get_data(state, DATA, x + 1, y, z));
-        neigh[1] = neigh[5] = FIX_ROT(get_data(state, DATA, x, y, z - 1));
-        neigh[2] = neigh[6] = FIX_ROT(get_data(state, DATA, x - 1, y, z));
-        neigh[3] = neigh[7] = FIX_ROT(get_data(state, DATA, x, y, z + 1));
+        stairs[0] = stairs[4] = block_class_is_subset(neighbour_block(state, x + 1, y, z), block_class_stair, block_class_stair_len);
+        stairs[1] = stairs[5] = block_class_is_subset(neighbour_block(state, x, y, z - 1), block_class_stair, block_class_stair_len);
+        stairs[2] = stairs[6] = block_class_is_subset(neighbour_block(state, x - 1, y, z), block_class_stair, block_class_stair_len);
+        stairs[3] = stairs[7] = block_class_is_subset(neighbour_block(state, x, y, z + 1), block_class_stair, block_class_stair_len);
+        neigh[0] = neigh[4] = FIX_ROT(neighbour_data(state, x + 1, y, z));
+        neigh[1] = neigh[5] = FIX_ROT(neighbour_data(state, x, y, z - 1));
+        neigh[2] = neigh[6] = FIX_ROT(neighbour_data(state, x - 1, y, z));
+        neigh[3] = neigh[7] = FIX_ROT(neighbour_data(state, x, y, z + 1));
 
 #undef FIX_ROT
 
@@ -521,8 +632,8 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
         /* use bottom block data format plus one bit for top
          * block (0x8)
          */
-        if (get_data(state, BLOCKS, x, y - 1, z) == block_double_plant) {
-            data = get_data(state, DATA, x, y - 1, z) | 0x8;
+        if (neighbour_block(state, x, y - 1, z) == block_double_plant) {
+            data = neighbour_data(state, x, y - 1, z) | 0x8;
         } else {
             data = ancilData;
         }
@@ -533,54 +644,154 @@ generate_pseudo_data(RenderState* state, uint16_t ancilData) {
     return 0;
 }
 
-/* TODO triple check this to make sure reference counting is correct */
-PyObject*
-chunk_render(PyObject* self, PyObject* args) {
-    RenderState state;
-    PyObject* modeobj;
-    PyObject* blockmap;
+/* the native sprite atlas built by Textures.build_atlas, held through
+ * the buffer protocol (we don't use the numpy C API, see main.c) */
+typedef struct {
+    bool loaded;
+    Py_buffer sprites, light, index;
+} SpriteAtlas;
 
-    int32_t xoff, yoff;
+static void
+release_atlas(SpriteAtlas* atlas) {
+    if (atlas->loaded) {
+        PyBuffer_Release(&(atlas->sprites));
+        PyBuffer_Release(&(atlas->light));
+        PyBuffer_Release(&(atlas->index));
+        atlas->loaded = false;
+    }
+}
+
+/* helper for load_atlas, gets a C-contiguous buffer from a textures
+ * attribute with the given number of dimensions and item format.
+ * returns true on error, with no exception set */
+static bool
+get_atlas_buffer(PyObject* textures, const char* name, Py_buffer* view, int32_t ndim, char format) {
+    PyObject* obj = PyObject_GetAttrString(textures, name);
+    if (obj == NULL || PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0) {
+        Py_XDECREF(obj);
+        PyErr_Clear();
+        return true;
+    }
+    /* the view holds its own reference to obj */
+    Py_DECREF(obj);
+
+    if (view->ndim != ndim || view->format == NULL ||
+        view->format[strlen(view->format) - 1] != format) {
+        PyBuffer_Release(view);
+        return true;
+    }
+    return false;
+}
+
+/* fetches the atlas buffers from the textures object, and makes sure they
+ * have the layout we index into directly. If they don't, the atlas is
+ * left unloaded and we fall back to the PIL images in the blockmap. */
+static void
+load_atlas(PyObject* textures, SpriteAtlas* atlas) {
+    atlas->loaded = false;
+
+    if (get_atlas_buffer(textures, "atlas", &(atlas->sprites), 4, 'B'))
+        return;
+    if (get_atlas_buffer(textures, "atlas_light", &(atlas->light), 3, 'B')) {
+        PyBuffer_Release(&(atlas->sprites));
+        return;
+    }
+    if (get_atlas_buffer(textures, "atlas_index", &(atlas->index), 1, 'i')) {
+        PyBuffer_Release(&(atlas->sprites));
+        PyBuffer_Release(&(atlas->light));
+        return;
+    }
+    atlas->loaded = true;
+
+    if (atlas->sprites.shape[3] != 4 || atlas->index.itemsize != sizeof(int32_t) ||
+        atlas->sprites.shape[0] != atlas->light.shape[0] ||
+        atlas->sprites.shape[1] != atlas->light.shape[1] ||
+        atlas->sprites.shape[2] != atlas->light.shape[2] ||
+        atlas->index.shape[0] != max_blockid * max_data) {
+        release_atlas(atlas);
+    }
+}
+
+/* returns the blockmap entry for a slot (a borrowed reference), first
+ * asking the textures object to generate it if it was left out by a lazy
+ * generate(). Returns NULL if there's nothing to draw. */
+static PyObject*
+get_block_texture(PyObject* textures, PyObject* blockmap, uint32_t slot) {
+    PyObject* t = PyList_GET_ITEM(blockmap, slot);
+    if (t == Py_Ellipsis) {
+        PyObject* ret = PyObject_CallMethod(textures, "generate_slot", "I", slot);
+        if (ret == NULL) {
+            /* generate_slot() leaves None behind, so this is only
+             * reported once */
+            PyErr_Print();
+            return NULL;
+        }
+        Py_DECREF(ret);
+        t = PyList_GET_ITEM(blockmap, slot);
+    }
+    if (t == Py_None || t == Py_Ellipsis)
+        return NULL;
+    return t;
+}
+
+/* draws the loaded section in state into state->img, at the given offset and
+ * with the given rendermode. returns true on error, with PyErr set. */
+static bool
+render_section(RenderState* state, PyObject* modeobj, int32_t xoff, int32_t yoff) {
+    PyObject* blockmap;
+    SpriteAtlas atlas;
+    Sprite sprite;
 
     PyObject *imgsize, *imgsize0_py, *imgsize1_py;
     int32_t imgsize0, imgsize1;
 
     PyArrayObject* blocks_py;
-    PyArrayObject* left_blocks_py;
-    PyArrayObject* right_blocks_py;
-    PyArrayObject* up_left_blocks_py;
-    PyArrayObject* up_right_blocks_py;
 
     RenderMode* rendermode;
 
-    int32_t i, j;
-
     PyObject* t = NULL;
+    uint32_t slot;
 
-    if (!PyArg_ParseTuple(args, "OOiiiOiiOO", &state.world, &state.regionset, &state.chunkx, &state.chunky, &state.chunkz, &state.img, &xoff, &yoff, &modeobj, &state.textures))
-        return NULL;
+    /* resolve the native image once, rather than on every draw */
+    state->imgcore = imaging_python_to_c(state->img);
+    if (state->imgcore == NULL)
+        return true;
+    if (strcmp(state->imgcore->mode, "RGBA") != 0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "given destination image does not have mode \"RGBA\"");
+        return true;
+    }
+    state->sprite = NULL;
 
     /* set up the render mode */
-    state.rendermode = rendermode = render_mode_create(modeobj, &state);
+    state->rendermode = rendermode = render_mode_get(modeobj, state);
     if (rendermode == NULL) {
-        return NULL; // note that render_mode_create will
+        return true; // note that render_mode_get will
                      // set PyErr.  No need to set it here
     }
 
     /* get the blockmap from the textures object */
-    blockmap = PyObject_GetAttrString(state.textures, "blockmap");
+    blockmap = PyObject_GetAttrString(state->textures, "blockmap");
     if (blockmap == NULL) {
-        render_mode_destroy(rendermode);
-        return NULL;
+        render_mode_release(rendermode);
+        return true;
     }
     if (blockmap == Py_None) {
-        render_mode_destroy(rendermode);
+        render_mode_release(rendermode);
+        Py_DECREF(blockmap);
         PyErr_SetString(PyExc_RuntimeError, "you must call Textures.generate()");
-        return NULL;
+        return true;
+    }
+
+    /* get the native sprite atlas, if there is one */
+    load_atlas(state->textures, &atlas);
+    if (atlas.loaded) {
+        sprite.ysize = atlas.sprites.shape[1];
+        sprite.xsize = atlas.sprites.shape[2];
     }
 
     /* get the image size */
-    imgsize = PyObject_GetAttrString(state.img, "size");
+    imgsize = PyObject_GetAttrString(state->img, "size");
 
     imgsize0_py = PySequence_GetItem(imgsize, 0);
     imgsize1_py = PySequence_GetItem(imgsize, 1);
@@ -591,103 +802,83 @@ chunk_render(PyObject* self, PyObject* args) {
     Py_DECREF(imgsize0_py);
     Py_DECREF(imgsize1_py);
 
-    /* set all block data to unloaded */
-    for (i = 0; i < 3; i++) {
-        for (j = 0; j < 3; j++) {
-            state.chunks[i][j].loaded = 0;
-        }
-    }
-
-    /* get the block data for the center column, erroring out if needed */
-    if (load_chunk(&state, 0, 0, 1)) {
-        render_mode_destroy(rendermode);
-        Py_DECREF(blockmap);
-        return NULL;
-    }
-    if (state.chunks[1][1].sections[state.chunky].blocks == NULL) {
-        /* this section doesn't exist, let's skeddadle */
-        render_mode_destroy(rendermode);
-        Py_DECREF(blockmap);
-        unload_all_chunks(&state);
-        Py_RETURN_NONE;
-    }
-
-    /* set blocks_py, state.blocks, and state.blockdatas as convenience */
-    blocks_py = state.blocks = state.chunks[1][1].sections[state.chunky].blocks;
-    state.blockdatas = state.chunks[1][1].sections[state.chunky].data;
+    blocks_py = state->blocks;
 
     /* set up the random number generator again for each chunk
        so tallgrass is in the same place, no matter what mode is used */
     srand(1);
 
-    for (state.x = 15; state.x > -1; state.x--) {
-        for (state.z = 0; state.z < 16; state.z++) {
+    for (state->x = 15; state->x > -1; state->x--) {
+        for (state->z = 0; state->z < 16; state->z++) {
 
             /* set up the render coordinates */
-            state.imgx = xoff + state.x * 12 + state.z * 12;
+            state->imgx = xoff + state->x * 12 + state->z * 12;
             /* 16*12 -- offset for y direction, 15*6 -- offset for x */
-            state.imgy = yoff - state.x * 6 + state.z * 6 + 16 * 12 + 15 * 6;
+            state->imgy = yoff - state->x * 6 + state->z * 6 + 16 * 12 + 15 * 6;
 
-            for (state.y = 0; state.y < 16; state.y++) {
+            for (state->y = 0; state->y < 16; state->y++) {
                 uint16_t ancilData;
 
-                state.imgy -= 12;
+                state->imgy -= 12;
                 /* get blockid */
-                state.block = getArrayShort3D(blocks_py, state.x, state.y, state.z);
-                if (state.block == block_air || render_mode_hidden(rendermode, state.x, state.y, state.z)) {
+                state->block = getArrayShort3D(blocks_py, state->x, state->y, state->z);
+                if (state->block == block_air || render_mode_hidden(rendermode, state->x, state->y, state->z)) {
                     continue;
                 }
 
                 /* make sure we're rendering inside the image boundaries */
-                if ((state.imgx >= imgsize0 + 24) || (state.imgx <= -24)) {
+                if ((state->imgx >= imgsize0 + 24) || (state->imgx <= -24)) {
                     continue;
                 }
-                if ((state.imgy >= imgsize1 + 24) || (state.imgy <= -24)) {
+                if ((state->imgy >= imgsize1 + 24) || (state->imgy <= -24)) {
                     continue;
                 }
 
                 /* check for occlusion */
-                if (render_mode_occluded(rendermode, state.x, state.y, state.z)) {
+                if (render_mode_occluded(rendermode, state->x, state->y, state->z)) {
                     continue;
                 }
 
                 /* everything stored here will be a borrowed ref */
 
-                if (block_has_property(state.block, NODATA)) {
+                if (block_has_property(state->block, NODATA)) {
                     /* block shouldn't have data associated with it, set it to 0 */
                     ancilData = 0;
-                    state.block_data = 0;
-                    state.block_pdata = 0;
+                    state->block_data = 0;
+                    state->block_pdata = 0;
                 } else {
                     /* block has associated data, use it */
-                    ancilData = getArrayByte3D(state.blockdatas, state.x, state.y, state.z);
-                    state.block_data = ancilData;
+                    ancilData = getArrayByte3D(state->blockdatas, state->x, state->y, state->z);
+                    state->block_data = ancilData;
                     /* block that need pseudo ancildata:
                      * grass, water, glass, chest, restone wire,
                      * ice, fence, portal, iron bars, glass panes,
                      * trapped chests, stairs */
-                    if (block_class_is_subset(state.block, block_class_ancil, block_class_ancil_len)) {
-                        ancilData = generate_pseudo_data(&state, ancilData);
-                        state.block_pdata = ancilData;
+                    if (block_class_is_subset(state->block, block_class_ancil, block_class_ancil_len)) {
+                        ancilData = generate_pseudo_data(state, ancilData);
+                        state->block_pdata = ancilData;
                     } else {
-                        state.block_pdata = 0;
+                        state->block_pdata = 0;
                     }
                 }
 
                 /* make sure our block info is in-bounds */
-                if (state.block >= max_blockid || ancilData >= max_data)
+                if (state->block >= max_blockid || ancilData >= max_data)
                     continue;
 
                 /* get the texture */
-                t = PyList_GET_ITEM(blockmap, max_data * state.block + ancilData);
+                slot = max_data * state->block + ancilData;
+                t = get_block_texture(state->textures, blockmap, slot);
                 /* if we don't get a texture, try it again with 0 data */
-                if ((t == NULL || t == Py_None) && ancilData != 0)
-                    t = PyList_GET_ITEM(blockmap, max_data * state.block);
+                if (t == NULL && ancilData != 0) {
+                    slot = max_data * state->block;
+                    t = get_block_texture(state->textures, blockmap, slot);
+                }
 
                 /* if we found a proper texture, render it! */
-                if (t != NULL && t != Py_None) {
+                if (t != NULL) {
                     PyObject *src, *mask, *mask_light;
-                    int32_t do_rand = (state.block == block_tallgrass /*|| state.block == block_red_flower || state.block == block_double_plant*/);
+                    int32_t do_rand = (state->block == block_tallgrass /*|| state->block == block_red_flower || state->block == block_double_plant*/);
                     int32_t randx = 0, randy = 0;
                     src = PyTuple_GetItem(t, 0);
                     mask = PyTuple_GetItem(t, 0);
@@ -696,20 +887,31 @@ chunk_render(PyObject* self, PyObject* args) {
                     if (mask == Py_None)
                         mask = src;
 
+                    /* point at the native copy of this sprite, if any */
+                    state->sprite = NULL;
+                    if (atlas.loaded) {
+                        int32_t sprite_index = ((int32_t*)atlas.index.buf)[slot];
+                        if (sprite_index >= 0) {
+                            sprite.rgba = (uint8_t*)atlas.sprites.buf + sprite_index * atlas.sprites.strides[0];
+                            sprite.light = (uint8_t*)atlas.light.buf + sprite_index * atlas.light.strides[0];
+                            state->sprite = &sprite;
+                        }
+                    }
+
                     if (do_rand) {
                         /* add a random offset to the postion of the tall grass to make it more wild */
                         randx = rand() % 6 + 1 - 3;
                         randy = rand() % 6 + 1 - 3;
-                        state.imgx += randx;
-                        state.imgy += randy;
+                        state->imgx += randx;
+                        state->imgy += randy;
                     }
 
                     render_mode_draw(rendermode, src, mask, mask_light);
 
                     if (do_rand) {
                         /* undo the random offsets */
-                        state.imgx -= randx;
-                        state.imgy -= randy;
+                        state->imgx -= randx;
+                        state->imgy -= randy;
                     }
                 }
             }
@@ -717,10 +919,127 @@ chunk_render(PyObject* self, PyObject* args) {
     }
 
     /* free up the rendermode info */
-    render_mode_destroy(rendermode);
+    render_mode_release(rendermode);
+    state->rendermode = NULL;
 
     Py_DECREF(blockmap);
+    release_atlas(&atlas);
+
+    return false;
+}
+
+/* loads the center chunk of state, and points state at its section.
+ * returns true on error (PyErr set), and sets *missing if there's no
+ * section there to draw */
+static bool
+load_render_section(RenderState* state, bool* missing) {
+    int32_t i, j;
+
+    /* set all block data to unloaded */
+    for (i = 0; i < 3; i++) {
+        for (j = 0; j < 3; j++) {
+            state->chunks[i][j].loaded = 0;
+        }
+    }
+
+    /* get the block data for the center column, erroring out if needed */
+    if (load_chunk(state, 0, 0, 1)) {
+        return true;
+    }
+    *missing = (state->chunks[1][1].sections[state->chunky].blocks == NULL);
+    if (*missing) {
+        /* this section doesn't exist, let's skeddadle */
+        unload_all_chunks(state);
+        return false;
+    }
+
+    /* set state->blocks and state->blockdatas as convenience */
+    state->blocks = state->chunks[1][1].sections[state->chunky].blocks;
+    state->blockdatas = state->chunks[1][1].sections[state->chunky].data;
+    return false;
+}
+
+/* TODO triple check this to make sure reference counting is correct */
+PyObject*
+chunk_render(PyObject* self, PyObject* args) {
+    RenderState state;
+    PyObject* modeobj;
+    SectionNeighbours neighbours;
+    int32_t xoff, yoff;
+    bool missing;
+    bool failed;
+
+    if (!PyArg_ParseTuple(args, "OOiiiOiiOO", &state.world, &state.regionset, &state.chunkx, &state.chunky, &state.chunkz, &state.img, &xoff, &yoff, &modeobj, &state.textures))
+        return NULL;
+
+    neighbours.loaded = false;
+    state.neighbours = &neighbours;
+
+    if (load_render_section(&state, &missing))
+        return NULL;
+    if (missing)
+        Py_RETURN_NONE;
+
+    failed = render_section(&state, modeobj, xoff, yoff);
     unload_all_chunks(&state);
+    if (failed)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
+/* like chunk_render, but draws the section into several images, each with
+ * its own rendermode and textures. The chunks (and the blocks around the
+ * section) are only loaded once for all of them. outputs is a sequence of
+ * (img, xoff, yoff, rendermode, textures) tuples. */
+PyObject*
+chunk_render_multi(PyObject* self, PyObject* args) {
+    RenderState state;
+    PyObject* outputs;
+    PyObject* last_textures = NULL;
+    SectionNeighbours neighbours;
+    Py_ssize_t i;
+    bool missing;
+    bool failed = false;
+
+    if (!PyArg_ParseTuple(args, "OOiiiO", &state.world, &state.regionset, &state.chunkx, &state.chunky, &state.chunkz, &outputs))
+        return NULL;
+    outputs = PySequence_Fast(outputs, "outputs must be a sequence");
+    if (outputs == NULL)
+        return NULL;
+
+    neighbours.loaded = false;
+    state.neighbours = &neighbours;
+
+    if (load_render_section(&state, &missing)) {
+        Py_DECREF(outputs);
+        return NULL;
+    }
+    if (missing) {
+        Py_DECREF(outputs);
+        Py_RETURN_NONE;
+    }
+
+    for (i = 0; i < PySequence_Fast_GET_SIZE(outputs) && !failed; i++) {
+        PyObject* modeobj;
+        int32_t xoff, yoff;
+
+        if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(outputs, i), "OiiOO", &state.img, &xoff, &yoff, &modeobj, &state.textures)) {
+            failed = true;
+            break;
+        }
+        /* the neighbours depend on the textures' rotation */
+        if (state.textures != last_textures)
+            neighbours.loaded = false;
+        last_textures = state.textures;
+
+        failed = render_section(&state, modeobj, xoff, yoff);
+    }
+
+    unload_all_chunks(&state);
+    Py_DECREF(outputs);
+    if (failed)
+        return NULL;
 
     Py_RETURN_NONE;
 }
@@ -32,6 +32,18 @@ static PyMethodDef COverviewerMethods[] = {
     {"render_loop", chunk_render, METH_VARARGS,
      "Renders stuffs"},
 
+    {"render_loop_multi", chunk_render_multi, METH_VARARGS,
+     "Renders a section into several images at once"},
+
+    {"create_rendermode", create_rendermode, METH_VARARGS,
+     "Sets up a list of render primitives once, for reuse with render_loop"},
+
+    {"rendermode_profile", rendermode_profile, METH_VARARGS,
+     "Returns the per-primitive counters of a rendermode, if built with RENDER_PROFILE"},
+
+    {"repeat_primitive", repeat_primitive, METH_VARARGS,
+     "Runs a drawing function many times, for benchmarks"},
+
     {"extension_version", get_extension_version, METH_VARARGS,
      "Returns the extension version"},
 
@@ -66,5 +78,8 @@ PyInit_c_overviewer(void) {
     }
 
     init_endian();
+#ifdef RENDER_PROFILE
+    PyModule_AddStringConstant(mod, "profile_unit", RENDER_PROFILE_UNIT);
+#endif
     return mod;
 }
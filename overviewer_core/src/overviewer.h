@@ -31,7 +31,7 @@
 
 // increment this value if you've made a change to the c extesion
 // and want to force users to rebuild
-#define OVERVIEWER_EXTENSION_VERSION 74
+#define OVERVIEWER_EXTENSION_VERSION 80
 
 #include <stdbool.h>
 #include <stdint.h>
@@ -53,6 +53,15 @@
 #define getArrayShort3D(array, x, y, z) (*(uint16_t*)(PyArray_GETPTR3((array), (y), (z), (x))))
 #define getArrayByte2D(array, x, y) (*(uint8_t*)(PyArray_GETPTR2((array), (y), (x))))
 
+/* a block sprite in the native atlas built by Textures.build_atlas */
+typedef struct {
+    int32_t xsize, ysize;
+    /* xsize * ysize RGBA pixels */
+    const uint8_t* rgba;
+    /* xsize * ysize lighting mask values */
+    const uint8_t* light;
+} Sprite;
+
 /* in composite.c */
 Imaging imaging_python_to_c(PyObject* obj);
 PyObject* alpha_over(PyObject* dest, PyObject* src, PyObject* mask,
@@ -63,6 +72,10 @@ PyObject* alpha_over_wrap(PyObject* self, PyObject* args);
 PyObject* tint_with_mask(PyObject* dest, uint8_t sr, uint8_t sg,
                          uint8_t sb, uint8_t sa,
                          PyObject* mask, int32_t dx, int32_t dy, int32_t xsize, int32_t ysize);
+void alpha_over_sprite(Imaging dest, const Sprite* sprite, int32_t dx, int32_t dy);
+void tint_with_native_mask(Imaging dest, uint8_t sr, uint8_t sg, uint8_t sb, uint8_t sa,
+                           const uint8_t* mask, int32_t mask_stride,
+                           int32_t mask_xsize, int32_t mask_ysize, int32_t dx, int32_t dy);
 PyObject* draw_triangle(PyObject* dest, int32_t inclusive,
                         int32_t x0, int32_t y0,
                         uint8_t r0, uint8_t g0, uint8_t b0,
@@ -73,6 +86,7 @@ PyObject* draw_triangle(PyObject* dest, int32_t inclusive,
                         int32_t tux, int32_t tuy, int32_t* touchups, uint32_t num_touchups);
 PyObject* resize_half(PyObject* dest, PyObject* src);
 PyObject* resize_half_wrap(PyObject* self, PyObject* args);
+PyObject* repeat_primitive(PyObject* self, PyObject* args);
 
 /* forward declaration of RenderMode object */
 typedef struct _RenderMode RenderMode;
@@ -90,6 +104,25 @@ typedef struct {
         PyArrayObject *blocks, *data, *skylight, *blocklight;
     } sections[SECTIONS_PER_CHUNK];
 } ChunkData;
+/* the blocks around the section being rendered, for working out pseudo
+ * data without going through get_data for every neighbour. Filled in by
+ * load_section_neighbours the first time a block in the section needs
+ * pseudo data. */
+typedef struct {
+    bool loaded;
+    /* block ids and data of the section plus a one block border from the
+     * sections and chunks around it, indexed [y + 1][z + 1][x + 1]. Only
+     * the columns sharing a side with this chunk are loaded, so the
+     * diagonal corners of the border are always air */
+    mc_block_t blocks[18][18][18];
+    uint8_t data[18][18][18];
+    /* for each block of the section, which neighbours have the same id:
+     * 0x08 +x, 0x04 +z, 0x02 -x, 0x01 -z (as in check_adjacent_blocks)
+     * and 0x10 for the block above */
+    uint8_t same[16][16][16];
+    /* the north direction of the textures, for stairs */
+    int32_t northdir;
+} SectionNeighbours;
 typedef struct {
     /* the regionset object, and chunk coords */
     PyObject* world;
@@ -99,6 +132,8 @@ typedef struct {
     /* the tile image and destination */
     PyObject* img;
     int32_t imgx, imgy;
+    /* the libImaging handle for img, resolved once per chunk */
+    Imaging imgcore;
 
     /* the current render mode in use */
     RenderMode* rendermode;
@@ -111,6 +146,8 @@ typedef struct {
     mc_block_t block;
     uint8_t block_data;
     uint16_t block_pdata;
+    /* the atlas sprite for this block, or NULL if it isn't in the atlas */
+    const Sprite* sprite;
 
     /* useful information about this, and neighboring, chunks */
     PyArrayObject* blockdatas;
@@ -118,11 +155,14 @@ typedef struct {
 
     /* 3x3 array of this and neighboring chunk columns */
     ChunkData chunks[3][3];
+    /* the blocks around this section, see generate_pseudo_data */
+    SectionNeighbours* neighbours;
 } RenderState;
 PyObject* init_chunk_render(void);
 /* returns true on error, x,z relative */
 bool load_chunk(RenderState* state, int32_t x, int32_t z, uint8_t required);
 PyObject* chunk_render(PyObject* self, PyObject* args);
+PyObject* chunk_render_multi(PyObject* self, PyObject* args);
 typedef enum {
     KNOWN,
     TRANSPARENT,
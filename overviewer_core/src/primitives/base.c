@@ -80,7 +80,10 @@ base_draw(void* data, RenderState* state, PyObject* src, PyObject* mask, PyObjec
     uint8_t below_data = get_data(state, DATA, state->x, state->y - 1, state->z);
 
     /* draw the block! */
-    alpha_over(state->img, src, mask, state->imgx, state->imgy, 0, 0);
+    if (state->sprite != NULL)
+        alpha_over_sprite(state->imgcore, state->sprite, state->imgx, state->imgy);
+    else
+        alpha_over(state->img, src, mask, state->imgx, state->imgy, 0, 0);
 
     /* check for biome-compatible blocks
      *
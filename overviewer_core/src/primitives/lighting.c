@@ -148,10 +148,10 @@ estimate_blocklevel(RenderPrimitiveLighting* self, RenderState* state,
     return blocklevel;
 }
 
-inline void
-get_lighting_color(RenderPrimitiveLighting* self, RenderState* state,
-                   int32_t x, int32_t y, int32_t z,
-                   uint8_t* r, uint8_t* g, uint8_t* b) {
+static void
+calculate_lighting_color(RenderPrimitiveLighting* self, RenderState* state,
+                         int32_t x, int32_t y, int32_t z,
+                         uint8_t* r, uint8_t* g, uint8_t* b) {
 
     /* placeholders for later data arrays, coordinates */
     mc_block_t block;
@@ -192,7 +192,35 @@ get_lighting_color(RenderPrimitiveLighting* self, RenderState* state,
         return;
     }
 
-    self->calculate_light_color(self, OV_MIN(skylevel, 15), OV_MIN(blocklevel, 15), r, g, b);
+    skylevel = OV_MIN(skylevel, 15);
+    blocklevel = OV_MIN(blocklevel, 15);
+    *r = self->light_lut[skylevel][blocklevel][0];
+    *g = self->light_lut[skylevel][blocklevel][1];
+    *b = self->light_lut[skylevel][blocklevel][2];
+}
+
+/* the lighting color of the block at x, y, z. The same blocks are lit
+   from several faces (and, in smooth lighting, several corners of each),
+   so the colors around the section are remembered in self->color_cache */
+void
+get_lighting_color(RenderPrimitiveLighting* self, RenderState* state,
+                   int32_t x, int32_t y, int32_t z,
+                   uint8_t* r, uint8_t* g, uint8_t* b) {
+    uint32_t* cached = NULL;
+
+    if (x >= -2 && x < 18 && y >= -2 && y < 18 && z >= -2 && z < 18) {
+        cached = &(self->color_cache[y + 2][z + 2][x + 2]);
+        if (*cached) {
+            *r = (*cached >> 16) & 0xff;
+            *g = (*cached >> 8) & 0xff;
+            *b = *cached & 0xff;
+            return;
+        }
+    }
+
+    calculate_lighting_color(self, state, x, y, z, r, g, b);
+    if (cached)
+        *cached = 0xff000000 | (*r << 16) | (*g << 8) | *b;
 }
 
 /* does per-face occlusion checking for do_shading_with_mask */
@@ -238,12 +266,20 @@ do_shading_with_mask(RenderPrimitiveLighting* self, RenderState* state,
     g += (255 - g) * comp_strength;
     b += (255 - b) * comp_strength;
 
+    /* a NULL mask means the light mask of the current atlas sprite */
+    if (mask == NULL) {
+        tint_with_native_mask(state->imgcore, r, g, b, 255, state->sprite->light, 1,
+                              state->sprite->xsize, state->sprite->ysize, state->imgx, state->imgy);
+        return;
+    }
+
     tint_with_mask(state->img, r, g, b, 255, mask, state->imgx, state->imgy, 0, 0);
 }
 
 static bool
 lighting_start(void* data, RenderState* state, PyObject* support) {
     RenderPrimitiveLighting* self;
+    uint8_t skylight, blocklight;
     self = (RenderPrimitiveLighting*)data;
 
     /* don't skip sides by default */
@@ -285,9 +321,24 @@ lighting_start(void* data, RenderState* state, PyObject* support) {
         self->lightcolor = NULL;
     }
 
+    for (skylight = 0; skylight < 16; skylight++) {
+        for (blocklight = 0; blocklight < 16; blocklight++) {
+            uint8_t* rgb = self->light_lut[skylight][blocklight];
+            self->calculate_light_color(self, skylight, blocklight, &rgb[0], &rgb[1], &rgb[2]);
+        }
+    }
+
     return false;
 }
 
+static void
+lighting_reset(void* data, RenderState* state) {
+    RenderPrimitiveLighting* self = (RenderPrimitiveLighting*)data;
+
+    /* the cached colors are only good for one section */
+    memset(self->color_cache, 0, sizeof(self->color_cache));
+}
+
 static void
 lighting_finish(void* data, RenderState* state) {
     RenderPrimitiveLighting* self = (RenderPrimitiveLighting*)data;
@@ -320,7 +371,7 @@ lighting_draw(void* data, RenderState* state, PyObject* src, PyObject* mask, PyO
          * per face-shading to look as in game */
     } else if (is_transparent(state->block) && (state->block != 18) && (state->block != 79)) {
         /* transparent: do shading on whole block */
-        do_shading_with_mask(self, state, x, y, z, mask_light);
+        do_shading_with_mask(self, state, x, y, z, state->sprite != NULL ? NULL : mask_light);
     } else {
         /* opaque: do per-face shading */
         do_shading_with_mask(self, state, x, y + 1, z, self->facemasks[0]);
@@ -337,4 +388,5 @@ RenderPrimitiveInterface primitive_lighting = {
     NULL,
     NULL,
     lighting_draw,
+    lighting_reset,
 };
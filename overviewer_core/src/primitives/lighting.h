@@ -36,6 +36,15 @@ typedef struct {
     float strength;
     int32_t color;
     int32_t night;
+
+    /* calculate_light_color for every (skylight, blocklight), filled in by
+       lighting_start so it's only called 256 times per section */
+    uint8_t light_lut[16][16][3];
+
+    /* get_lighting_color results for the section and the two blocks
+       around it, indexed [y + 2][z + 2][x + 2]. 0 means not worked out
+       yet, otherwise it's 0xff000000 | r << 16 | g << 8 | b */
+    uint32_t color_cache[20][20][20];
 } RenderPrimitiveLighting;
 
 /* exposed so that smooth-lighting can use them */
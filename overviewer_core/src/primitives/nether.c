@@ -61,6 +61,15 @@ nether_hidden(void* data, RenderState* state, int32_t x, int32_t y, int32_t z) {
     return self->remove_block[x + 1][real_y][z + 1];
 }
 
+static void
+nether_reset(void* data, RenderState* state) {
+    RenderPrimitiveNether* self = (RenderPrimitiveNether*)data;
+
+    /* the roof is walked again for every section */
+    self->walked_chunk = false;
+    memset(self->remove_block, 0, sizeof(self->remove_block));
+}
+
 RenderPrimitiveInterface primitive_nether = {
     "nether",
     sizeof(RenderPrimitiveNether),
@@ -69,4 +78,5 @@ RenderPrimitiveInterface primitive_nether = {
     NULL,
     nether_hidden,
     NULL,
+    nether_reset,
 };
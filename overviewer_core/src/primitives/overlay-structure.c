@@ -18,13 +18,6 @@
 #include "../mc_id.h"
 #include "overlay.h"
 
-typedef struct {
-    /* inherits from overlay */
-    RenderPrimitiveOverlay parent;
-    void* structures;
-    int32_t numcolors;
-} RenderPrimitiveStructure;
-
 struct Condition {
     int32_t relx, rely, relz;
     mc_block_t block;
@@ -36,6 +29,84 @@ struct Color {
     uint8_t r, g, b, a;
 };
 
+/* Whether a structure matches at a block is the same for every block
+ * above it in the column, so for each column of a chunk we remember how
+ * far up (counting from the bottom of the world) each structure has been
+ * searched for, and the lowest y it was found at (or -1).
+ *
+ * The sections of a chunk are drawn in separate render_loop calls,
+ * interleaved with those of the other chunks in the tile, so this is
+ * kept in a small table of recently drawn chunks. It lives as long as the
+ * rendermode, which is the whole tileset for one made with
+ * create_rendermode. */
+#define COLUMN_CACHE_SIZE 256
+
+typedef struct {
+    bool used;
+    int32_t chunkx, chunkz;
+    /* [numcolors][16][16] each */
+    int16_t* searched;
+    int16_t* matched;
+} ColumnCacheEntry;
+
+typedef struct {
+    /* inherits from overlay */
+    RenderPrimitiveOverlay parent;
+    void* structures;
+    int32_t numcolors;
+    /* the table is only valid for this regionset, a held reference so
+     * its address can't be reused */
+    PyObject* cache_regionset;
+    ColumnCacheEntry column_cache[COLUMN_CACHE_SIZE];
+} RenderPrimitiveStructure;
+
+/* returns the column cache entry for the current chunk, or NULL if it
+ * can't be allocated */
+static ColumnCacheEntry* get_column_cache(RenderPrimitiveStructure* self, RenderState* state) {
+    ColumnCacheEntry* entry;
+    int32_t i, size = self->numcolors * 16 * 16;
+
+    if (self->cache_regionset != state->regionset) {
+        /* start over */
+        for (i = 0; i < COLUMN_CACHE_SIZE; i++)
+            self->column_cache[i].used = false;
+        Py_XDECREF(self->cache_regionset);
+        self->cache_regionset = state->regionset;
+        Py_INCREF(self->cache_regionset);
+    }
+
+    entry = &self->column_cache[((uint32_t)state->chunkx * 31 + (uint32_t)state->chunkz) % COLUMN_CACHE_SIZE];
+    if (entry->used && entry->chunkx == state->chunkx && entry->chunkz == state->chunkz)
+        return entry;
+
+    if (entry->searched == NULL) {
+        entry->searched = malloc(2 * size * sizeof(int16_t));
+        if (entry->searched == NULL)
+            return NULL;
+        entry->matched = entry->searched + size;
+    }
+    for (i = 0; i < size; i++) {
+        entry->searched[i] = -1;
+        entry->matched[i] = -1;
+    }
+    entry->used = true;
+    entry->chunkx = state->chunkx;
+    entry->chunkz = state->chunkz;
+    return entry;
+}
+
+/* whether all the conditions of a structure are met at x, y, z (section
+ * relative) */
+static inline bool structure_matches(RenderState* state, struct Color* structure, int32_t x, int32_t y, int32_t z) {
+    int32_t cond;
+    for (cond = 0; cond < structure->numconds; cond++) {
+        struct Condition* c = &structure->conditions[cond];
+        if (c->block != get_data(state, BLOCKS, x + c->relx, y + c->rely, z + c->relz))
+            return false;
+    }
+    return true;
+}
+
 static void get_color(void* data,
                       RenderState* state,
                       uint8_t* r,
@@ -46,38 +117,45 @@ static void get_color(void* data,
      * Calculate the color at the current position and store the values to r,g,b,a.
      **/
     RenderPrimitiveStructure* self = (RenderPrimitiveStructure*)data;
-    int32_t x = state->x, z = state->z, y_max, y, col, cond;
+    int32_t x = state->x, z = state->z, y_max, y, col, bottom;
     struct Color* structures = (struct Color*)(self->structures);
-    struct Condition* c = NULL;
-    bool all = true;
+    ColumnCacheEntry* entry = get_column_cache(self, state);
     y_max = state->y + 1;
+    /* the bottom of the world, relative to this section */
+    bottom = state->chunky * -16;
 
     /**
-     * Check for every color in every y level if all its Conditions are met.
-     * If all conditions are met for one y level set r,b,g,a accordingly.
+     * Check for every color if all its Conditions are met in any y level
+     * up to this block. If they are for one color set r,b,g,a accordingly.
      **/
     // iterate over all the colors
     for (col = 0; col < self->numcolors; col++) {
-        // iterate over all y levels
-        for (y = state->chunky * -16; y <= y_max; y++) {
-            // iterate over all the conditions
-            for (cond = 0; cond < structures[col].numconds; cond++) {
-                all = true;
-                c = (struct Condition*)&structures[col].conditions[cond];
-                // check if the condition does apply and break from the conditions loop if not.
-                if (!(c->block == get_data(state, BLOCKS, x + c->relx, y + c->rely, z + c->relz))) {
-                    all = false;
-                    break;
+        bool found = false;
+        if (entry == NULL) {
+            // no cache, search the whole column
+            for (y = bottom; y <= y_max && !found; y++)
+                found = structure_matches(state, &structures[col], x, y, z);
+        } else {
+            int32_t i = (col * 16 + z) * 16 + x;
+            // only search the part of the column we haven't yet
+            if (entry->matched[i] < 0 && entry->searched[i] < y_max - bottom) {
+                for (y = entry->searched[i] + 1 + bottom; y <= y_max; y++) {
+                    if (structure_matches(state, &structures[col], x, y, z)) {
+                        entry->matched[i] = y - bottom;
+                        break;
+                    }
                 }
+                entry->searched[i] = y_max - bottom;
             }
-            if (all) {
-                // set the color
-                *r = structures[col].r;
-                *g = structures[col].g;
-                *b = structures[col].b;
-                *a = structures[col].a;
-                return;
-            }
+            found = entry->matched[i] >= 0 && entry->matched[i] <= y_max - bottom;
+        }
+        if (found) {
+            // set the color
+            *r = structures[col].r;
+            *g = structures[col].g;
+            *b = structures[col].b;
+            *a = structures[col].a;
+            return;
         }
     }
     return;
@@ -211,6 +289,10 @@ static void overlay_structure_finish(void* data, RenderState* state) {
     RenderPrimitiveStructure* self = (RenderPrimitiveStructure*)data;
     int32_t i = 0;
 
+    for (i = 0; i < COLUMN_CACHE_SIZE; i++)
+        free(self->column_cache[i].searched);
+    Py_XDECREF(self->cache_regionset);
+
     if (self->structures) {
         // freeing the nested structure
         struct Color* m = self->structures;
@@ -196,6 +196,12 @@ smooth_lighting_finish(void* data, RenderState* state) {
     primitive_lighting.finish(data, state);
 }
 
+static void
+smooth_lighting_reset(void* data, RenderState* state) {
+    /* nothing special to do */
+    primitive_lighting.reset(data, state);
+}
+
 static void
 smooth_lighting_draw(void* data, RenderState* state, PyObject* src, PyObject* mask, PyObject* mask_light) {
     bool light_top = true;
@@ -239,4 +245,5 @@ RenderPrimitiveInterface primitive_smooth_lighting = {
     NULL,
     NULL,
     smooth_lighting_draw,
+    smooth_lighting_reset,
 };
@@ -129,13 +129,90 @@ void render_mode_destroy(RenderMode* self) {
     free(self);
 }
 
+void render_mode_reset(RenderMode* self, RenderState* state) {
+    uint32_t i;
+
+    self->state = state;
+    for (i = 0; i < self->num_primitives; i++) {
+        RenderPrimitive* prim = self->primitives[i];
+        if (prim->iface->reset) {
+            prim->iface->reset(prim->primitive, state);
+        }
+    }
+}
+
+/* reusable rendermodes, made once (per tileset) by create_rendermode, so
+   the primitives don't need to be set up again for every section */
+
+#define RENDERMODE_CAPSULE "overviewer_core.c_overviewer.RenderMode"
+
+static void
+render_mode_capsule_destroy(PyObject* capsule) {
+    RenderMode* mode = PyCapsule_GetPointer(capsule, RENDERMODE_CAPSULE);
+    if (mode)
+        render_mode_destroy(mode);
+}
+
+PyObject* create_rendermode(PyObject* self, PyObject* args) {
+    RenderState state;
+    PyObject* mode;
+    RenderMode* ret;
+    PyObject* capsule;
+
+    /* the primitives only look at the world and textures when starting */
+    memset(&state, 0, sizeof(state));
+    if (!PyArg_ParseTuple(args, "OOO", &mode, &state.world, &state.textures))
+        return NULL;
+
+    ret = render_mode_create(mode, &state);
+    if (ret == NULL)
+        return NULL;
+    ret->state = NULL;
+    ret->persistent = true;
+
+    capsule = PyCapsule_New(ret, RENDERMODE_CAPSULE, render_mode_capsule_destroy);
+    if (capsule == NULL)
+        render_mode_destroy(ret);
+    return capsule;
+}
+
+RenderMode* render_mode_get(PyObject* mode, RenderState* state) {
+    RenderMode* ret;
+
+    if (PyCapsule_IsValid(mode, RENDERMODE_CAPSULE)) {
+        ret = PyCapsule_GetPointer(mode, RENDERMODE_CAPSULE);
+    } else {
+        ret = render_mode_create(mode, state);
+        if (ret == NULL)
+            return NULL;
+    }
+    render_mode_reset(ret, state);
+    return ret;
+}
+
+void render_mode_release(RenderMode* self) {
+    if (self->persistent) {
+        /* don't keep pointing at the finished section's state */
+        self->state = NULL;
+        return;
+    }
+    render_mode_destroy(self);
+}
+
 bool render_mode_occluded(RenderMode* self, int32_t x, int32_t y, int32_t z) {
     uint32_t i;
     bool occluded = false;
     for (i = 0; i < self->num_primitives; i++) {
         RenderPrimitive* prim = self->primitives[i];
         if (prim->iface->occluded) {
+#ifdef RENDER_PROFILE
+            uint64_t start = RENDER_PROFILE_TICKS();
+            occluded |= prim->iface->occluded(prim->primitive, self->state, x, y, z);
+            prim->profile.occluded_ticks += RENDER_PROFILE_TICKS() - start;
+            prim->profile.occluded_calls++;
+#else
             occluded |= prim->iface->occluded(prim->primitive, self->state, x, y, z);
+#endif
         }
 
         if (occluded)
@@ -164,9 +241,58 @@ void render_mode_draw(RenderMode* self, PyObject* img, PyObject* mask, PyObject*
     for (i = 0; i < self->num_primitives; i++) {
         RenderPrimitive* prim = self->primitives[i];
         if (prim->iface->draw) {
+#ifdef RENDER_PROFILE
+            uint64_t start = RENDER_PROFILE_TICKS();
+            prim->iface->draw(prim->primitive, self->state, img, mask, mask_light);
+            prim->profile.draw_ticks += RENDER_PROFILE_TICKS() - start;
+            prim->profile.draw_calls++;
+#else
             prim->iface->draw(prim->primitive, self->state, img, mask, mask_light);
+#endif
+        }
+    }
+}
+
+PyObject* rendermode_profile(PyObject* self, PyObject* args) {
+    PyObject* capsule;
+    int reset = 0;
+#ifdef RENDER_PROFILE
+    RenderMode* mode;
+    PyObject* ret;
+    uint32_t i;
+#endif
+
+    if (!PyArg_ParseTuple(args, "O|p", &capsule, &reset))
+        return NULL;
+    if (!PyCapsule_IsValid(capsule, RENDERMODE_CAPSULE)) {
+        PyErr_SetString(PyExc_TypeError, "expected a rendermode from create_rendermode");
+        return NULL;
+    }
+
+#ifdef RENDER_PROFILE
+    mode = PyCapsule_GetPointer(capsule, RENDERMODE_CAPSULE);
+    ret = PyList_New(mode->num_primitives);
+    if (ret == NULL)
+        return NULL;
+    for (i = 0; i < mode->num_primitives; i++) {
+        RenderPrimitive* prim = mode->primitives[i];
+        PyObject* item = Py_BuildValue("(sKKKK)", prim->iface->name,
+                                       (unsigned long long)prim->profile.occluded_calls,
+                                       (unsigned long long)prim->profile.occluded_ticks,
+                                       (unsigned long long)prim->profile.draw_calls,
+                                       (unsigned long long)prim->profile.draw_ticks);
+        if (item == NULL) {
+            Py_DECREF(ret);
+            return NULL;
         }
+        PyList_SET_ITEM(ret, i, item);
+        if (reset)
+            memset(&prim->profile, 0, sizeof(prim->profile));
     }
+    return ret;
+#else
+    Py_RETURN_NONE;
+#endif
 }
 
 /* options parse helper */
@@ -61,6 +61,10 @@ typedef struct {
     bool (*hidden)(void*, RenderState*, int32_t, int32_t, int32_t);
     /* last two arguments are img and mask, from texture lookup */
     void (*draw)(void*, RenderState*, PyObject*, PyObject*, PyObject*);
+    /* called before each section is drawn, to clear anything that only
+     * holds for one section. start() is only called once for modes made
+     * with create_rendermode, which are reused for many sections */
+    void (*reset)(void*, RenderState*);
 } RenderPrimitiveInterface;
 
 /* A quick note about the difference between occluded and hidden:
@@ -78,10 +82,43 @@ typedef struct {
  * example, in lighting mode it is called at most 4 times per block.
  */
 
+/* with RENDER_PROFILE defined (see setup.py), each primitive counts the
+ * calls to its occluded and draw functions and the time they took, in
+ * ticks of RENDER_PROFILE_TICKS(): CPU cycles where the time stamp counter
+ * can be read directly, nanoseconds elsewhere */
+#ifdef RENDER_PROFILE
+#if defined(_MSC_VER) && (defined(_M_X64) || defined(_M_IX86))
+#include <intrin.h>
+#define RENDER_PROFILE_TICKS() __rdtsc()
+#define RENDER_PROFILE_UNIT "cycles"
+#elif defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#include <x86intrin.h>
+#define RENDER_PROFILE_TICKS() __rdtsc()
+#define RENDER_PROFILE_UNIT "cycles"
+#else
+#include <time.h>
+static inline uint64_t render_profile_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+#define RENDER_PROFILE_TICKS() render_profile_ns()
+#define RENDER_PROFILE_UNIT "ns"
+#endif
+
+typedef struct {
+    uint64_t occluded_calls, occluded_ticks;
+    uint64_t draw_calls, draw_ticks;
+} RenderPrimitiveProfile;
+#endif
+
 /* convenience wrapper for a single primitive + interface */
 typedef struct {
     void* primitive;
     RenderPrimitiveInterface* iface;
+#ifdef RENDER_PROFILE
+    RenderPrimitiveProfile profile;
+#endif
 } RenderPrimitive;
 
 /* wrapper for passing around rendermodes */
@@ -89,14 +126,26 @@ struct _RenderMode {
     uint32_t num_primitives;
     RenderPrimitive** primitives;
     RenderState* state;
+    /* true if this is owned by a python object from create_rendermode */
+    bool persistent;
 };
 
 /* functions for creating / using rendermodes */
 RenderMode* render_mode_create(PyObject* mode, RenderState* state);
 void render_mode_destroy(RenderMode* self);
+/* gets a mode ready to draw a section with: either the one wrapped by a
+ * create_rendermode object, or a new one made from a list of primitives.
+ * Give it back with render_mode_release when done */
+RenderMode* render_mode_get(PyObject* mode, RenderState* state);
+void render_mode_release(RenderMode* self);
+void render_mode_reset(RenderMode* self, RenderState* state);
+PyObject* create_rendermode(PyObject* self, PyObject* args);
 bool render_mode_occluded(RenderMode* self, int32_t x, int32_t y, int32_t z);
 bool render_mode_hidden(RenderMode* self, int32_t x, int32_t y, int32_t z);
 void render_mode_draw(RenderMode* self, PyObject* img, PyObject* mask, PyObject* mask_light);
+/* returns the counters of a create_rendermode object's primitives, or None
+ * if the extension was built without RENDER_PROFILE */
+PyObject* rendermode_profile(PyObject* self, PyObject* args);
 
 /* helper function for reading in rendermode options
    works like PyArg_ParseTuple on a support object */
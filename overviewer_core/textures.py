@@ -18,6 +18,7 @@ import sys
 import imp
 import os
 import os.path
+from stat import S_ISREG
 import zipfile
 from io import BytesIO
 import math
@@ -26,8 +27,13 @@ import numpy
 from PIL import Image, ImageEnhance, ImageOps, ImageDraw
 import logging
 import functools
+import hashlib
+import json
+import multiprocessing
+from multiprocessing import shared_memory
 
 from . import util
+from .files import FileReplacer
 
 
 # global variables to collate information in @material decorators
@@ -59,6 +65,18 @@ class TextureException(Exception):
     pass
 
 
+def get_file_stat(path):
+    """Returns the (size, mtime) of a file, for telling whether it changed,
+    or None if there's no such file."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not S_ISREG(st.st_mode):
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
 color_map = ["white", "orange", "magenta", "light_blue", "yellow", "lime", "pink", "gray",
              "light_gray", "cyan", "purple", "blue", "brown", "green", "red", "black"]
 
@@ -71,10 +89,25 @@ class Textures(object):
     rendering. It accepts a background color, north direction, and
     local textures path.
     """
-    def __init__(self, texturepath=None, bgcolor=(26, 26, 26, 0), northdirection=0):
+    def __init__(self, texturepath=None, bgcolor=(26, 26, 26, 0), northdirection=0,
+                 cachedir=None, lazy=False, preflight=False):
         self.bgcolor = bgcolor
         self.rotation = northdirection
         self.find_file_local_path = texturepath
+
+        # if lazy, generate() leaves the blocks to generate_slot(), which
+        # the renderer calls the first time it draws a block. With
+        # preflight, the tilesets note the blocks their chunks use, and
+        # those are made up front by pregenerate()
+        self.lazy = lazy
+        self.preflight = preflight
+
+        # if set, generate() keeps its results in here (see load_cache())
+        self.cachedir = cachedir
+        self.fingerprint = None
+
+        # set by share(), the shared memory segment holding the atlas
+        self.shared_memory = None
         
         # not yet configurable
         self.texture_size = 24
@@ -86,8 +119,14 @@ class Textures(object):
         # see load_image_texture()
         self.texture_cache = {}
 
-        # once we find a jarfile that contains a texture, we cache the ZipFile object here
+        # the ZipFile objects of the resource packs and jars in use, the
+        # files in them, and where find_file() found each file
         self.jars = OrderedDict()
+        self.jar_names = None
+        self.file_index = None
+        self.file_sources = None
+        # the plain files find_file() looked for, see save_cache()
+        self.file_stats = {}
     
     ##
     ## pickle support
@@ -96,18 +135,35 @@ class Textures(object):
     def __getstate__(self):
         # we must get rid of the huge image lists, and other images
         attributes = self.__dict__.copy()
-        for attr in ['blockmap', 'biome_grass_texture', 'watertexture', 'lavatexture', 'firetexture', 'portaltexture', 'lightcolor', 'grasscolor', 'foliagecolor', 'watercolor', 'texture_cache']:
+        for attr in ['blockmap', 'atlas', 'atlas_light', 'atlas_index', 'biome_grass_texture', 'watertexture', 'lavatexture', 'firetexture', 'portaltexture', 'lightcolor', 'grasscolor', 'foliagecolor', 'watercolor', 'texture_cache', 'file_index', 'jar_names', 'file_stats']:
             try:
                 del attributes[attr]
             except KeyError:
                 pass
         attributes['jars'] = OrderedDict()
+
+        # if the atlas is in shared memory, send the (small) rest of the
+        # generated data along, so the other side can just attach to it
+        if self.shared_memory:
+            attributes['shared_memory'] = self.shared_memory.name
+            attributes['shared_layout'] = (self.atlas.shape, self.atlas_light.shape,
+                                           self.atlas_index.shape)
+            attributes['shared_extras'] = dict((attr, getattr(self, attr))
+                                               for attr in ['biome_grass_texture'] + self.cached_colormaps
+                                               if getattr(self, attr, None) is not None)
         return attributes
     def __setstate__(self, attrs):
         # regenerate textures, if needed
         for attr, val in list(attrs.items()):
             setattr(self, attr, val)
         self.texture_cache = {}
+        self.file_index = None
+        self.jar_names = None
+        self.file_stats = {}
+        if self.shared_memory:
+            if self.attach_shared():
+                return
+            self.shared_memory = None
         if self.generated:
             self.generate()
     
@@ -116,6 +172,10 @@ class Textures(object):
     ##
     
     def generate(self):
+        if self.cachedir and self.load_cache():
+            self.generated = True
+            return
+
         # Make sure we have the foliage/grasscolor images available
         try:
             self.load_foliage_color()
@@ -135,6 +195,14 @@ class Textures(object):
         global blockmap_generators
         global known_blocks, used_datas
         self.blockmap = [None] * max_blockid * max_data
+
+        if self.lazy:
+            # Ellipsis marks a block generate_slot() has yet to make
+            for (blockid, data) in blockmap_generators:
+                self.blockmap[blockid * max_data + data] = Ellipsis
+            self.build_atlas()
+            self.generated = True
+            return
         
         for (blockid, data), texgen in list(blockmap_generators.items()):
             tex = texgen(self, blockid, data)
@@ -152,7 +220,304 @@ class Textures(object):
                 scaled_block = block.resize(self.texture_dimensions, Image.ANTIALIAS)
                 blockmap[i] = self.generate_texture_tuple(scaled_block)
         
+        self.build_atlas()
         self.generated = True
+
+        if self.cachedir:
+            self.save_cache()
+
+    def generate_slot(self, slot):
+        """Generates the texture for a blockmap slot left out by a lazy
+        generate(), stores it in the blockmap and returns it. The C
+        renderer calls this the first time it needs the slot."""
+        # if the generator fails, don't try again on every block
+        self.blockmap[slot] = None
+        blockid, data = divmod(slot, max_data)
+        texgen = blockmap_generators.get((blockid, data))
+        if texgen is None:
+            return None
+        tex = self.generate_texture_tuple(texgen(self, blockid, data))
+        if self.texture_size != 24 and tex is not None:
+            tex = self.generate_texture_tuple(tex[0].resize(self.texture_dimensions, Image.ANTIALIAS))
+        self.blockmap[slot] = tex
+        return tex
+
+    def pregenerate(self, blockids, processes=1):
+        """Generates every variant of the given block ids that a lazy
+        generate() left out, using up to the given number of processes,
+        and rebuilds the atlas so the renderer can use them directly.
+
+        All data values are made, not just the ones seen in the world,
+        since the renderer picks most of them (pseudo data) itself."""
+        slots = {}
+        for (blockid, data) in blockmap_generators:
+            slot = blockid * max_data + data
+            if blockid in blockids and self.blockmap[slot] is Ellipsis:
+                slots.setdefault(blockid, []).append(slot)
+        if not slots:
+            return
+
+        logging.debug("Generating textures for %d blocks.", len(slots))
+        if processes > 1 and len(slots) > 1:
+            pool = multiprocessing.Pool(min(processes, len(slots)),
+                                        initializer=_pregenerate_init, initargs=(self,))
+            try:
+                for results in pool.imap_unordered(_pregenerate_slots, list(slots.values())):
+                    for slot, tex in results:
+                        self.blockmap[slot] = tex
+            finally:
+                pool.terminate()
+        else:
+            for blockslots in slots.values():
+                for slot in blockslots:
+                    self.generate_slot(slot)
+        self.build_atlas()
+
+    def build_atlas(self):
+        """Packs the sprites in the blockmap into contiguous native
+        buffers, so the C renderer can blit them directly instead of
+        going through a PIL image object on every draw.
+
+        This sets self.atlas, an (n, h, w, 4) array of RGBA sprites,
+        self.atlas_light, the matching (n, h, w) lighting masks, and
+        self.atlas_index, which maps every blockmap slot to a sprite
+        index (or -1, in which case the PIL tuple is used instead, or
+        -2 for a slot a lazy generate() hasn't made yet).
+        """
+        w, h = self.texture_dimensions
+        self.atlas_index = numpy.full(len(self.blockmap), -1, dtype=numpy.int32)
+
+        # many blockmap slots share the same image, so only store it once
+        sprites = {}
+        rgba = []
+        light = []
+        for i, tex in enumerate(self.blockmap):
+            if tex is Ellipsis:
+                self.atlas_index[i] = -2
+                continue
+            if tex is None:
+                continue
+            img, mask_light = tex
+            if img.mode != "RGBA" or img.size != (w, h):
+                continue
+            if mask_light.mode != "L" or mask_light.size != (w, h):
+                continue
+            if id(img) not in sprites:
+                sprites[id(img)] = len(rgba)
+                rgba.append(img.tobytes())
+                light.append(mask_light.tobytes())
+            self.atlas_index[i] = sprites[id(img)]
+
+        self.atlas = numpy.frombuffer(b"".join(rgba), dtype=numpy.uint8).reshape((len(rgba), h, w, 4))
+        self.atlas_light = numpy.frombuffer(b"".join(light), dtype=numpy.uint8).reshape((len(light), h, w))
+
+    def atlas_is_complete(self):
+        """Returns True if every sprite in the blockmap is in the atlas, so
+        the blockmap can be rebuilt from the atlas alone."""
+        return (sum(1 for tex in self.blockmap if isinstance(tex, tuple)) ==
+                numpy.count_nonzero(self.atlas_index >= 0))
+
+    def set_atlas(self, atlas, atlas_light, atlas_index):
+        """Uses the given atlas arrays, and rebuilds the blockmap from them.
+        The blockmap images are read-only views of the atlas memory."""
+        h, w = atlas.shape[1:3]
+        sprites = [(Image.frombuffer("RGBA", (w, h), atlas[i], "raw", "RGBA", 0, 1),
+                    Image.frombuffer("L", (w, h), atlas_light[i], "raw", "L", 0, 1))
+                   for i in range(len(atlas))]
+        self.blockmap = [sprites[i] if i >= 0 else (Ellipsis if i == -2 else None)
+                         for i in atlas_index.tolist()]
+        self.atlas = atlas
+        self.atlas_light = atlas_light
+        self.atlas_index = atlas_index
+
+    ##
+    ## Sharing the generated textures between processes
+    ##
+
+    def share(self):
+        """Copies the atlas into a shared memory segment. From then on,
+        pickled copies of this object (like the ones worker processes get)
+        map that segment instead of generating their own textures.
+
+        Returns False if the textures can't be shared. The process that
+        calls this must call unshare() once the workers are done."""
+        if self.shared_memory:
+            return True
+        if not self.atlas_is_complete():
+            logging.debug("Not sharing textures, some don't fit the atlas.")
+            return False
+
+        arrays = (self.atlas, self.atlas_light, self.atlas_index)
+        try:
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(1, sum(a.nbytes for a in arrays)))
+        except OSError as e:
+            logging.warning("Could not share textures with the worker processes: %s", e)
+            return False
+
+        offset = 0
+        for a in arrays:
+            shm.buf[offset:offset + a.nbytes] = a.tobytes()
+            offset += a.nbytes
+        self.shared_memory = shm
+        logging.debug("Shared %d bytes of textures as '%s'.", offset, shm.name)
+        return True
+
+    def unshare(self):
+        """Releases the shared memory segment created by share()."""
+        if not self.shared_memory:
+            return
+        shm = self.shared_memory
+        self.shared_memory = None
+        shm.close()
+        shm.unlink()
+
+    def attach_shared(self):
+        """Maps the atlas shared by another process's share(), after
+        unpickling. Returns False if the segment isn't available (say, in
+        a worker on another machine)."""
+        try:
+            shm = shared_memory.SharedMemory(name=self.shared_memory)
+        except (OSError, ValueError) as e:
+            logging.debug("Could not attach to shared textures '%s': %s", self.shared_memory, e)
+            return False
+
+        arrays = []
+        offset = 0
+        for shape, dtype in zip(self.shared_layout, (numpy.uint8, numpy.uint8, numpy.int32)):
+            a = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            a.flags.writeable = False
+            arrays.append(a)
+            offset += a.nbytes
+        self.set_atlas(*arrays)
+        for attr, val in self.shared_extras.items():
+            setattr(self, attr, val)
+
+        # keep the segment mapped for as long as we use it
+        self.shared_memory = shm
+        del self.shared_layout, self.shared_extras
+        return True
+    
+    ##
+    ## On-disk cache of the generated textures
+    ##
+
+    # generated attributes kept in the cache, besides the blockmap
+    cached_colormaps = ['grasscolor', 'foliagecolor', 'watercolor', 'lightcolor']
+
+    def get_fingerprint(self):
+        """Returns a hash identifying the textures generate() would build,
+        as "<options>-<sources>": a hash of the options that affect the
+        output, and one of the texture generators themselves and the
+        sources from get_file_sources() (resource packs and jars by size
+        and mtime). The plain files that are used are checked against the
+        list kept in the cache instead, see load_cache()."""
+        if self.fingerprint:
+            return self.fingerprint
+
+        options = hashlib.sha1()
+        options.update(repr((self.texture_size, tuple(self.bgcolor), self.rotation)).encode())
+
+        h = hashlib.sha1()
+        # changes to the block generators must invalidate the cache too
+        try:
+            with open(os.path.splitext(__file__)[0] + ".py", "rb") as f:
+                h.update(f.read())
+        except IOError:
+            h.update(util.findGitHash().encode())
+
+        for source in self.get_file_sources():
+            h.update(repr((source, get_file_stat(source))).encode())
+
+        self.fingerprint = "%s-%s" % (options.hexdigest()[:16], h.hexdigest())
+        return self.fingerprint
+
+    def get_cache_path(self):
+        return os.path.join(self.cachedir, "textures-%s.npz" % self.get_fingerprint())
+
+    def load_cache(self):
+        """Loads the blockmap, biome grass texture and color maps from the
+        on-disk cache, if there's an entry for the current fingerprint.
+        Returns True if the textures were loaded."""
+        path = self.get_cache_path()
+        if not os.path.isfile(path):
+            return False
+
+        try:
+            with numpy.load(path) as cache:
+                arrays = dict(cache.items())
+            atlas = arrays.pop('atlas')
+            atlas_light = arrays.pop('atlas_light')
+            atlas_index = arrays.pop('atlas_index')
+            biome_grass_texture = arrays.pop('biome_grass_texture')
+            files = json.loads(str(arrays.pop('files')))
+        except (IOError, ValueError, KeyError, zipfile.BadZipfile) as e:
+            logging.warning("Could not read the texture cache '%s', regenerating textures: %s",
+                            path, e)
+            return False
+
+        if len(atlas_index) != max_blockid * max_data:
+            return False
+
+        # the plain files the textures came from, and the ones that were
+        # looked for but didn't exist, must still be as they were
+        for path, stat in files:
+            current = get_file_stat(path)
+            if current != (tuple(stat) if stat is not None else None):
+                logging.debug("Texture file '%s' changed, regenerating textures.", path)
+                return False
+
+        self.set_atlas(atlas, atlas_light, atlas_index)
+        self.biome_grass_texture = Image.fromarray(biome_grass_texture, "RGBA")
+        for name, colors in arrays.items():
+            setattr(self, name, [tuple(c) for c in colors.tolist()])
+
+        logging.debug("Loaded textures from cache '%s'.", path)
+        return True
+
+    def save_cache(self):
+        """Writes the generated textures to the on-disk cache, as a plain
+        (uncompressed) npz file so it can be read back in bulk."""
+        # the cache only holds what fits in the atlas
+        if not self.atlas_is_complete():
+            logging.debug("Not caching textures, some don't fit the atlas.")
+            return
+
+        arrays = {
+            'atlas': self.atlas,
+            'atlas_light': self.atlas_light,
+            'atlas_index': self.atlas_index,
+            'biome_grass_texture': numpy.asarray(self.biome_grass_texture.convert("RGBA")),
+            'files': numpy.array(json.dumps(sorted(self.file_stats.items()))),
+        }
+        for name in self.cached_colormaps:
+            colors = getattr(self, name, None)
+            if colors:
+                arrays[name] = numpy.array(colors, dtype=numpy.uint8)
+
+        path = self.get_cache_path()
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            with FileReplacer(path) as tmppath:
+                with open(tmppath, "wb") as f:
+                    numpy.savez(f, **arrays)
+        except (IOError, OSError) as e:
+            logging.warning("Could not write the texture cache '%s': %s", path, e)
+            return
+        logging.debug("Saved textures to cache '%s'.", path)
+
+        # the caches for the same options made from older sources are of
+        # no use anymore
+        prefix = "textures-%s-" % self.get_fingerprint().split("-")[0]
+        for name in os.listdir(self.cachedir):
+            stale = os.path.join(self.cachedir, name)
+            if name.startswith(prefix) and name.endswith(".npz") and stale != path:
+                try:
+                    os.remove(stale)
+                    logging.debug("Removed old texture cache '%s'.", stale)
+                except OSError as e:
+                    logging.warning("Could not remove the old texture cache '%s': %s", stale, e)
     
     ##
     ## Helpers for opening textures
@@ -162,9 +527,8 @@ class Textures(object):
         """Searches for the given file and returns an open handle to it.
         This searches the following locations in this order:
         
-        * In the directory textures_path given in the initializer if not already open
-        * In an already open resource pack or client jar file
-        * In the resource pack given by textures_path
+        * In the directory or resource pack textures_path given in the
+          initializer
         * The program dir (same dir as overviewer.py) for extracted textures
         * On Darwin, in /Applications/Minecraft for extracted textures
         * Inside a minecraft client jar. Client jars are searched for in the
@@ -175,74 +539,107 @@ class Textures(object):
                 $HOME/Library/Application Support/minecraft/versions
             * at $HOME/.minecraft/versions/
 
-          Only the latest non-snapshot version >1.6 is used
+          The latest non-snapshot version >1.6 is searched first, older
+          versions after it
 
         * The overviewer_core/data/textures dir
-        
+
+        Where each file was found (or that it wasn't) is remembered, so
+        every file is only searched for once.
         """
         if verbose: logging.info("Starting search for {0}".format(filename))
 
-        # A texture path was given on the command line. Search this location
-        # for the file first.
-        if self.find_file_local_path:
-            if (self.find_file_local_path not in self.jars
-                and os.path.isfile(self.find_file_local_path)):
-                # Must be a resource pack. Look for the requested file within
-                # it.
-                try:
-                    pack = zipfile.ZipFile(self.find_file_local_path)
-                    # pack.getinfo() will raise KeyError if the file is
-                    # not found.
-                    pack.getinfo(filename)
-                    if verbose: logging.info("Found %s in '%s'", filename,
-                                             self.find_file_local_path)
-                    self.jars[self.find_file_local_path] = pack
-                    # ok cool now move this to the start so we pick it first
-                    self.jars.move_to_end(self.find_file_local_path, last=False)
-                    return pack.open(filename)
-                except (zipfile.BadZipfile, KeyError, IOError):
-                    pass
-            elif os.path.isdir(self.find_file_local_path):
-                full_path = os.path.join(self.find_file_local_path, filename)
-                if os.path.isfile(full_path):
-                        if verbose: logging.info("Found %s in '%s'", filename, full_path)
-                        return open(full_path, mode)
-
-        # We already have some jars open, better use them.
-        if len(self.jars) > 0:
-            for jarpath in self.jars:
-                try:
-                    jar = self.jars[jarpath]
-                    jar.getinfo(filename)
-                    if verbose: logging.info("Found (cached) %s in '%s'", filename,
-                                             jarpath)
-                    return jar.open(filename)
-                except (KeyError, IOError) as e:
-                    pass
-
-        # If we haven't returned at this point, then the requested file was NOT
-        # found in the user-specified texture path or resource pack.
-        if verbose: logging.info("Did not find the file in specified texture path")
+        if self.file_index is None:
+            self.file_index = {}
+        try:
+            found = self.file_index[filename]
+        except KeyError:
+            found = self.file_index[filename] = self.locate_file(filename, verbose)
+
+        if found is None:
+            raise TextureException("Could not find the textures while searching for '{0}'. Try specifying the 'texturepath' option in your config file.\nSet it to the path to a Minecraft Resource pack.\nAlternately, install the Minecraft client (which includes textures)\nAlso see <http://docs.overviewer.org/en/latest/running/#installing-the-textures>\n(Remember, this version of Overviewer requires a 1.14-compatible resource pack)\n(Also note that I won't automatically use snapshots; you'll have to use the texturepath option to use a snapshot jar)".format(filename))
+
+        source, entry = found
+        if verbose: logging.info("Found %s in '%s'", filename, source or entry)
+        if source is None:
+            return open(entry, mode)
+        return self.open_jar(source).open(entry)
+
+    def locate_file(self, filename, verbose=False):
+        """Looks for a file in the sources from get_file_sources(), in
+        order. Returns a (jarpath, entry) tuple, (None, path) for a plain
+        file, or None if it's nowhere."""
+        for source in self.get_file_sources(verbose):
+            names = self.get_jar_names(source, verbose)
+            if names is None:
+                path = os.path.join(source, filename)
+                stat = self.file_stats[path] = get_file_stat(path)
+                if stat is not None:
+                    return (None, path)
+            elif filename in names:
+                return (source, filename)
+            elif verbose:
+                logging.info("Did not find file {0} in '{1}'".format(filename, source))
+        return None
 
+    def open_jar(self, jarpath):
+        """Returns a ZipFile for the given resource pack or jar, opening it
+        the first time it's used (in this process)."""
+        try:
+            return self.jars[jarpath]
+        except KeyError:
+            jar = self.jars[jarpath] = zipfile.ZipFile(jarpath)
+            return jar
+
+    def get_jar_names(self, path, verbose=False):
+        """Returns the set of file names in a resource pack or jar (empty
+        if it can't be read), or None if the path isn't a file. The names
+        are read once per jar."""
+        if self.jar_names is None:
+            self.jar_names = {}
+        try:
+            return self.jar_names[path]
+        except KeyError:
+            pass
 
-        # Look in the location of the overviewer executable for the given path
-        programdir = util.get_program_path()
-        path = os.path.join(programdir, filename)
+        names = None
         if os.path.isfile(path):
-            if verbose: logging.info("Found %s in '%s'", filename, path)
-            return open(path, mode)
+            if verbose: logging.info("Reading the file list of '%s'", path)
+            try:
+                names = set(self.open_jar(path).namelist())
+            except (zipfile.BadZipfile, IOError) as e:
+                if verbose: logging.info("Could not open '%s': %s", path, e)
+                names = set()
+        self.jar_names[path] = names
+        return names
+
+    def get_file_sources(self, verbose=False):
+        """Returns the directories, resource packs and jars find_file()
+        takes files from, in order of precedence. The get_fingerprint()
+        of the textures covers the same list."""
+        if self.file_sources is not None:
+            return self.file_sources
 
+        programdir = util.get_program_path()
+        sources = []
+        if self.find_file_local_path:
+            sources.append(self.find_file_local_path)
+        sources.append(programdir)
         if sys.platform.startswith("darwin"):
-            path = os.path.join("/Applications/Minecraft", filename)
-            if os.path.isfile(path):
-                if verbose: logging.info("Found %s in '%s'", filename, path)
-                return open(path, mode)
-
-        if verbose: logging.info("Did not find the file in overviewer executable directory")
+            sources.append("/Applications/Minecraft")
         if verbose: logging.info("Looking for installed minecraft jar files...")
-
-        # Find an installed minecraft client jar and look in it for the texture
-        # file we need.
+        sources.extend(self.find_client_jars(verbose))
+        sources.append(os.path.join(programdir, "overviewer_core", "data", "textures"))
+        if hasattr(sys, "frozen") or imp.is_frozen("__main__"):
+            # windows special case, when the package dir doesn't exist
+            sources.append(os.path.join(programdir, "textures"))
+        self.file_sources = sources
+        return sources
+
+    def find_client_jars(self, verbose=False):
+        """Returns the paths of the installed minecraft client jars that
+        find_file() falls back to, most recent version first. See
+        find_file() for where these are searched for."""
         versiondir = ""
         if "APPDATA" in os.environ and sys.platform.startswith("win"):
             versiondir = os.path.join(os.environ['APPDATA'], ".minecraft", "versions")
@@ -260,8 +657,8 @@ class Textures(object):
             if verbose: logging.info("Found these versions: {0}".format(versions))
         except OSError:
             # Directory doesn't exist? Ignore it. It will find no versions and
-            # fall through the checks below to the error at the bottom of the
-            # method.
+            # fall through the checks in find_file() to the error at the bottom
+            # of the method.
             versions = []
 
         available_versions = []
@@ -287,44 +684,16 @@ class Textures(object):
         available_versions.sort(reverse=True)
         if not available_versions:
             if verbose: logging.info("Did not find any non-snapshot minecraft jars >=1.8.0")
-        while(available_versions):
-            most_recent_version = available_versions.pop(0)
-            if verbose: logging.info("Trying {0}. Searching it for the file...".format(".".join(str(x) for x in most_recent_version)))
 
-            jarname = ".".join(str(x) for x in most_recent_version)
+        jars = []
+        for version in available_versions:
+            jarname = ".".join(str(x) for x in version)
             jarpath = os.path.join(versiondir, jarname, jarname + ".jar")
-
             if os.path.isfile(jarpath):
-                jar = zipfile.ZipFile(jarpath)
-                try:
-                    jar.getinfo(filename)
-                    if verbose: logging.info("Found %s in '%s'", filename, jarpath)
-                    self.jars[jarpath] = jar
-                    return jar.open(filename)
-                except (KeyError, IOError) as e:
-                    pass
-
-            if verbose: logging.info("Did not find file {0} in jar {1}".format(filename, jarpath))
-            
-        # Last ditch effort: look for the file is stored in with the overviewer
-        # installation. We include a few files that aren't included with Minecraft
-        # textures. This used to be for things such as water and lava, since
-        # they were generated by the game and not stored as images. Nowdays I
-        # believe that's not true, but we still have a few files distributed
-        # with overviewer.
-        if verbose: logging.info("Looking for texture in overviewer_core/data/textures")
-        path = os.path.join(programdir, "overviewer_core", "data", "textures", filename)
-        if os.path.isfile(path):
-            if verbose: logging.info("Found %s in '%s'", filename, path)
-            return open(path, mode)
-        elif hasattr(sys, "frozen") or imp.is_frozen("__main__"):
-            # windows special case, when the package dir doesn't exist
-            path = os.path.join(programdir, "textures", filename)
-            if os.path.isfile(path):
-                if verbose: logging.info("Found %s in '%s'", filename, path)
-                return open(path, mode)
-
-        raise TextureException("Could not find the textures while searching for '{0}'. Try specifying the 'texturepath' option in your config file.\nSet it to the path to a Minecraft Resource pack.\nAlternately, install the Minecraft client (which includes textures)\nAlso see <http://docs.overviewer.org/en/latest/running/#installing-the-textures>\n(Remember, this version of Overviewer requires a 1.14-compatible resource pack)\n(Also note that I won't automatically use snapshots; you'll have to use the texturepath option to use a snapshot jar)".format(filename))
+                jars.append(jarpath)
+            elif verbose:
+                logging.info("Did not find jar {0}".format(jarpath))
+        return jars
 
     def load_image_texture(self, filename):
         # Textures may be animated or in a different resolution than 16x16.  
@@ -809,6 +1178,18 @@ class Textures(object):
             return None
         return (img, self.generate_opaque_mask(img))
 
+# the Textures object used by pregenerate()'s pool workers
+_pregenerate_textures = None
+
+def _pregenerate_init(textures):
+    global _pregenerate_textures
+    # the open jars' file positions are shared with the parent, reopen them
+    textures.jars = OrderedDict()
+    _pregenerate_textures = textures
+
+def _pregenerate_slots(slots):
+    return [(slot, _pregenerate_textures.generate_slot(slot)) for slot in slots]
+
 ##
 ## The other big one: @material and associated framework
 ##
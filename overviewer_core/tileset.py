@@ -34,7 +34,7 @@ from . import c_overviewer
 from . import rendermodes
 from .c_overviewer import resize_half
 
-from . import nbt, world
+from . import metrics, nbt, world
 from .files import FileReplacer, get_fs_caps
 from .optimizeimages import optimize_image
 from .util import roundrobin
@@ -289,6 +289,16 @@ class TileSet(object):
             changelist output: each tile written will get outputted to the
             specified fd.
 
+        metrics
+            Optional: A boolean. If true, the time spent in each stage of
+            rendering is recorded and reported with the metrics.report signal,
+            in every process this tileset is used in.
+
+        trace
+            Optional: A boolean. If true, trace events for the stages of
+            rendering are recorded and reported with the metrics.trace signal,
+            in every process this tileset is used in.
+
         Other options that must be specified but aren't really documented
         (oops. consider it a TODO):
         * worldname_orig
@@ -298,12 +308,28 @@ class TileSet(object):
 
         """
         self.options = options
+        if options.get("metrics"):
+            metrics.enable()
+        if options.get("trace"):
+            metrics.enable_tracing()
         self.world = worldobj
         self.regionset = regionsetobj
         self.am = assetmanagerobj
         self.textures = texturesobj
         self.outputdir = os.path.abspath(outputdir)
 
+        # The render primitives, set up once per process by
+        # _get_rendermode() and then reused for every chunk section
+        self.rendermode = None
+
+        # Set by share_renders() on the first tileset of a group of tilesets
+        # that render the same regionset: a list of all of them, starting
+        # with this one. That tileset then renders the tiles for the whole
+        # group, and the others (which get render_leader set) do no work of
+        # their own.
+        self.render_group = None
+        self.render_leader = None
+
         config = self.am.get_tileset_config(self.options.get("name"))
         self.config = config
 
@@ -398,13 +424,16 @@ class TileSet(object):
         # This sets self.treedepth, self.xradius, and self.yradius
         self._set_map_size()
 
-    # Only pickle the initial state. Don't pickle anything resulting from the
-    # do_preprocessing step
+    # Only pickle the initial state, and the group of tilesets this renders
+    # tiles for. Don't pickle anything resulting from the do_preprocessing
+    # step
     def __getstate__(self):
-        return self.world, self.regionset, self.am, self.textures, self.options, self.outputdir
+        return (self.world, self.regionset, self.am, self.textures, self.options, self.outputdir,
+                self.render_group)
 
     def __setstate__(self, state):
-        self.__init__(*state)
+        self.__init__(*state[:6])
+        self.render_group = state[6]
 
     def do_preprocessing(self):
         """For the preprocessing step of the Worker interface, this does the
@@ -446,6 +475,12 @@ class TileSet(object):
     def get_phase_length(self, phase):
         """Returns the number of work items in a given phase.
         """
+        if self.render_leader is not None:
+            # our tiles are counted with the rest of the group
+            return 0
+        if self.render_group is not None:
+            return self._get_group_tree().count_all()
+
         # Yeah functional programming!
         # and by functional we mean a bastardized python switch statement
         return {
@@ -467,29 +502,22 @@ class TileSet(object):
         if self.options['renderchecks'] == 3:
             return
 
+        # skip if another tileset is rendering our tiles for us
+        if self.render_leader is not None:
+            return
+
         # The following block of code implementes the changelist functionality.
         fd = self.options.get("changelist", None)
         if fd:
             logging.debug("Changelist activated for %s (fileno %s)", self, fd)
 
-            # This re-implements some of the logic from do_work()
             def write_out(tilepath):
-                if len(tilepath) == self.treedepth:
-                    rt = RenderTile.from_path(tilepath)
-                    imgpath = rt.get_filepath(self.outputdir, self.imgextension)
-                elif len(tilepath) == 0:
-                    imgpath = os.path.join(self.outputdir, "base." + self.imgextension)
-                else:
-                    dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
-                    name = str(tilepath[-1])
-                    imgpath = os.path.join(dest, name) + "." + self.imgextension
-                # We use low-level file output because we don't want open file
-                # handles being passed to subprocesses. fd is just an integer.
-                # This method is only called from the master process anyways.
-                # We don't use os.fdopen() because this fd may be shared by
-                # many tileset objects, and as soon as this method exists the
-                # file object may be garbage collected, closing the file.
-                os.write(fd, (imgpath + "\n").encode())
+                self._write_changelist(fd, tilepath)
+
+        if self.render_group is not None:
+            for item in self._iterate_group_work_items():
+                yield item
+            return
 
         # See note at the top of this file about the rendercheck modes for an
         # explanation of what this method does in different situations.
@@ -522,27 +550,101 @@ class TileSet(object):
                         write_out(tilepath)
                     yield tilepath, dependencies
 
+    def _write_changelist(self, fd, tilepath):
+        """Writes the path of the image for the given tile to the changelist
+        file descriptor fd.
+
+        """
+        # This re-implements some of the logic from do_work()
+        if len(tilepath) == self.treedepth:
+            rt = RenderTile.from_path(tilepath)
+            imgpath = rt.get_filepath(self.outputdir, self.imgextension)
+        elif len(tilepath) == 0:
+            imgpath = os.path.join(self.outputdir, "base." + self.imgextension)
+        else:
+            dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
+            name = str(tilepath[-1])
+            imgpath = os.path.join(dest, name) + "." + self.imgextension
+        # We use low-level file output because we don't want open file
+        # handles being passed to subprocesses. fd is just an integer.
+        # This method is only called from the master process anyways.
+        # We don't use os.fdopen() because this fd may be shared by
+        # many tileset objects, and as soon as this method exists the
+        # file object may be garbage collected, closing the file.
+        os.write(fd, (imgpath + "\n").encode())
+
+    def _get_group_tree(self):
+        """Returns a RendertileSet of every tile any tileset in this
+        tileset's render group needs rendered.
+
+        """
+        if self.grouptree is None:
+            self.grouptree = RendertileSet(self.treedepth)
+            for ts in self.render_group:
+                for tilepath in ts.dirtytree:
+                    self.grouptree.add(tilepath)
+        return self.grouptree
+
+    def _get_group_members(self, tilepath):
+        """Returns the indices into self.render_group of the tilesets that
+        need the given tile rendered.
+
+        """
+        return tuple(i for i, ts in enumerate(self.render_group)
+                     if ts.dirtytree.query_path(tilepath))
+
+    def _iterate_group_work_items(self):
+        """Like iterate_work_items(), but for every tileset in this
+        tileset's render group. The work items are (tilepath, members) tuples,
+        where members is from _get_group_members().
+
+        """
+        for tilepath in self._get_group_tree().posttraversal(robin=True):
+            members = self._get_group_members(tilepath)
+            dependencies = []
+            if len(tilepath) < self.treedepth:
+                for i in range(4):
+                    childpath = tilepath + (i,)
+                    dependencies.append((childpath, self._get_group_members(childpath)))
+            for i in members:
+                ts = self.render_group[i]
+                fd = ts.options.get("changelist", None)
+                if fd:
+                    ts._write_changelist(fd, tilepath)
+            yield (tilepath, members), dependencies
+
     def do_work(self, tilepath):
         """Renders the given tile.
 
         tilepath is yielded by iterate_work_items and is an iterable of
-        integers representing the path of the tile to render.
+        integers representing the path of the tile to render. For a tileset
+        that renders for a group of tilesets, it's a (tilepath, members) tuple
+        instead, and the tile is rendered for each of those members.
 
         """
+        if self.render_group is not None:
+            tilepath, members = tilepath
+            tilesets = [self.render_group[i] for i in members]
+        else:
+            tilesets = [self]
+
         if len(tilepath) == self.treedepth:
             # A render-tile
-            self._render_rendertile(RenderTile.from_path(tilepath))
+            metrics.set_label(self.options['name'])
+            self._render_rendertile(RenderTile.from_path(tilepath), tilesets)
         else:
             # A composite-tile
-            if len(tilepath) == 0:
-                # The base tile
-                dest = self.outputdir
-                name = "base"
-            else:
-                # All others
-                dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
-                name = str(tilepath[-1])
-            self._render_compositetile(dest, name)
+            for ts in tilesets:
+                metrics.set_label(ts.options['name'])
+                if len(tilepath) == 0:
+                    # The base tile
+                    dest = ts.outputdir
+                    name = "base"
+                else:
+                    # All others
+                    dest = os.path.join(ts.outputdir, *(str(x) for x in tilepath[:-1]))
+                    name = str(tilepath[-1])
+                ts._render_compositetile(dest, name)
 
     def get_initial_data(self):
         """This is called similarly to get_persistent_data, but is called after
@@ -822,7 +924,8 @@ class TileSet(object):
         unconditionally, does not check any mtimes.
 
         As a side-effect, the scan sets self.max_chunk_mtime to the max of all
-        the chunks' mtimes
+        the chunks' mtimes, and self.seen_blockids to the block ids used by the
+        chunks that need rendering (only collected for a texture preflight)
 
         """
         # See note at the top of this file about the rendercheck modes for an
@@ -847,6 +950,13 @@ class TileSet(object):
 
         max_chunk_mtime = 0
 
+        # with a texture preflight, note the blocks of the chunks that will
+        # be rendered, so their textures can be made up front. In
+        # --check-tiles mode that's only known per tile while rendering, so
+        # like --forcerender it takes every chunk
+        preflight = getattr(self.textures, 'preflight', False)
+        seen_blockids = set()
+
         # For each chunk, do this:
         #   For each tile that the chunk touches, do this:
         #       Compare the last modified time of the chunk and tile. If the
@@ -860,6 +970,9 @@ class TileSet(object):
             if chunkmtime > max_chunk_mtime:
                 max_chunk_mtime = chunkmtime
 
+            if preflight and (markall or chunkmtime > last_rendertime):
+                seen_blockids.update(self.regionset.get_chunk_blockids(chunkx, chunkz))
+
             # Convert to diagonal coordinates
             chunkcol, chunkrow = convert_coords(chunkx, chunkz)
 
@@ -912,6 +1025,7 @@ class TileSet(object):
             "s" if t != 1 else "")
 
         self.max_chunk_mtime = max_chunk_mtime
+        self.seen_blockids = seen_blockids
         return dirty
 
     def __str__(self):
@@ -976,45 +1090,49 @@ class TileSet(object):
             return
 
         # Create the actual image now
-        img = Image.new("RGBA", (384, 384), self.options['bgcolor'])
-        # We'll use paste (NOT alpha_over) for quadtree generation because
-        # this is just straight image stitching, not alpha blending
-        for path in quadPath_filtered:
-            try:
-                src = Image.open(path[1])
-                # optimizeimg may have converted them to a palette image in the meantime
-                if src.mode != "RGB" and src.mode != "RGBA":
-                    src = src.convert("RGBA")
-                src.load()
-
-                quad = Image.new("RGBA", (192, 192), self.options['bgcolor'])
-                resize_half(quad, src)
-                img.paste(quad, path[0])
-            except Exception as e:
-                logging.warning("Couldn't open %s. It may be corrupt. Error was '%s'.", path[1], e)
-                logging.warning(
-                    "I'm going to try and delete it. You will need to run "
-                    "the render again and with --check-tiles.")
+        with metrics.stage("composite"):
+            img = Image.new("RGBA", (384, 384), self.options['bgcolor'])
+            # We'll use paste (NOT alpha_over) for quadtree generation because
+            # this is just straight image stitching, not alpha blending
+            for path in quadPath_filtered:
                 try:
-                    os.unlink(path[1])
+                    src = Image.open(path[1])
+                    # optimizeimg may have converted them to a palette image in the meantime
+                    if src.mode != "RGB" and src.mode != "RGBA":
+                        src = src.convert("RGBA")
+                    src.load()
+
+                    quad = Image.new("RGBA", (192, 192), self.options['bgcolor'])
+                    resize_half(quad, src)
+                    img.paste(quad, path[0])
                 except Exception as e:
-                    logging.error(
-                        "While attempting to delete corrupt image %s, an error was encountered. "
-                        "You will need to delete it yourself. Error was '%s'", path[1], e)
+                    logging.warning("Couldn't open %s. It may be corrupt. Error was '%s'.", path[1], e)
+                    logging.warning(
+                        "I'm going to try and delete it. You will need to run "
+                        "the render again and with --check-tiles.")
+                    try:
+                        os.unlink(path[1])
+                    except Exception as e:
+                        logging.error(
+                            "While attempting to delete corrupt image %s, an error was encountered. "
+                            "You will need to delete it yourself. Error was '%s'", path[1], e)
 
         # Save it
-        with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
-            if imgformat == 'jpg':
-                img.convert('RGB').save(tmppath, "jpeg", quality=self.options['imgquality'],
-                                        subsampling=0)
-            elif imgformat == 'png':   # PNG
-                img.save(tmppath, "png")
-            elif imgformat == 'webp':
-                img.save(tmppath, "webp", quality=self.options['imgquality'],
-                         lossless=self.options['imglossless'])
+        with metrics.stage("write"), FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
+            with metrics.stage("encode"):
+                if imgformat == 'jpg':
+                    img.convert('RGB').save(tmppath, "jpeg", quality=self.options['imgquality'],
+                                            subsampling=0)
+                elif imgformat == 'png':   # PNG
+                    img.save(tmppath, "png")
+                elif imgformat == 'webp':
+                    img.save(tmppath, "webp", quality=self.options['imgquality'],
+                             lossless=self.options['imglossless'])
 
             if self.options['optimizeimg']:
-                optimize_image(tmppath, imgformat, self.options['optimizeimg'])
+                with metrics.stage("optimize"):
+                    optimize_image(tmppath, imgformat, self.options['optimizeimg'])
+            self._count_written(tmppath)
 
             try:
                 os.utime(tmppath, (max_mtime, max_mtime))
@@ -1025,21 +1143,43 @@ class TileSet(object):
                 if e.errno != errno.ENOENT:
                     raise
 
-    def _render_rendertile(self, tile):
+    def _get_rendermode(self):
+        """Returns this tileset's render primitives, set up for reuse with
+        c_overviewer.render_loop(). They're made the first time this is called
+        in each process, since they can't be pickled.
+
+        """
+        if self.rendermode is None:
+            try:
+                self.rendermode = c_overviewer.create_rendermode(
+                    self.options['rendermode'], self.world, self.textures)
+            except Exception:
+                logging.error("Could not set up the render primitives for %s. "
+                              "This is likely a render primitive option error.",
+                              self.options['name'])
+                logging.error("Full error was:", exc_info=1)
+                sys.exit(1)
+        return self.rendermode
+
+    def _render_rendertile(self, tile, tilesets=None):
         """Renders the given render-tile.
 
         This function is called from the public do_work() method in the child
         process. The tile is assumed to need rendering and is rendered
         unconditionally.
 
-        The argument is a RenderTile object
+        The argument is a RenderTile object, and optionally the list of
+        tilesets (from this tileset's render group) to render it for. The
+        chunks are only read once for all of them.
 
-        The image is rendered and saved to disk in the place this tileset is
+        The image is rendered and saved to disk in the place each tileset is
         configured to save images.
 
         """
+        if tilesets is None:
+            tilesets = [self]
 
-        imgpath = tile.get_filepath(self.outputdir, self.imgextension)
+        imgpaths = [tile.get_filepath(ts.outputdir, ts.imgextension) for ts in tilesets]
 
         # Calculate which chunks are relevant to this tile
         # This is a list of (col, row, chunkx, chunkz, chunk_mtime)
@@ -1049,30 +1189,33 @@ class TileSet(object):
             # No chunks were found in this tile
             logging.warning("%s was requested for render, but no chunks found! "
                             "This may be a bug.", tile)
-            try:
-                os.unlink(imgpath)
-            except OSError as e:
-                # ignore only if the error was "file not found"
-                if e.errno != errno.ENOENT:
-                    raise
-            else:
-                logging.debug("%s deleted", tile)
+            for imgpath in imgpaths:
+                try:
+                    os.unlink(imgpath)
+                except OSError as e:
+                    # ignore only if the error was "file not found"
+                    if e.errno != errno.ENOENT:
+                        raise
+                else:
+                    logging.debug("%s deleted", tile)
             return
 
-        # Create the directory if not exists
-        dirdest = os.path.dirname(imgpath)
-        if not os.path.exists(dirdest):
-            try:
-                os.makedirs(dirdest)
-            except OSError as e:
-                # Ignore errno EEXIST: file exists. Due to a race condition,
-                # two processes could conceivably try and create the same
-                # directory at the same time
-                if e.errno != errno.EEXIST:
-                    raise
+        for imgpath in imgpaths:
+            # Create the directory if not exists
+            dirdest = os.path.dirname(imgpath)
+            if not os.path.exists(dirdest):
+                try:
+                    os.makedirs(dirdest)
+                except OSError as e:
+                    # Ignore errno EEXIST: file exists. Due to a race condition,
+                    # two processes could conceivably try and create the same
+                    # directory at the same time
+                    if e.errno != errno.EEXIST:
+                        raise
 
-        # Compile this image
-        tileimg = Image.new("RGBA", (384, 384), self.options['bgcolor'])
+        # Compile these images
+        tileimgs = [Image.new("RGBA", (384, 384), ts.options['bgcolor']) for ts in tilesets]
+        modes = [ts._get_rendermode() for ts in tilesets]
 
         colstart = tile.col
         rowstart = tile.row
@@ -1088,9 +1231,11 @@ class TileSet(object):
 
             # draw the chunk!
             try:
-                c_overviewer.render_loop(
-                    self.world, self.regionset, chunkx, chunky, chunkz, tileimg, xpos, ypos,
-                    self.options['rendermode'], self.textures)
+                with metrics.stage("render"):
+                    c_overviewer.render_loop_multi(
+                        self.world, self.regionset, chunkx, chunky, chunkz,
+                        [(tileimg, xpos, ypos, rendermode, ts.textures)
+                         for ts, tileimg, rendermode in zip(tilesets, tileimgs, modes)])
             except nbt.CorruptionError:
                 # A warning and traceback was already printed by world.py's
                 # get_chunk()
@@ -1106,19 +1251,36 @@ class TileSet(object):
                 logging.error("Full error was:", exc_info=1)
                 sys.exit(1)
 
-        # Save them
-        with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
-            if self.imgextension == 'jpg':
-                tileimg.convert('RGB').save(tmppath, "jpeg", quality=self.options['imgquality'],
-                                            subsampling=0)
-            elif self.imgextension == 'png':   # PNG
-                tileimg.save(tmppath, "png")
-            elif self.imgextension == 'webp':
-                tileimg.save(tmppath, "webp", quality=self.options['imgquality'],
-                         lossless=self.options['imglossless'])
+        for ts, tileimg, imgpath in zip(tilesets, tileimgs, imgpaths):
+            metrics.set_label(ts.options['name'])
+            ts._save_rendertile(tileimg, imgpath, max_chunk_mtime)
+
+    def _save_rendertile(self, tileimg, imgpath, mtime):
+        """Saves a rendered render-tile image in this tileset's format"""
+        with metrics.stage("write"), FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
+            with metrics.stage("encode"):
+                if self.imgextension == 'jpg':
+                    tileimg.convert('RGB').save(tmppath, "jpeg", quality=self.options['imgquality'],
+                                                subsampling=0)
+                elif self.imgextension == 'png':   # PNG
+                    tileimg.save(tmppath, "png")
+                elif self.imgextension == 'webp':
+                    tileimg.save(tmppath, "webp", quality=self.options['imgquality'],
+                             lossless=self.options['imglossless'])
             if self.options['optimizeimg']:
-                optimize_image(tmppath, self.imgextension, self.options['optimizeimg'])
-            os.utime(tmppath, (max_chunk_mtime, max_chunk_mtime))
+                with metrics.stage("optimize"):
+                    optimize_image(tmppath, self.imgextension, self.options['optimizeimg'])
+            self._count_written(tmppath)
+            os.utime(tmppath, (mtime, mtime))
+
+    def _count_written(self, tmppath):
+        """Adds the size of a tile that's about to be written to the
+        metrics, if they're being recorded"""
+        if metrics.recorder.enabled:
+            try:
+                metrics.count("bytes.written", os.path.getsize(tmppath))
+            except OSError:
+                pass
 
     def _iterate_and_check_tiles(self, path):
         """A generator function over all tiles that should exist in the subtree
@@ -1279,6 +1441,37 @@ class TileSet(object):
                 shutil.rmtree(dirpath)
 
 
+def share_renders(tilesets):
+    """Groups together the tilesets that render the same regionset object
+    (and so the same world, dimension, crop and rotation), so that one
+    traversal of the tile tree renders the tiles for all of them, reading
+    each chunk only once.
+
+    The first tileset of each group renders the tiles for the group; the
+    others have no work items of their own. Only tilesets that know up front
+    which tiles need rendering (renderchecks modes 0 and 2) are grouped. This
+    must be called after do_preprocessing().
+
+    """
+    groups = {}
+    for ts in tilesets:
+        if ts.options['renderchecks'] not in (0, 2):
+            continue
+        key = (id(ts.regionset), ts.treedepth)
+        groups.setdefault(key, []).append(ts)
+
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        logging.debug("Rendering %s together",
+                      ", ".join(ts.options['name'] for ts in group))
+        leader = group[0]
+        leader.render_group = group
+        leader.grouptree = None
+        for ts in group[1:]:
+            ts.render_leader = leader
+
+
 #
 # Functions for converting (x, z) to (col, row) and back
 #
@@ -14,6 +14,7 @@
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
 import functools
+import json
 import os
 import os.path
 import logging
@@ -26,6 +27,8 @@ import numpy
 
 from . import nbt
 from . import cache
+from . import metrics
+from .files import FileReplacer
 
 """
 This module has routines for extracting information about available worlds
@@ -59,6 +62,59 @@ def log_other_exceptions(func):
     return newfunc
 
 
+# Directories at the top of a world that never hold region sets, so the scan
+# for them doesn't need to look inside (the player directories can be huge).
+# Further down, e.g. in datapack dimensions, these names may be anything.
+NON_REGION_DIRS = frozenset(["advancements", "data", "datapacks", "playerdata", "players",
+                             "poi", "stats"])
+
+def scan_world_dirs(worlddir, listings=None, newlistings=None):
+    """Returns an iterator over (dirpath, mcafiles) for the directories in
+    worlddir that may hold region files, top-down like os.walk(). mcafiles
+    is a list of the names of the .mca files in dirpath.
+
+    listings, if given, is a dict of directory listings from an earlier scan,
+    as put in newlistings by that scan. The listing of a directory is used
+    instead of reading it again if its mtime hasn't changed.
+
+    """
+    if listings is None:
+        listings = {}
+
+    def scan(path, rel):
+        skipped = NON_REGION_DIRS if rel == "." else ()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        cached = listings.get(rel)
+        if cached is not None and cached[0] == mtime:
+            subdirs, mcas = cached[1], cached[2]
+        else:
+            subdirs, mcas = [], []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            if entry.name not in skipped:
+                                subdirs.append(entry.name)
+                        elif entry.name.endswith(".mca"):
+                            mcas.append(entry.name)
+            except OSError:
+                return
+        # mtimes are only so precise, so a directory that changed in the last
+        # couple of seconds could change again without its mtime changing.
+        # Don't keep those.
+        if newlistings is not None and time.time() - mtime / 1e9 > 2:
+            newlistings[rel] = [mtime, subdirs, mcas]
+
+        yield path, mcas
+        for name in subdirs:
+            for item in scan(os.path.join(path, name), os.path.normpath(os.path.join(rel, name))):
+                yield item
+
+    return scan(worlddir, ".")
+
 class World(object):
     """Encapsulates the concept of a Minecraft "world". A Minecraft world is a
     level.dat file, a players directory with info about each player, a data
@@ -86,7 +142,15 @@ class World(object):
 
     """
 
-    def __init__(self, worlddir):
+    def __init__(self, worlddir, listingcache=None, quarantine=None):
+        """listingcache, if given, is the path to a file to keep the listings
+        of the world's directories in between runs, to speed up finding the
+        region sets. It may be shared by several worlds.
+
+        quarantine, if given, is the ChunkQuarantine for the region sets to
+        use (see RegionSet).
+
+        """
         self.worlddir = worlddir
 
         # This list, populated below, will hold RegionSet files that are in
@@ -128,18 +192,20 @@ class World(object):
         # seem to be any set standard on what dimensions are in each world,
         # just scan the directory heirarchy to find a directory with .mca
         # files.
-        for root, dirs, files in os.walk(self.worlddir, followlinks=True):
-            # any .mcr files in this directory?
-            mcas = [x for x in files if x.endswith(".mca")]
-            if mcas:
+        listings = self._load_listings(listingcache) if listingcache else None
+        newlistings = {}
+        for root, mcas in scan_world_dirs(self.worlddir, listings, newlistings):
+            # any .mca files in this directory?
+            rel = os.path.relpath(root, self.worlddir)
+            if mcas and os.path.basename(rel) != "poi":
                 # construct a regionset object for this
-                rel = os.path.relpath(root, self.worlddir)
-                if os.path.basename(rel) != "poi":
-                    rset = RegionSet(root, rel)
-                    if root == os.path.join(self.worlddir, "region"):
-                        self.regionsets.insert(0, rset)
-                    else:
-                        self.regionsets.append(rset)
+                rset = RegionSet(root, rel, mcas, quarantine)
+                if root == os.path.join(self.worlddir, "region"):
+                    self.regionsets.insert(0, rset)
+                else:
+                    self.regionsets.append(rset)
+        if listingcache and newlistings != listings:
+            self._save_listings(listingcache, newlistings)
 
         # TODO move a lot of the following code into the RegionSet
 
@@ -159,6 +225,38 @@ class World(object):
 
         # TODO figure out where to handle regionlists
 
+    def _load_listings(self, listingcache):
+        """Returns this world's directory listings from the given listing
+        cache file, for scan_world_dirs()
+
+        """
+        try:
+            with open(listingcache) as f:
+                return json.load(f).get(os.path.abspath(self.worlddir), {})
+        except (IOError, ValueError, AttributeError):
+            return {}
+
+    def _save_listings(self, listingcache, listings):
+        """Replaces this world's directory listings in the given listing
+        cache file, keeping those of any other worlds
+
+        """
+        try:
+            with open(listingcache) as f:
+                allworlds = json.load(f)
+            if not isinstance(allworlds, dict):
+                allworlds = {}
+        except (IOError, ValueError):
+            allworlds = {}
+        allworlds[os.path.abspath(self.worlddir)] = listings
+        try:
+            with FileReplacer(listingcache) as tmppath:
+                with open(tmppath, "w") as f:
+                    json.dump(allworlds, f)
+        except (IOError, OSError):
+            logging.warning("Couldn't save the world directory listings to %s", listingcache)
+            logging.debug("Full error was:", exc_info=1)
+
     def get_regionsets(self):
         return self.regionsets
     def get_regionset(self, index):
@@ -236,6 +334,121 @@ class World(object):
             inChunkY = 0
         return spawnX, 256, spawnZ
 
+class ChunkQuarantine(object):
+    """Remembers the chunks that couldn't be read, so they're given up on right
+    away the next time they're asked for instead of being retried again.
+
+    Each entry is keyed by the region file and the chunk's coordinates, and
+    holds the chunk's timestamp when it was found to be corrupt (or the
+    region file's mtime, if the region's header was the problem). Once that
+    changes, the chunk is tried again.
+
+    If path is given, entries are appended to that file as they're added, so
+    they're shared with the other worker processes and with later runs. Call
+    prune() before a render to forget the chunks that changed since.
+
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        # how much of the file has been read into entries
+        self.offset = 0
+        self.refresh()
+
+    # Re-read the file upon unpickling
+    def __getstate__(self):
+        return self.path
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def refresh(self):
+        """Reads any entries added to the file since it was last read, e.g. by
+        other processes
+
+        """
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except IOError:
+            return
+        # leave any partly written last line for next time
+        data = data[:data.rfind(b"\n") + 1]
+        self.offset += len(data)
+        for line in data.splitlines():
+            try:
+                regionfile, x, z, stamp = json.loads(line.decode("utf-8"))
+                self.entries[(regionfile, x, z)] = stamp
+            except (ValueError, TypeError):
+                logging.debug("Ignoring a malformed line in %s", self.path)
+
+    def get(self, regionfile, x, z):
+        """Returns the stamp a chunk was quarantined with, or None"""
+        return self.entries.get((regionfile, x, z))
+
+    def prune(self):
+        """Forgets the chunks that changed, or are gone, since they were
+        quarantined, and rewrites the file without them. Only call this while
+        no other process is adding entries.
+
+        """
+        regions = {}
+        def get_stamp(regionfile, x, z):
+            # like RegionSet._get_chunk_stamp(), or None if the chunk's gone
+            if regionfile not in regions:
+                try:
+                    regions[regionfile] = nbt.load_region(regionfile)
+                except nbt.CorruptRegionError:
+                    regions[regionfile] = None
+            region = regions[regionfile]
+            if region is None:
+                return os.path.getmtime(regionfile)
+            if not region.chunk_exists(x, z):
+                return None
+            return region.get_chunk_timestamp(x, z)
+
+        stale = []
+        for (regionfile, x, z), stamp in self.entries.items():
+            try:
+                if get_stamp(regionfile, x, z) != stamp:
+                    stale.append((regionfile, x, z))
+            except (IOError, OSError):
+                stale.append((regionfile, x, z))
+        for region in regions.values():
+            if region is not None:
+                region.close()
+
+        if not stale:
+            return
+        logging.debug("Forgetting %d corrupt chunks that have changed since.", len(stale))
+        for key in stale:
+            del self.entries[key]
+        if self.path is None:
+            return
+        try:
+            with FileReplacer(self.path) as tmppath:
+                with open(tmppath, "w") as f:
+                    for (regionfile, x, z), stamp in self.entries.items():
+                        f.write(json.dumps([regionfile, x, z, stamp]) + "\n")
+            self.offset = os.path.getsize(self.path)
+        except (IOError, OSError):
+            logging.debug("Couldn't write to %s", self.path, exc_info=1)
+
+    def add(self, regionfile, x, z, stamp):
+        self.entries[(regionfile, x, z)] = stamp
+        if self.path is None:
+            return
+        line = json.dumps([regionfile, x, z, stamp]) + "\n"
+        try:
+            # a single small write in append mode, so lines from different
+            # processes don't get mixed up
+            with open(self.path, "a") as f:
+                f.write(line)
+        except IOError:
+            logging.debug("Couldn't write to %s", self.path, exc_info=1)
+
 class RegionSet(object):
     """This object is the gateway to a particular Minecraft dimension within a
     world. It corresponds to a set of region files containing the actual
@@ -248,7 +461,7 @@ class RegionSet(object):
 
     """
 
-    def __init__(self, regiondir, rel):
+    def __init__(self, regiondir, rel, filenames=None, quarantine=None):
         """Initialize a new RegionSet to access the region files in the given
         directory.
 
@@ -257,6 +470,12 @@ class RegionSet(object):
         rel is the relative path of this directory, with respect to the
         world directory.
 
+        filenames, if given, is a list of the names of the files in regiondir,
+        so it doesn't need to be listed again.
+
+        quarantine, if given, is a ChunkQuarantine to record the corrupt
+        chunks in and look them up from.
+
         cachesize, if specified, is the number of chunks to keep parsed and
         in-memory.
 
@@ -281,12 +500,19 @@ class RegionSet(object):
         # This is populated below. It is a mapping from (x,y) region coords to filename
         self.regionfiles = {}
 
+        # The mtimes of the region files, only looked up when they're needed
+        # (by iterate_newer_chunks()); on network filesystems each of them can
+        # take a while
+        self.regionmtimes = {}
+
         # This holds a cache of open regionfile objects
         self.regioncache = cache.LRUCache(size=16, destructor=lambda regionobj: regionobj.close())
 
-        for x, y, regionfile in self._iterate_regionfiles():
+        self.quarantine = quarantine
+
+        for x, y, regionfile in self._iterate_regionfiles(filenames):
             # regionfile is a pathname
-            self.regionfiles[(x,y)] = (regionfile, os.path.getmtime(regionfile))
+            self.regionfiles[(x,y)] = regionfile
 
         self.empty_chunk = [None,None]
         logging.debug("Done scanning regions")
@@ -846,9 +1072,11 @@ class RegionSet(object):
             self._blockmap['minecraft:%s_concrete_powder'    % colors[i]] = (252, i)
 
 
-    # Re-initialize upon unpickling
+    # Re-initialize upon unpickling, from the same list of region files
     def __getstate__(self):
-        return (self.regiondir, self.rel)
+        return (self.regiondir, self.rel,
+                [os.path.basename(path) for path in self.regionfiles.values()],
+                self.quarantine)
     def __setstate__(self, state):
         return self.__init__(*state)
 
@@ -1121,6 +1349,27 @@ class RegionSet(object):
         # path will be normalized in __init__
         return self.type
 
+    def _get_chunk_stamp(self, regionfile, x, z):
+        """Returns what a corrupt chunk is quarantined with: its timestamp,
+        or the region file's mtime if the region's header can't be read
+
+        """
+        try:
+            return self._get_regionobj(regionfile).get_chunk_timestamp(x, z)
+        except nbt.CorruptRegionError:
+            return os.path.getmtime(regionfile)
+
+    def _is_quarantined(self, regionfile, x, z):
+        if self.quarantine is None:
+            return False
+        stamp = self.quarantine.get(regionfile, x, z)
+        # only look at the chunk itself if it was corrupt before
+        return stamp is not None and stamp == self._get_chunk_stamp(regionfile, x, z)
+
+    def _quarantine_chunk(self, regionfile, x, z):
+        if self.quarantine is not None:
+            self.quarantine.add(regionfile, x, z, self._get_chunk_stamp(regionfile, x, z))
+
     def _get_regionobj(self, regionfilename):
         # Check the cache first. If it's not there, create the
         # nbt.MCRFileReader object, cache it, and return it
@@ -1136,7 +1385,7 @@ class RegionSet(object):
         bits_per_value = (len(long_array) * 64) / n
         if bits_per_value < 4 or 12 < bits_per_value:
             raise nbt.CorruptChunkError()
-        b = numpy.frombuffer(numpy.asarray(long_array, dtype=numpy.uint64), dtype=numpy.uint8)
+        b = numpy.frombuffer(numpy.asarray(long_array, dtype=numpy.int64), dtype=numpy.uint8)
         # give room for work, later
         b = b.astype(numpy.uint16)
         if bits_per_value == 8:
@@ -1168,7 +1417,7 @@ class RegionSet(object):
             result[4::8] = ((b[4::7] & 0x07) << 4) | ((b[3::7] & 0xf0) >> 4)
             result[5::8] = ((b[5::7] & 0x03) << 5) | ((b[4::7] & 0xf8) >> 3)
             result[6::8] = ((b[6::7] & 0x01) << 6) | ((b[5::7] & 0xfc) >> 2)
-            result[7::8] =  (b[6::7] & 0xfc) >> 1
+            result[7::8] =  (b[6::7] & 0xfe) >> 1
         # bits_per_value == 8 is handled above
         elif bits_per_value == 9:
             result[0::8] = ((b[1::9] & 0x01) << 8) |   b[0::9]
@@ -1191,7 +1440,7 @@ class RegionSet(object):
             result[3::8] = ((b[ 5::11] & 0x0f) << 7 ) | ((b[ 4::11] & 0xfe) >> 1 )
             result[4::8] = ((b[ 6::11] & 0x7f) << 4 ) | ((b[ 5::11] & 0xf0) >> 4 )
             result[5::8] = ((b[ 8::11] & 0x03) << 9 ) | ( b[ 7::11]         << 1 ) | ((b[ 6::11] & 0x80) >> 7 )
-            result[6::8] = ((b[ 9::11] & 0x1f) << 2 ) | ((b[ 8::11] & 0xfc) >> 2 )
+            result[6::8] = ((b[ 9::11] & 0x1f) << 6 ) | ((b[ 8::11] & 0xfc) >> 2 )
             result[7::8] = ( b[10::11]         << 3 ) | ((b[ 9::11] & 0xe0) >> 5 )
         elif bits_per_value == 12:
             result[0::2] = ((b[1::3] & 0x0f) << 8) |   b[0::3]
@@ -1254,46 +1503,33 @@ class RegionSet(object):
 
         return (blocks, data_expanded)
 
-    #@log_other_exceptions
-    def get_chunk(self, x, z):
-        """Returns a dictionary object representing the "Level" NBT Compound
-        structure for a chunk given its x, z coordinates. The coordinates given
-        are chunk coordinates. Raises ChunkDoesntExist exception if the given
-        chunk does not exist.
-
-        The returned dictionary corresponds to the "Level" structure in the
-        chunk file, with a few changes:
-
-        * The Biomes array is transformed into a 16x16 numpy array
+    def _load_chunk(self, regionfile, x, z, select=None):
+        """Reads the given chunk from its region file, retrying a few times
+        if it seems to be corrupt, and returns its (name, data) NBT tuple.
+        select is passed on to nbt.MCRFileReader.load_chunk().
 
-        * For each chunk section:
-
-          * The "Blocks" byte string is transformed into a 16x16x16 numpy array
-          * The Add array, if it exists, is bitshifted left 8 bits and
-            added into the Blocks array
-          * The "SkyLight" byte string is transformed into a 16x16x128 numpy
-            array
-          * The "BlockLight" byte string is transformed into a 16x16x128 numpy
-            array
-          * The "Data" byte string is transformed into a 16x16x128 numpy array
-
-        Warning: the returned data may be cached and thus should not be
-        modified, lest it affect the return values of future calls for the same
-        chunk.
+        Raises ChunkDoesntExist if the chunk doesn't exist.
         """
-        regionfile = self._get_region_path(x, z)
         if regionfile is None:
             raise ChunkDoesntExist("Chunk %s,%s doesn't exist (and neither does its region)" % (x,z))
 
+        if self._is_quarantined(regionfile, x, z):
+            raise nbt.CorruptChunkError("Chunk %s,%s was found to be corrupt before" % (x,z))
+
         # Try a few times to load and parse this chunk before giving up and
         # raising an error
         tries = 5
         while True:
             try:
                 region = self._get_regionobj(regionfile)
-                data = region.load_chunk(x, z)
+                data = region.load_chunk(x, z, select)
             except nbt.CorruptionError as e:
                 tries -= 1
+                if tries == 4 and self.quarantine is not None:
+                    # Another process may have given up on it already
+                    self.quarantine.refresh()
+                    if self._is_quarantined(regionfile, x, z):
+                        raise
                 if tries > 0:
                     # Flush the region cache to possibly read a new region file
                     # header
@@ -1314,6 +1550,7 @@ class RegionSet(object):
                         logging.warning("Tried several times to read chunk %d,%d. Unknown error. Giving up.",
                                 x, z)
                     logging.debug("Full traceback:", exc_info=1)
+                    self._quarantine_chunk(regionfile, x, z)
                     # Let this exception propagate out through the C code into
                     # tileset.py, where it is caught and gracefully continues
                     # with the next chunk
@@ -1324,10 +1561,11 @@ class RegionSet(object):
 
         if data is None:
             raise ChunkDoesntExist("Chunk %s,%s doesn't exist" % (x,z))
+        return data
 
-        level = data[1]['Level']
-        chunk_data = level
-
+    def _check_status(self, chunk_data, x, z):
+        """Raises ChunkDoesntExist if the chunk with the given "Level"
+        structure isn't generated far enough to be rendered"""
         # From the interior of a map to the edge, a chunk's status may be one of:
         # - postprocessed (interior, or next to fullchunk)
         # - fullchunk (next to decorated)
@@ -1342,6 +1580,62 @@ class RegionSet(object):
                                                 "mobs_spawned", "spawn", ""):
             raise ChunkDoesntExist("Chunk %s,%s doesn't exist" % (x,z))
 
+    def get_chunk_entities(self, x, z):
+        """Returns the Entities and TileEntities lists of the given chunk, as
+        a dictionary like the one returned by get_chunk() but with only
+        those two keys. Nothing else in the chunk is parsed, so this is much
+        quicker than get_chunk() when the entities are all that's needed.
+
+        Raises ChunkDoesntExist and nbt.CorruptionError like get_chunk(),
+        including for chunks that aren't fully generated yet.
+        """
+        data = self._load_chunk(self._get_region_path(x, z), x, z,
+                                {'Level': {'Status': True, 'Entities': True,
+                                           'TileEntities': True}})
+        level = data[1].get('Level', {})
+        self._check_status(level, x, z)
+        return {'Entities': level.get('Entities', []),
+                'TileEntities': level.get('TileEntities', [])}
+
+    #@log_other_exceptions
+    def get_chunk(self, x, z):
+        """Returns a dictionary object representing the "Level" NBT Compound
+        structure for a chunk given its x, z coordinates. The coordinates given
+        are chunk coordinates. Raises ChunkDoesntExist exception if the given
+        chunk does not exist.
+
+        The returned dictionary corresponds to the "Level" structure in the
+        chunk file, with a few changes:
+
+        * The Biomes array is transformed into a 16x16 numpy array
+
+        * For each chunk section:
+
+          * The "Blocks" byte string is transformed into a 16x16x16 numpy array
+          * The Add array, if it exists, is bitshifted left 8 bits and
+            added into the Blocks array
+          * The "SkyLight" byte string is transformed into a 16x16x128 numpy
+            array
+          * The "BlockLight" byte string is transformed into a 16x16x128 numpy
+            array
+          * The "Data" byte string is transformed into a 16x16x128 numpy array
+
+        Warning: the returned data may be cached and thus should not be
+        modified, lest it affect the return values of future calls for the same
+        chunk.
+        """
+        regionfile = self._get_region_path(x, z)
+        data = self._load_chunk(regionfile, x, z)
+
+        with metrics.stage("decode"):
+            return self._decode_chunk(regionfile, x, z, data[1]['Level'])
+
+    def _decode_chunk(self, regionfile, x, z, chunk_data):
+        """Turns the "Level" structure of the given chunk into what
+        get_chunk() returns"""
+
+        self._check_status(chunk_data, x, z)
+
         # Turn the Biomes array into a 16x16 numpy array
         if 'Biomes' in chunk_data and len(chunk_data['Biomes']) > 0:
             biomes = chunk_data['Biomes']
@@ -1401,6 +1695,7 @@ class RegionSet(object):
                 logging.warning("There was a problem reading chunk %d,%d.  It might be corrupt.  I am giving up and will not render this particular chunk.", x, z)
 
                 logging.debug("Full traceback:", exc_info=1)
+                self._quarantine_chunk(regionfile, x, z)
                 raise nbt.CorruptChunkError()
 
         for k in unrecognized_block_types:
@@ -1409,32 +1704,82 @@ class RegionSet(object):
         return chunk_data
 
 
-    def iterate_chunks(self):
+    def get_chunk_blockids(self, x, z):
+        """Returns the set of block ids used in the given chunk. This only
+        reads the section palettes (for pre-1.13 chunks, the Blocks arrays),
+        skipping over the rest of the chunk without parsing it.
+
+        Returns an empty set if the chunk doesn't exist, can't be read, or
+        isn't generated far enough for get_chunk() to return it.
+        """
+        regionfile = self._get_region_path(x, z)
+        if regionfile is None:
+            return set()
+        try:
+            data = self._get_regionobj(regionfile).load_chunk(x, z, {
+                'Level': {'Status': True,
+                          'Sections': {'Palette': True, 'Blocks': True, 'Add': True,
+                                       'Data': True}}})
+        except nbt.CorruptionError:
+            return set()
+        if data is None:
+            return set()
+        try:
+            self._check_status(data[1].get('Level', {}), x, z)
+        except ChunkDoesntExist:
+            return set()
+
+        blockids = set()
+        for section in data[1]['Level'].get('Sections', []):
+            try:
+                if 'Palette' in section:
+                    for entry in section['Palette']:
+                        try:
+                            blockids.add(self._get_block(entry)[0])
+                        except KeyError:
+                            pass
+                elif 'Blocks' in section:
+                    blocks, _ = self._get_blockdata_v112(section)
+                    blockids.update(numpy.unique(blocks).tolist())
+            except ValueError:
+                # malformed section, get_chunk() will complain about it
+                pass
+        return blockids
+
+    def iterate_chunks(self, bounds=None):
         """Returns an iterator over all chunk metadata in this world. Iterates
         over tuples of integers (x,z,mtime) for each chunk.  Other chunk data
         is not returned here.
 
+        If bounds is given, it is a list of (xmin, zmin, xmax, zmax) boxes in
+        chunk coordinates (inclusive), and only the chunks inside one of them
+        are returned. Region files outside all of them aren't read at all.
+
         """
 
-        for (regionx, regiony), (regionfile, filemtime) in self.regionfiles.items():
+        for (regionx, regiony), regionfile in self._iterate_regions(bounds):
             try:
                 mcr = self._get_regionobj(regionfile)
             except nbt.CorruptRegionError:
                 logging.warning("Found a corrupt region file at %s,%s in %s, Skipping it.", regionx, regiony, self.regiondir)
                 continue
             for chunkx, chunky in mcr.get_chunks():
-                yield chunkx+32*regionx, chunky+32*regiony, mcr.get_chunk_timestamp(chunkx, chunky)
+                x, z = chunkx+32*regionx, chunky+32*regiony
+                if bounds is None or in_bounds(x, z, bounds):
+                    yield x, z, mcr.get_chunk_timestamp(chunkx, chunky)
 
-    def iterate_newer_chunks(self, mtime):
+    def iterate_newer_chunks(self, mtime, bounds=None):
         """Returns an iterator over all chunk metadata in this world. Iterates
         over tuples of integers (x,z,mtime) for each chunk.  Other chunk data
         is not returned here.
 
+        bounds is as for iterate_chunks().
+
         """
 
-        for (regionx, regiony), (regionfile, filemtime) in self.regionfiles.items():
+        for (regionx, regiony), regionfile in self._iterate_regions(bounds):
             """ SKIP LOADING A REGION WHICH HAS NOT BEEN MODIFIED! """
-            if (filemtime < mtime):
+            if (self._get_region_mtime(regionfile) < mtime):
                 continue
 
             try:
@@ -1444,7 +1789,22 @@ class RegionSet(object):
                 continue
 
             for chunkx, chunky in mcr.get_chunks():
-                yield chunkx+32*regionx, chunky+32*regiony, mcr.get_chunk_timestamp(chunkx, chunky)
+                x, z = chunkx+32*regionx, chunky+32*regiony
+                if bounds is None or in_bounds(x, z, bounds):
+                    yield x, z, mcr.get_chunk_timestamp(chunkx, chunky)
+
+    def _iterate_regions(self, bounds):
+        """Iterates over the items of self.regionfiles for the regions that
+        have chunks inside the given bounds (see iterate_chunks())
+
+        """
+        if bounds is None:
+            return iter(self.regionfiles.items())
+        # the same boxes, in region coordinates
+        regionbounds = [(xmin//32, zmin//32, xmax//32, zmax//32)
+                        for xmin, zmin, xmax, zmax in bounds]
+        return ((coords, region) for coords, region in self.regionfiles.items()
+                if in_bounds(coords[0], coords[1], regionbounds))
 
     def get_chunk_mtime(self, x, z):
         """Returns a chunk's mtime, or False if the chunk does not exist.  This
@@ -1471,18 +1831,31 @@ class RegionSet(object):
         Coords can be either be global chunk coords, or local to a region
 
         """
-        (regionfile,filemtime) = self.regionfiles.get((chunkX//32, chunkY//32),(None, None))
-        return regionfile
+        return self.regionfiles.get((chunkX//32, chunkY//32))
+
+    def _get_region_mtime(self, regionfile):
+        """Returns the mtime of the given region file, as of the first time
+        it was asked for
+
+        """
+        try:
+            return self.regionmtimes[regionfile]
+        except KeyError:
+            mtime = self.regionmtimes[regionfile] = os.path.getmtime(regionfile)
+            return mtime
 
-    def _iterate_regionfiles(self):
+    def _iterate_regionfiles(self, filenames=None):
         """Returns an iterator of all of the region files, along with their
-        coordinates
+        coordinates. filenames is the listing of the region directory, if it
+        is already known.
 
         Returns (regionx, regiony, filename)"""
 
         logging.debug("regiondir is %s, has type %r", self.regiondir, self.type)
 
-        for f in os.listdir(self.regiondir):
+        if filenames is None:
+            filenames = os.listdir(self.regiondir)
+        for f in filenames:
             if re.match(r"^r\.-?\d+\.-?\d+\.mca$", f):
                 p = f.split(".")
                 x = int(p[1])
@@ -1491,6 +1864,16 @@ class RegionSet(object):
                     logging.warning("Holy shit what is up with region file %s !?" % f)
                 yield (x, y, os.path.join(self.regiondir, f))
 
+def in_bounds(x, z, bounds):
+    """Returns whether the point (x, z) is inside any of the given
+    (xmin, zmin, xmax, zmax) boxes. The boxes are inclusive.
+
+    """
+    for xmin, zmin, xmax, zmax in bounds:
+        if xmin <= x <= xmax and zmin <= z <= zmax:
+            return True
+    return False
+
 class RegionSetWrapper(object):
     """This is the base class for all "wrappers" of RegionSet objects. A
     wrapper is an object that acts similarly to a subclass: some methods are
@@ -1522,10 +1905,14 @@ class RegionSetWrapper(object):
         return self._r.get_biome_data(x,z)
     def get_chunk(self, x, z):
         return self._r.get_chunk(x,z)
-    def iterate_chunks(self):
-        return self._r.iterate_chunks()
-    def iterate_newer_chunks(self,filemtime):
-        return self._r.iterate_newer_chunks(filemtime)
+    def get_chunk_blockids(self, x, z):
+        return self._r.get_chunk_blockids(x,z)
+    def get_chunk_entities(self, x, z):
+        return self._r.get_chunk_entities(x,z)
+    def iterate_chunks(self, bounds=None):
+        return self._r.iterate_chunks(bounds)
+    def iterate_newer_chunks(self,filemtime, bounds=None):
+        return self._r.iterate_newer_chunks(filemtime, bounds)
     def get_chunk_mtime(self, x, z):
         return self._r.get_chunk_mtime(x,z)
 
@@ -1569,6 +1956,11 @@ class RotatedRegionSet(RegionSetWrapper):
         self.unrotate = self._unrotation_funcs[north_dir]
         self.rotate = self._rotation_funcs[north_dir]
 
+        # The rotated chunks. The renderer asks for each chunk once for every
+        # section it draws in it or next to it, so without this the same
+        # chunk would be rotated over and over again.
+        self.rotated = cache.LRUCache(size=100)
+
         super(RotatedRegionSet, self).__init__(rsetobj)
 
 
@@ -1580,7 +1972,19 @@ class RotatedRegionSet(RegionSetWrapper):
         self.__init__(args[0], args[1])
 
     def get_chunk(self, x, z):
-        x,z = self.unrotate(x,z)
+        try:
+            return self.rotated[x, z]
+        except KeyError:
+            pass
+        chunk_data = self._rotate_chunk(*self.unrotate(x, z))
+        self.rotated[x, z] = chunk_data
+        return chunk_data
+
+    def _rotate_chunk(self, x, z):
+        """Returns the chunk at the given un-rotated coordinates, rotated.
+        The arrays are rotated views of the original chunk's, not copies.
+
+        """
         chunk_data = dict(super(RotatedRegionSet, self).get_chunk(x,z))
         newsections = []
         for section in chunk_data['Sections']:
@@ -1603,20 +2007,44 @@ class RotatedRegionSet(RegionSetWrapper):
         chunk_data['Biomes'] = numpy.swapaxes(biomes, 0, 1)
         return chunk_data
 
+    def get_chunk_blockids(self, x, z):
+        x,z = self.unrotate(x,z)
+        return super(RotatedRegionSet, self).get_chunk_blockids(x, z)
+
+    def get_chunk_entities(self, x, z):
+        # the entities' positions are in world coordinates either way
+        x,z = self.unrotate(x,z)
+        return super(RotatedRegionSet, self).get_chunk_entities(x, z)
+
     def get_chunk_mtime(self, x, z):
         x,z = self.unrotate(x,z)
         return super(RotatedRegionSet, self).get_chunk_mtime(x, z)
 
-    def iterate_chunks(self):
-        for x,z,mtime in super(RotatedRegionSet, self).iterate_chunks():
+    def iterate_chunks(self, bounds=None):
+        for x,z,mtime in super(RotatedRegionSet, self).iterate_chunks(self._unrotate_bounds(bounds)):
             x,z = self.rotate(x,z)
             yield x,z,mtime
 
-    def iterate_newer_chunks(self, filemtime):
-        for x,z,mtime in super(RotatedRegionSet, self).iterate_newer_chunks(filemtime):
+    def iterate_newer_chunks(self, filemtime, bounds=None):
+        for x,z,mtime in super(RotatedRegionSet, self).iterate_newer_chunks(
+                filemtime, self._unrotate_bounds(bounds)):
             x,z = self.rotate(x,z)
             yield x,z,mtime
 
+    def _unrotate_bounds(self, bounds):
+        """Takes bounding boxes in rotated coordinates and returns the same
+        boxes in un-rotated coordinates
+
+        """
+        if bounds is None:
+            return None
+        newbounds = []
+        for xmin, zmin, xmax, zmax in bounds:
+            x1, z1 = self.unrotate(xmin, zmin)
+            x2, z2 = self.unrotate(xmax, zmax)
+            newbounds.append((min(x1, x2), min(z1, z2), max(x1, x2), max(z1, z2)))
+        return newbounds
+
 class CroppedRegionSet(RegionSetWrapper):
     def __init__(self, rsetobj, xmin, zmin, xmax, zmax):
         super(CroppedRegionSet, self).__init__(rsetobj)
@@ -1634,19 +2062,43 @@ class CroppedRegionSet(RegionSetWrapper):
         else:
             raise ChunkDoesntExist("This chunk is out of the requested bounds")
 
-    def iterate_chunks(self):
-        return ((x,z,mtime) for (x,z,mtime) in super(CroppedRegionSet,self).iterate_chunks()
-                if
-                    self.xmin <= x <= self.xmax and
-                    self.zmin <= z <= self.zmax
-                )
+    def get_chunk_blockids(self,x,z):
+        if (
+                self.xmin <= x <= self.xmax and
+                self.zmin <= z <= self.zmax
+                ):
+            return super(CroppedRegionSet, self).get_chunk_blockids(x,z)
+        else:
+            return set()
+
+    def get_chunk_entities(self,x,z):
+        if (
+                self.xmin <= x <= self.xmax and
+                self.zmin <= z <= self.zmax
+                ):
+            return super(CroppedRegionSet, self).get_chunk_entities(x,z)
+        else:
+            raise ChunkDoesntExist("This chunk is out of the requested bounds")
 
-    def iterate_newer_chunks(self, filemtime):
-        return ((x,z,mtime) for (x,z,mtime) in super(CroppedRegionSet,self).iterate_newer_chunks(filemtime)
-                if
-                    self.xmin <= x <= self.xmax and
-                    self.zmin <= z <= self.zmax
-                )
+    # Let the regionset skip the regions outside of the crop, rather than
+    # filtering out their chunks here after they've all been read
+    def iterate_chunks(self, bounds=None):
+        return super(CroppedRegionSet,self).iterate_chunks(self._crop_bounds(bounds))
+
+    def iterate_newer_chunks(self, filemtime, bounds=None):
+        return super(CroppedRegionSet,self).iterate_newer_chunks(filemtime, self._crop_bounds(bounds))
+
+    def _crop_bounds(self, bounds):
+        """Returns the given bounding boxes cut down to this crop"""
+        if bounds is None:
+            return [(self.xmin, self.zmin, self.xmax, self.zmax)]
+        newbounds = []
+        for xmin, zmin, xmax, zmax in bounds:
+            xmin, zmin = max(xmin, self.xmin), max(zmin, self.zmin)
+            xmax, zmax = min(xmax, self.xmax), min(zmax, self.zmax)
+            if xmin <= xmax and zmin <= zmax:
+                newbounds.append((xmin, zmin, xmax, zmax))
+        return newbounds
 
     def get_chunk_mtime(self,x,z):
         if (
@@ -1694,6 +2146,7 @@ class CachedRegionSet(RegionSetWrapper):
         for i, cache in enumerate(self.caches):
             try:
                 retval = cache[key]
+                metrics.count("chunkcache.hits")
                 # This did have it, no need to re-add it to this cache, just
                 # the ones before it
                 i -= 1
@@ -1701,6 +2154,7 @@ class CachedRegionSet(RegionSetWrapper):
             except KeyError:
                 pass
         else:
+            metrics.count("chunkcache.misses")
             retval = super(CachedRegionSet, self).get_chunk(x,z)
 
         # Now add retval to all the caches that didn't have it, all the caches
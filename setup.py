@@ -183,7 +183,13 @@ c_overviewer_includes = ['overviewer.h', 'rendermodes.h']
 c_overviewer_files = ['overviewer_core/src/' + s for s in c_overviewer_files]
 c_overviewer_includes = ['overviewer_core/src/' + s for s in c_overviewer_includes]
 
-setup_kwargs['ext_modules'].append(Extension('overviewer_core.c_overviewer', c_overviewer_files, include_dirs=['.', numpy_include] + pil_include, depends=c_overviewer_includes, extra_link_args=[]))
+# count the calls to each render primitive and the cycles they take, for
+# contrib/benchmark.py (this slows the render down a little)
+define_macros = []
+if os.environ.get('OVERVIEWER_RENDER_PROFILE'):
+    define_macros.append(('RENDER_PROFILE', '1'))
+
+setup_kwargs['ext_modules'].append(Extension('overviewer_core.c_overviewer', c_overviewer_files, include_dirs=['.', numpy_include] + pil_include, depends=c_overviewer_includes, define_macros=define_macros, extra_link_args=[]))
 
 
 # tell build_ext to build the extension in-place
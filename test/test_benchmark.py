@@ -0,0 +1,114 @@
+import unittest
+
+import argparse
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy
+from PIL import Image
+
+import contrib.benchmark as benchmark
+from overviewer_core import c_overviewer, nbt, rendermodes, world
+
+
+def make_options(**kwargs):
+    options = argparse.Namespace(chunks=2, sections=2, density=0.5, palette=20, corruption=0.0,
+                                 seed=1, texturepath=None, repeat=1, stages=benchmark.STAGES,
+                                 rendermodes=["normal"], formats=["png"], processes=[1])
+    for k, v in kwargs.items():
+        setattr(options, k, v)
+    return options
+
+
+class GenerateWorldTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.worlddir = os.path.join(self.tmpdir, "world")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_blockstates(self):
+        rset = world.RegionSet(self.tmpdir, "region", filenames=[])
+        rnd = numpy.random.RandomState(0)
+        for bits in range(4, 13):
+            values = rnd.randint(0, 2 ** bits, size=4096)
+            packed = tuple(benchmark.pack_blockstates(values, bits).tolist())
+            self.assertEqual(len(packed), bits * 64)
+            self.assertEqual(rset._packed_longarray_to_shorts(packed, 4096).tolist(),
+                             values.tolist(), "%d bits per block" % bits)
+
+    def test_generate(self):
+        info = benchmark.generate_world(self.worlddir, make_options())
+        self.assertEqual((info["chunks"], info["corrupt"]), (4, 0))
+
+        rset = world.World(self.worlddir).get_regionset(None)
+        self.assertEqual(sorted((x, z) for x, z, _ in rset.iterate_chunks()),
+                         [(0, 0), (0, 1), (1, 0), (1, 1)])
+        blockids = set(rset._get_block({"Name": name})[0] for name in info["palette"])
+        chunk = rset.get_chunk(1, 1)
+        self.assertEqual([s["Y"] for s in chunk["Sections"]], [0, 1])
+        blocks = chunk["Sections"][0]["Blocks"]
+        # half the height is filled, and the top is air
+        self.assertEqual(set(numpy.unique(blocks[:8]).tolist()) - blockids, set())
+        self.assertEqual(numpy.count_nonzero(chunk["Sections"][1]["Blocks"][8:]), 0)
+        self.assertEqual(chunk["Sections"][1]["SkyLight"][15, 0, 0], 15)
+
+    @mock.patch("time.sleep")
+    def test_corruption(self, sleep):
+        info = benchmark.generate_world(self.worlddir, make_options(corruption=1.0))
+        self.assertEqual(info["corrupt"], 4)
+        rset = world.World(self.worlddir).get_regionset(None)
+        self.assertEqual(len(list(rset.iterate_chunks())), 4)
+        self.assertRaises(nbt.CorruptionError, rset.get_chunk, 0, 0)
+
+
+class PrimitivesTest(unittest.TestCase):
+    def test_repeat(self):
+        tex = benchmark.SyntheticTextures()
+        tex.generate()
+        tile = Image.new("RGBA", (384, 384), (255, 0, 0, 255))
+        for name in benchmark.PRIMITIVES:
+            pixels = benchmark.bench_primitive(name, tex, tile)()
+            self.assertTrue(pixels > 0, name)
+
+        dest = Image.new("RGBA", (24, 24))
+        self.assertRaises(ValueError, c_overviewer.repeat_primitive, "nothing", 1, dest, dest)
+        # a triangle across the image, with full brightness in one corner
+        dest = Image.new("RGBA", (24, 24), (100, 100, 100, 255))
+        c_overviewer.repeat_primitive("draw_triangle", 1, dest, (0, 0, 23, 0, 0, 23))
+        self.assertEqual(dest.getpixel((0, 0)), (100, 78, 59, 255))
+        self.assertEqual(dest.getpixel((23, 23)), (100, 100, 100, 255))
+
+    def test_profile(self):
+        rendermode = c_overviewer.create_rendermode(rendermodes.normal, None, None)
+        profile = benchmark.get_profile(rendermode, 0)
+        if profile is not None:
+            self.assertEqual([p["primitive"] for p in profile], ["base", "edge-lines"])
+        self.assertRaises(TypeError, c_overviewer.rendermode_profile, rendermodes.normal)
+
+
+class RunBenchmarksTest(unittest.TestCase):
+    def test_run(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        options = make_options(stages=["get_chunk", "render_loop", "primitives", "composite",
+                                       "encode"])
+        info = benchmark.generate_world(os.path.join(tmpdir, "world"), options)
+
+        results = benchmark.run_benchmarks(options, info, log=lambda msg: None)
+        self.assertEqual(sorted(results),
+                         ["composite", "encode/png", "get_chunk", "primitive/alpha_over",
+                          "primitive/draw_triangle", "primitive/resize_half",
+                          "primitive/tint_with_mask", "render_loop/normal"])
+        self.assertEqual(results["get_chunk"]["items"], 4)
+        render = results["render_loop/normal"]
+        self.assertEqual(len(render["times"]), 1)
+        self.assertTrue(render["blocks"] > 0)
+        self.assertEqual(render["per_block"], render["best"] / render["blocks"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,356 @@
+import unittest
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib.error
+from io import BytesIO
+from unittest import mock
+
+import contrib.benchmark as benchmark
+from overviewer_core import world
+from overviewer_core.aux_files import genPOI
+
+from .test_nbt import encode_tag
+
+
+def sign_filter(poi):
+    if poi['id'] == 'minecraft:sign':
+        return poi['Text1']
+
+
+def chest_filter(poi):
+    if poi['id'] == 'minecraft:chest':
+        return "Chest"
+
+
+class FakeRegionSet(object):
+    regiondir = "/fake/region"
+
+    def __init__(self):
+        self.chunks = {}
+        self.read = []
+
+    def add_sign(self, x, z, mtime, text):
+        self.chunks[(x, z)] = (mtime, [{'id': 'minecraft:sign', 'x': x * 16, 'y': 64, 'z': z * 16,
+                                        'Text1': text, 'Text2': '', 'Text3': '', 'Text4': ''}])
+
+    def iterate_chunks(self, bounds=None):
+        for (x, z), (mtime, pois) in self.chunks.items():
+            if bounds is None or world.in_bounds(x, z, bounds):
+                yield x, z, mtime
+
+    def get_chunk_entities(self, x, z):
+        self.read.append((x, z))
+        return {'TileEntities': self.chunks[(x, z)][1], 'Entities': []}
+
+
+class MarkerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.outputdir = tempfile.mkdtemp()
+        self.rset = FakeRegionSet()
+        for i in range(5):
+            self.rset.add_sign(i, -i, 1000 + i, "sign %d" % i)
+        self.rset.chunks[(9, 9)] = (1009, [])
+
+    def tearDown(self):
+        shutil.rmtree(self.outputdir)
+
+    def run_genpoi(self, filter_function=sign_filter, ordered=False, load=True):
+        """Runs handleEntities() with a cache saved by the previous run, and
+        returns the texts of the markers found"""
+        cache = genPOI.MarkerCache(self.outputdir)
+        if load:
+            cache.load()
+        markers = {'signs': dict(raw=[])}
+        self.rset.read = []
+        genPOI.handleEntities(
+            genPOI.groupEntityFilters([('signs', 'Signs', filter_function, self.rset, None, None)], {}),
+            {'processes': 1}, None, markers, cache)
+        cache.save()
+        texts = [m['text'] for m in markers['signs']['raw']]
+        return texts if ordered else sorted(texts)
+
+    def test_cache(self):
+        expected = ["sign %d" % i for i in range(5)]
+        self.assertEqual(self.run_genpoi(), expected)
+        self.assertEqual(len(self.rset.read), 6)
+
+        self.assertEqual(self.run_genpoi(), expected)
+        self.assertEqual(self.rset.read, [])
+
+        # changed chunks are read again
+        self.rset.add_sign(2, -2, 2000, "changed")
+        del self.rset.chunks[(4, -4)]
+        self.assertEqual(self.run_genpoi(), ["changed", "sign 0", "sign 1", "sign 3"])
+        self.assertEqual(self.rset.read, [(2, -2)])
+        self.assertEqual(self.run_genpoi(), ["changed", "sign 0", "sign 1", "sign 3"])
+        self.assertEqual(self.rset.read, [])
+
+    def test_order(self):
+        # the markers come out in the same order whichever chunks are cached
+        self.run_genpoi()
+        self.rset.add_sign(2, -2, 2000, "changed")
+        self.rset.add_sign(-40, 0, 1000, "other region")
+        cached = self.run_genpoi(ordered=True)
+        self.assertEqual(len(self.rset.read), 2)
+        self.assertEqual(cached, self.run_genpoi(ordered=True, load=False))
+        self.assertEqual(len(self.rset.read), 7)
+
+    def test_filter_changed(self):
+        self.run_genpoi()
+        self.assertEqual(self.run_genpoi(chest_filter), [])
+        self.assertEqual(len(self.rset.read), 6)
+
+    def test_corrupt_cache(self):
+        with open(os.path.join(self.outputdir, "poicache.dat"), "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(len(self.run_genpoi()), 5)
+        self.assertEqual(len(self.rset.read), 6)
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        worlddir = os.path.join(self.tmpdir, "world")
+        self.outputdir = os.path.join(self.tmpdir, "output")
+        os.mkdir(self.outputdir)
+        benchmark.generate_world(worlddir, argparse.Namespace(
+            chunks=2, sections=1, density=0.5, palette=5, corruption=0.0, seed=1))
+        self.config = os.path.join(self.tmpdir, "config.py")
+        with open(self.config, "w") as f:
+            f.write("def signs(poi):\n"
+                    "    return poi['id'] == 'minecraft:sign'\n"
+                    "worlds = {'world': %r}\n"
+                    "outputdir = %r\n"
+                    "processes = 1\n"
+                    "renders = {'render': {'world': 'world', 'title': 'Render',\n"
+                    "                      'markers': [dict(name='Signs', filterFunction=signs)]}}\n"
+                    % (worlddir, self.outputdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_genpoi(self, hashseed):
+        """Runs genPOI in a process with the given string hash seed, and
+        returns its log and the markers.js it wrote"""
+        overviewer = os.path.join(os.path.dirname(__file__), "..", "overviewer.py")
+        env = dict(os.environ, PYTHONHASHSEED=str(hashseed))
+        output = subprocess.run([sys.executable, overviewer, "--genpoi", "--skip-players",
+                                 "-c", self.config], env=env, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+        with open(os.path.join(self.outputdir, "markers.js")) as f:
+            return output.decode("utf-8"), f.read()
+
+    def test_cache(self):
+        # the cache is still good in a process that hashes strings differently
+        log, markers = self.run_genpoi(1)
+        self.assertIn("0 chunks are unchanged since the last run, 4 to scan", log)
+        log, markers2 = self.run_genpoi(2)
+        self.assertIn("4 chunks are unchanged since the last run, 0 to scan", log)
+        self.assertEqual(markers2, markers)
+
+    @mock.patch("time.sleep")
+    def test_quarantine(self, sleep):
+        worlddir = os.path.join(self.tmpdir, "world")
+        shutil.rmtree(worlddir)
+        benchmark.generate_world(worlddir, argparse.Namespace(
+            chunks=2, sections=1, density=0.5, palette=5, corruption=1.0, seed=1))
+        corruptchunks = os.path.join(self.outputdir, ".corruptchunks")
+        argv = ["genPOI.py", "--skip-players", "-c", self.config]
+        with mock.patch.object(sys, "argv", argv):
+            genPOI.main()
+        self.assertTrue(os.path.exists(corruptchunks))
+
+        # turned off, it's neither used nor kept
+        with open(self.config, "a") as f:
+            f.write("chunkquarantine = False\n")
+        with mock.patch.object(sys, "argv", argv + ["--ignore-cache"]):
+            genPOI.main()
+        self.assertFalse(os.path.exists(corruptchunks))
+
+
+class GroupTest(unittest.TestCase):
+    def setUp(self):
+        self.rset = FakeRegionSet()
+        for i in range(-5, 5):
+            self.rset.add_sign(i, i, 1000, "sign %d" % i)
+        self.rset.chunks[(0, 0)][1].append({'id': 'minecraft:chest', 'x': 3, 'y': 64, 'z': 3})
+
+    def run_genpoi(self, filters, filter_ids={}):
+        markers = dict((f[0], dict(raw=[])) for f in filters)
+        genPOI.handleEntities(genPOI.groupEntityFilters(filters, filter_ids),
+                              {'processes': 1}, None, markers)
+        return dict((name, sorted(m['text'] for m in group['raw']))
+                    for name, group in markers.items())
+
+    def test_crops(self):
+        # crops are given in blocks, and cover whole chunks
+        crop1 = world.CroppedRegionSet(self.rset, -32, -32, -1, -1)
+        crop2 = world.CroppedRegionSet(self.rset, 48, 48, 70, 70)
+        markers = self.run_genpoi([('cropped', 'C', sign_filter, crop1, None, None),
+                                   ('cropped', 'C', sign_filter, crop2, None, None),
+                                   ('other', 'O', sign_filter, crop2, None, None)])
+        self.assertEqual(markers, {'cropped': ['sign -1', 'sign -2', 'sign 3', 'sign 4'],
+                                   'other': ['sign 3', 'sign 4']})
+        # scanned once, and only where the crops are
+        self.assertEqual(sorted(self.rset.read), [(-2, -2), (-1, -1), (3, 3), (4, 4)])
+
+        # in the same order whichever way the filters come
+        groups = genPOI.groupEntityFilters([('cropped', 'C', sign_filter, crop2, None, None),
+                                            ('cropped', 'C', sign_filter, crop1, None, None)], {})
+        self.assertEqual(groups[0][1][0][3], [(-2, -2, -1, -1), (3, 3, 4, 4)])
+        cache = genPOI.MarkerCache(tempfile.gettempdir())
+        self.assertIs(cache.get_chunks(self.rset, [('c', sign_filter, None, [(1, 1, 2, 2),
+                                                                            (0, 0, 1, 1)])])[1],
+                      cache.get_chunks(self.rset, [('c', sign_filter, None, [(0, 0, 1, 1),
+                                                                            (1, 1, 2, 2)])])[1])
+
+        self.rset.read = []
+        markers = self.run_genpoi([('cropped', 'C', sign_filter, crop1, None, None),
+                                   ('all', 'A', sign_filter, self.rset, None, None)])
+        self.assertEqual(len(markers['cropped']), 2)
+        self.assertEqual(len(markers['all']), 10)
+        self.assertEqual(len(self.rset.read), 10)
+
+    def test_ids(self):
+        seen = []
+
+        def counting_filter(poi):
+            seen.append(poi['id'])
+            return chest_filter(poi)
+        markers = self.run_genpoi([('chests', 'C', counting_filter, self.rset, None, None),
+                                   ('signs', 'S', sign_filter, self.rset, None, None)],
+                                  {'chests': ['minecraft:chest']})
+        self.assertEqual(markers, {'chests': ['Chest'],
+                                   'signs': sorted("sign %d" % i for i in range(-5, 5))})
+        self.assertEqual(seen, ['minecraft:chest'])
+
+
+class WriteMarkersTest(unittest.TestCase):
+    def setUp(self):
+        self.outputdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputdir)
+
+    def read_js(self, path, prefix, suffix=";\n"):
+        with open(os.path.join(self.outputdir, path)) as f:
+            data = f.read()
+        self.assertTrue(data.startswith(prefix) and data.endswith(suffix))
+        return json.loads(data[len(prefix):-len(suffix)])
+
+    def test_tiles(self):
+        markers = {
+            'signs': dict(created=False, name="Signs", raw=[
+                dict(x=5, y=64, z=5, text="a"), dict(x=511.5, y=64, z=-0.5, text="b"),
+                dict(x=-513, y=64, z=1024, text="c")]),
+            'chests': dict(created=False, name="Chests", raw=[dict(x=1, y=64, z=2, text="d")]),
+        }
+        genPOI.writeMarkers(self.outputdir, markers)
+
+        index = self.read_js("markersDB.js", "var markersDB=")
+        self.assertEqual(index['signs'], dict(created=False, name="Signs", raw=[],
+                                              tiles=["-2.2", "0.-1", "0.0"]))
+        self.assertEqual(index['chests']['tiles'], ["0.0"])
+        tile = self.read_js(os.path.join("markers", "r.0.0.js"),
+                            'overviewer.util.loadMarkerTile("0.0",', ");\n")
+        self.assertEqual(tile, {'signs': [markers['signs']['raw'][0]],
+                                'chests': markers['chests']['raw']})
+
+        # tiles without markers any more are removed
+        markers['signs']['raw'].pop()
+        genPOI.writeMarkers(self.outputdir, markers)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.outputdir, "markers"))),
+                         ["r.0.-1.js", "r.0.0.js"])
+
+
+class StubNameSource(object):
+    def __init__(self, names):
+        self.names = names
+        self.lookups = []
+
+    def lookup(self, uuids):
+        self.lookups.append(sorted(uuids))
+        return dict((uuid, self.names[uuid]) for uuid in uuids if uuid in self.names)
+
+
+class MojangNameSourceTest(unittest.TestCase):
+    def test_lookup(self):
+        def urlopen(url, timeout):
+            uuid = url[-1]
+            requested.append(uuid)
+            if uuid in "45":
+                raise urllib.error.HTTPError(url, 429 if uuid == "4" else 404, "", {}, None)
+            if uuid == "6":
+                raise urllib.error.URLError("no network")
+            # an unknown UUID gets an empty response
+            return BytesIO(b'{"name": "player%s"}' % uuid.encode() if uuid in "02" else b"")
+
+        for uuids, expected, expected_requests in [
+                ("0123", {"0": "player0", "2": "player2"}, "0123"),
+                ("0532", {"0": "player0", "2": "player2"}, "0532"),
+                ("0402", {"0": "player0"}, "04"),
+                ("0602", {"0": "player0"}, "06")]:
+            requested = []
+            with mock.patch("urllib.request.urlopen", urlopen):
+                source = genPOI.MojangNameSource(threads=1)
+                self.assertEqual(source.lookup(uuids), expected)
+            self.assertEqual("".join(requested), expected_requests)
+
+
+class PlayersTest(unittest.TestCase):
+    def setUp(self):
+        self.worlddir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.worlddir, "playerdata"))
+        self.uuids = ["%032x" % i for i in range(150)]
+        for i, uuid in enumerate(self.uuids):
+            with open(os.path.join(self.worlddir, "playerdata", uuid + ".dat"), "wb") as f:
+                f.write(gzip.compress(encode_tag("", {"Pos": [float(i), 64.0, -float(i)]})))
+        with open(os.path.join(self.worlddir, "playerdata", "broken.dat"), "wb") as f:
+            f.write(b"broken")
+        self.old_cache = genPOI.PlayerDict.uuid_cache
+        genPOI.PlayerDict.uuid_cache = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.worlddir)
+        genPOI.PlayerDict.uuid_cache = self.old_cache
+
+    def run_genpoi(self, processes, sources):
+        def player_filter(poi):
+            if poi['id'] == 'Player':
+                return "%s at %d" % (poi['EntityId'], poi['x'])
+        markers = {'players': dict(raw=[])}
+        rset = FakeRegionSet()
+        rset.get_type = lambda: None
+        genPOI.handlePlayers(self.worlddir, [('players', 'P', player_filter, rset, None, None)],
+                             markers, processes, sources)
+        return sorted(m['text'] for m in markers['players']['raw'])
+
+    def test_players(self):
+        usercache = os.path.join(self.worlddir, "usercache.json")
+        with open(usercache, "w") as f:
+            json.dump([{"name": "player%d" % i, "uuid": "-".join([uuid[:8], uuid[8:]])}
+                       for i, uuid in enumerate(self.uuids[:100])], f)
+        online = StubNameSource({self.uuids[100]: "online"})
+        expected = sorted(["player%d at %d" % (i, i) for i in range(100)] + ["online at 100"] +
+                          ["None at %d" % i for i in range(101, 150)])
+
+        self.assertEqual(self.run_genpoi(1, [genPOI.UserCacheNameSource(usercache), online]),
+                         expected)
+        # all of the names are looked up at once
+        self.assertEqual(online.lookups, [self.uuids[100:]])
+
+        # and come from the cache the next time
+        online = StubNameSource({})
+        self.assertEqual(self.run_genpoi(4, [online]), expected)
+        self.assertEqual(online.lookups, [self.uuids[101:]])
+
+
+if __name__ == "__main__":
+    unittest.main()
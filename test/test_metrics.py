@@ -0,0 +1,269 @@
+import unittest
+
+import json
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from overviewer_core import dispatcher, metrics, nbt, observer
+
+from .test_nbt import CHUNK, encode_nbt
+from .test_world import write_region
+
+
+class StageStatsTest(unittest.TestCase):
+    def test_histogram(self):
+        s = metrics.StageStats()
+        for wall in (0.0000005, 0.003, 0.003, 0.003, 0.5):
+            s.add(wall, wall / 2)
+        self.assertEqual(s.count, 5)
+        self.assertAlmostEqual(s.cpu, s.wall / 2)
+        # 3ms is in the bucket up to 2**12us
+        self.assertEqual(s.buckets, {0: 1, 12: 3, 19: 1})
+        self.assertEqual(s.percentile(50), 0.004096)
+        self.assertEqual(s.percentile(99), 0.524288)
+
+        other = pickle.loads(pickle.dumps(s))
+        other.merge(s)
+        self.assertEqual(other.count, 10)
+        self.assertEqual(other.to_dict()["histogram"], [[0.000001, 2], [0.004096, 6], [0.524288, 2]])
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.recorder = metrics.Recorder()
+        self.recorder.enabled = True
+        self.recorder.label = "render"
+
+    def test_disabled(self):
+        self.recorder.enabled = False
+        with self.recorder.stage("encode"):
+            pass
+        self.recorder.count("bytes.written", 10)
+        self.assertEqual(self.recorder.stats, {})
+        self.assertEqual(self.recorder.counters, {})
+
+    def test_nested(self):
+        # the clocks advance by one second of wall time and half a second of
+        # CPU time between every two calls
+        ticks = iter(range(10))
+        with mock.patch("time.perf_counter", lambda: next(ticks) // 2), \
+                mock.patch("time.process_time", lambda: next(ticks) // 2 / 2.0):
+            with self.recorder.stage("write"):
+                with self.recorder.stage("encode", "other"):
+                    pass
+        write = self.recorder.stats["render", "write"]
+        encode = self.recorder.stats["other", "encode"]
+        self.assertEqual((encode.wall, encode.cpu), (1, 0.5))
+        # two seconds besides the inner stage
+        self.assertEqual((write.wall, write.cpu), (2, 1.0))
+        self.assertEqual(self.recorder._stack, [])
+
+    def test_flush(self):
+        collector = metrics.MetricsCollector()
+        report = metrics.Signal("MetricsTest", "report")
+        report.register(collector.merge)
+        with mock.patch.object(metrics, "report", report):
+            for i in range(2):
+                with self.recorder.stage("render"):
+                    pass
+                self.recorder.count("chunkcache.hits", 3)
+                self.recorder.flush()
+            # nothing new to report
+            self.recorder.flush()
+
+        self.assertEqual(self.recorder.stats, {})
+        data = json.loads(json.dumps(collector.to_dict()))
+        self.assertEqual(data["counters"], {"chunkcache.hits": 6})
+        self.assertEqual(list(data["busy"]), [])
+        self.assertEqual(data["tilesets"]["render"]["render"]["count"], 2)
+
+
+class StagesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.enabled = metrics.recorder.enabled
+        metrics.recorder.enabled = True
+
+    def tearDown(self):
+        metrics.recorder.enabled = self.enabled
+        metrics.recorder.stats = {}
+        metrics.recorder.counters = {}
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_chunk(self):
+        path = os.path.join(self.tmpdir, "r.0.0.mca")
+        write_region(path, {(0, 0): (100, encode_nbt(CHUNK))})
+        metrics.set_label("world")
+        nbt.load_region(path).load_chunk(0, 0)
+        self.assertEqual(sorted(metrics.recorder.stats),
+                         [("world", "chunkread"), ("world", "nbtparse")])
+
+
+class FakeWorker(object):
+    """Two phases: four items, the last depending on the others, then one"""
+    def get_num_phases(self):
+        return 2
+
+    def get_phase_length(self, phase):
+        return 4 if phase == 0 else 1
+
+    def iterate_work_items(self, phase):
+        if phase == 0:
+            for i in range(3):
+                yield i, []
+            yield 3, [0, 1, 2]
+        else:
+            yield 4, []
+
+    def do_work(self, workitem):
+        with metrics.stage("render", "fake"):
+            pass
+
+
+class NullObserver(object):
+    def start(self, total):
+        pass
+
+    def add(self, amount):
+        pass
+
+    def finish(self):
+        pass
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "trace.json")
+        patches = [mock.patch.object(metrics, "recorder", metrics.Recorder()),
+                   mock.patch.object(metrics, "trace", metrics.Signal("MetricsTest", "trace"))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_render(self):
+        metrics.enable_tracing()
+        writer = metrics.TraceWriter(self.path)
+        writer.register()
+        dispatcher.Dispatcher().render_all([FakeWorker()], NullObserver())
+        writer.close()
+
+        with open(self.path) as f:
+            events = json.load(f)
+        self.assertEqual(events[0]["ph"], "M")
+        names = [e["name"] for e in events[1:]]
+        self.assertEqual(names.count("do_work"), 5)
+        self.assertEqual(names.count("render"), 5)
+        self.assertEqual(names.count("dispatch"), 5)
+        self.assertEqual(metrics.recorder.events, [])
+
+        # events that start inside another one end inside it too
+        do_work = [e for e in events if e["name"] == "do_work"]
+        render = [e for e in events if e["name"] == "render"]
+        for outer, inner in zip(do_work, render):
+            self.assertTrue(outer["ts"] <= inner["ts"])
+            self.assertTrue(inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"])
+        self.assertEqual(do_work[-1]["args"]["workitem"], "4")
+
+    def test_fork(self):
+        metrics.enable_tracing()
+        with metrics.span("dispatch", "dispatcher"):
+            pass
+        with mock.patch("os.getpid", return_value=metrics.recorder.pid + 1):
+            metrics.enable_tracing()
+        self.assertEqual(len(metrics.recorder.events), 1)
+        self.assertEqual(metrics.recorder.events[0]["pid"], metrics.recorder.pid)
+
+
+class MetricsObserverTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(metrics, "report", metrics.Signal("MetricsTest", "report"))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def report(self, obs):
+        write = metrics.StageStats()
+        write.add(0.003, 0.001)
+        write.add(5.0, 1.0)
+        metrics.report(100, {("my render", "write"): write},
+                       {"chunkcache.hits": 3, "chunkcache.misses": 1, "bytes.written": 2048,
+                        "worker.busy_seconds": 0.5},
+                       {"jobs.pending": 7})
+
+    def check_metrics(self, text):
+        lines = text.splitlines()
+        self.assertIn("overviewer_tiles_done_total 12.0", lines)
+        self.assertIn('overviewer_tiles_written_total{tileset="my render"} 2.0', lines)
+        self.assertIn("overviewer_jobs_pending 7.0", lines)
+        self.assertIn("overviewer_chunk_cache_hit_ratio 0.75", lines)
+        self.assertIn("overviewer_written_bytes_total 2048.0", lines)
+        self.assertIn('overviewer_worker_busy_seconds_total{pid="100"} 0.5', lines)
+        self.assertIn('overviewer_stage_seconds_bucket{tileset="my render",stage="write",'
+                      'le="0.004096"} 1', lines)
+        self.assertIn('overviewer_stage_seconds_bucket{tileset="my render",stage="write",'
+                      'le="2.097152"} 1', lines)
+        self.assertIn('overviewer_stage_seconds_bucket{tileset="my render",stage="write",'
+                      'le="+Inf"} 2', lines)
+        self.assertIn('overviewer_stage_seconds_count{tileset="my render",stage="write"} 2',
+                      lines)
+
+    def run_phases(self, obs):
+        obs.start(10)
+        obs.add(10)
+        obs.finish()
+        obs.start(5)
+        obs.add(2)
+        self.report(obs)
+
+    def test_http(self):
+        obs = observer.MetricsObserver(port=0)
+        self.assertTrue(observer.MultiplexingObserver(observer.Observer(), obs).wants_metrics())
+        self.run_phases(obs)
+        try:
+            url = "http://127.0.0.1:%d/metrics" % obs.server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+                self.check_metrics(response.read().decode("utf-8"))
+        finally:
+            obs.close()
+        self.assertIsNone(obs.server)
+        self.assertRaises(urllib.error.URLError, urllib.request.urlopen, url, timeout=5)
+        # closing it again does nothing
+        obs.close()
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "no unix sockets")
+    def test_unix_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "metrics.sock")
+        obs = observer.MetricsObserver(socket=path)
+        self.run_phases(obs)
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(path)
+            s.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            data = b""
+            while True:
+                chunk = s.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            s.close()
+            self.assertTrue(data.startswith(b"HTTP/1.0 200"))
+            self.check_metrics(data.split(b"\r\n\r\n", 1)[1].decode("utf-8"))
+        finally:
+            obs.close()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
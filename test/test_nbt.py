@@ -0,0 +1,93 @@
+import unittest
+
+import struct
+import zlib
+from io import BytesIO
+
+from overviewer_core import nbt
+
+
+def encode_payload(value):
+    """Returns (tagtype, payload bytes) for a python value, the reverse of
+    what NBTFileReader reads. Ints become TAG_Int, tuples TAG_Long_Array."""
+    if isinstance(value, dict):
+        data = b"".join(encode_tag(name, v) for name, v in value.items())
+        return 10, data + b"\0"
+    elif isinstance(value, list):
+        items = [encode_payload(v) for v in value]
+        tagtype = items[0][0] if items else 0
+        return 9, struct.pack(">bI", tagtype, len(items)) + b"".join(data for _, data in items)
+    elif isinstance(value, str):
+        value = value.encode("utf-8")
+        return 8, struct.pack(">H", len(value)) + value
+    elif isinstance(value, bytes):
+        return 7, struct.pack(">I", len(value)) + value
+    elif isinstance(value, tuple):
+        return 12, struct.pack(">I%iq" % len(value), len(value), *value)
+    elif isinstance(value, float):
+        return 6, struct.pack(">d", value)
+    else:
+        return 3, struct.pack(">i", value)
+
+
+def encode_tag(name, value):
+    tagtype, data = encode_payload(value)
+    name = name.encode("utf-8")
+    return struct.pack(">bH", tagtype, len(name)) + name + data
+
+
+def encode_nbt(value, name=""):
+    """Returns the given dictionary as a zlib compressed NBT file"""
+    return zlib.compress(encode_tag(name, value))
+
+
+CHUNK = {
+    "DataVersion": 1976,
+    "Level": {
+        "xPos": 3,
+        "Sections": [{"Y": 0, "BlockStates": (1, 2, 3), "SkyLight": b"\xff" * 2048,
+                      "Palette": [{"Name": "minecraft:stone"}, {"Name": "minecraft:air"}]}],
+        "Heightmaps": {"WORLD_SURFACE": (4, 5)},
+        "Entities": [{"id": "minecraft:cow", "Pos": [1.5, 64.0, 2.5]}],
+        "TileEntities": [{"id": "minecraft:sign", "Text1": "hello"}],
+        "PostProcessing": [[], [1]],
+    },
+}
+
+
+class NBTTest(unittest.TestCase):
+    def read(self, select=None):
+        reader = nbt.NBTFileReader(BytesIO(encode_nbt(CHUNK)), is_gzip=False)
+        return reader.read_all(select)
+
+    def test_read_all(self):
+        name, data = self.read()
+        self.assertEqual(data["Level"]["Sections"][0]["Palette"][1]["Name"], "minecraft:air")
+        self.assertEqual(data["Level"]["PostProcessing"], [[], [1]])
+
+    def test_select(self):
+        name, data = self.read({"Level": {"Entities": True, "TileEntities": True, "Missing": True}})
+        self.assertEqual(data, {"Level": {"Entities": CHUNK["Level"]["Entities"],
+                                          "TileEntities": CHUNK["Level"]["TileEntities"]}})
+
+        name, data = self.read({"DataVersion": True, "Level": {"Heightmaps": {"WORLD_SURFACE": True}}})
+        self.assertEqual(data, {"DataVersion": 1976,
+                                "Level": {"Heightmaps": {"WORLD_SURFACE": (4, 5)}}})
+
+    def test_select_list(self):
+        # the selection applies to each compound in a list
+        name, data = self.read({"Level": {"Sections": {"Palette": True, "Missing": True},
+                                          "PostProcessing": {"Y": True}}})
+        self.assertEqual(data, {"Level": {
+            "Sections": [{"Palette": CHUNK["Level"]["Sections"][0]["Palette"]}],
+            "PostProcessing": [[], [1]]}})
+
+    def test_truncated(self):
+        data = encode_nbt(CHUNK)
+        data = zlib.compress(zlib.decompress(data)[:-40])
+        reader = nbt.NBTFileReader(BytesIO(data), is_gzip=False)
+        self.assertRaises(nbt.CorruptNBTError, reader.read_all, {"Level": {"xPos": True}})
+
+
+if __name__ == "__main__":
+    unittest.main()
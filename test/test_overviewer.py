@@ -0,0 +1,75 @@
+import unittest
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+import contrib.benchmark as benchmark
+from overviewer_core import dispatcher, observer, textures
+import overviewer
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        worlddir = os.path.join(self.tmpdir, "world")
+        benchmark.generate_world(worlddir, argparse.Namespace(
+            chunks=2, sections=1, density=0.5, palette=5, corruption=0.0, seed=1))
+        self.outputdir = os.path.join(self.tmpdir, "output")
+        self.config = os.path.join(self.tmpdir, "config.py")
+        with open(self.config, "w") as f:
+            f.write("worlds = {'world': %r}\n"
+                    "outputdir = %r\n"
+                    "processes = 1\n"
+                    "renders = {'render': {'world': 'world', 'title': 'Render'}}\n"
+                    % (worlddir, self.outputdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(textures.Textures, "generate")
+    @mock.patch.object(textures.Textures, "unshare")
+    @mock.patch.object(observer.Observer, "close")
+    @mock.patch.object(dispatcher.Dispatcher, "render_all", side_effect=KeyboardInterrupt)
+    def test_cleanup_on_failure(self, render_all, close, unshare, generate):
+        # the textures are unshared and the observer closed even when the
+        # render doesn't finish
+        argv = ["overviewer.py", "-c", self.config]
+        with mock.patch.object(sys, "argv", argv):
+            self.assertRaises(KeyboardInterrupt, overviewer.main)
+        render_all.assert_called_once()
+        unshare.assert_called_once_with()
+        close.assert_called_once_with()
+
+    @mock.patch.object(textures.Textures, "generate")
+    @mock.patch.object(dispatcher.Dispatcher, "render_all", side_effect=KeyboardInterrupt)
+    def test_trace_on_failure(self, render_all, generate):
+        # the trace of an unfinished render is still written out in full
+        trace = os.path.join(self.tmpdir, "trace.json")
+        argv = ["overviewer.py", "-c", self.config, "--trace", trace]
+        with mock.patch.object(sys, "argv", argv):
+            self.assertRaises(KeyboardInterrupt, overviewer.main)
+        with open(trace) as f:
+            self.assertIsInstance(json.load(f), list)
+
+    @mock.patch.object(textures.Textures, "generate")
+    @mock.patch.object(dispatcher.Dispatcher, "render_all", side_effect=KeyboardInterrupt)
+    def test_no_quarantine(self, render_all, generate):
+        # turning the quarantine off forgets the corrupt chunks
+        os.mkdir(self.outputdir)
+        corruptchunks = os.path.join(self.outputdir, ".corruptchunks")
+        with open(corruptchunks, "w") as f:
+            f.write('["r.0.0.mca", 0, 0, 100]\n')
+        with open(self.config, "a") as f:
+            f.write("chunkquarantine = False\n")
+        with mock.patch.object(sys, "argv", ["overviewer.py", "-c", self.config]):
+            self.assertRaises(KeyboardInterrupt, overviewer.main)
+        self.assertFalse(os.path.exists(corruptchunks))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+
+import tempfile
+
+import numpy
+from PIL import Image
+
+import contrib.benchmark as benchmark
+from overviewer_core import c_overviewer, rendermodes, world
+
+
+def make_section(y, blocks, skylight=15, blocklight=0):
+    return {"Y": y, "Blocks": blocks.astype(numpy.uint16),
+            "Data": numpy.zeros((16, 16, 16), dtype=numpy.uint8),
+            "SkyLight": numpy.broadcast_to(skylight, (16, 16, 16)).astype(numpy.uint8),
+            "BlockLight": numpy.broadcast_to(blocklight, (16, 16, 16)).astype(numpy.uint8)}
+
+
+class RenderModeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tex = benchmark.SyntheticTextures()
+        cls.tex.generate()
+        # only the slime overlay looks at the world, for its seed
+        cls.worldobj = None
+
+    def render(self, rset, x, z, rendermode, tex=None):
+        tex = tex or self.tex
+        img = Image.new("RGBA", (384, 384), tex.bgcolor)
+        for section in rset.get_chunk(x, z)["Sections"]:
+            c_overviewer.render_loop(self.worldobj, rset, x, section["Y"], z, img, 0, 0,
+                                     rendermode, tex)
+        return img
+
+    def render_multi(self, rset, x, z, rendermodes):
+        imgs = [Image.new("RGBA", (384, 384), self.tex.bgcolor) for mode in rendermodes]
+        for section in rset.get_chunk(x, z)["Sections"]:
+            c_overviewer.render_loop_multi(self.worldobj, rset, x, section["Y"], z,
+                                           [(img, 0, 0, mode, self.tex)
+                                            for img, mode in zip(imgs, rendermodes)])
+        return imgs
+
+    def assertSameRenders(self, rset, chunks, modes):
+        """Renders the chunks one after the other with one rendermode
+        object for each mode, alone and all together, and checks that
+        each comes out as it does on its own"""
+        shared = [c_overviewer.create_rendermode(mode, self.worldobj, self.tex)
+                  for mode in modes]
+        multi = [c_overviewer.create_rendermode(mode, self.worldobj, self.tex)
+                 for mode in modes]
+        for x, z in chunks:
+            together = self.render_multi(rset, x, z, multi)
+            for i, mode in enumerate(modes):
+                fresh = c_overviewer.create_rendermode(mode, self.worldobj, self.tex)
+                expected = self.render(rset, x, z, fresh).tobytes()
+                msg = "chunk %d,%d mode %d" % (x, z, i)
+                self.assertEqual(self.render(rset, x, z, shared[i]).tobytes(), expected, msg)
+                self.assertEqual(self.render(rset, x, z, mode).tobytes(), expected, msg)
+                self.assertEqual(together[i].tobytes(), expected, msg)
+
+    def test_nether(self):
+        # under the roof, the first chunk is all netherrack, which the
+        # nether mode hides, and the second has stone that it doesn't
+        rset = world.RegionSet(tempfile.gettempdir(), "region", filenames=[])
+        netherrack = rset._get_block({"Name": "minecraft:netherrack"})[0]
+        roof = numpy.zeros((16, 16, 16))
+        roof[:15] = netherrack
+        stone = numpy.zeros((16, 16, 16))
+        stone[:8] = 1
+        rset = benchmark.PreloadedRegionSet({
+            (0, 0): {"Biomes": numpy.ones((256,)), "Sections": [make_section(7, roof)]},
+            (1, 0): {"Biomes": numpy.ones((256,)), "Sections": [make_section(7, stone)]},
+        })
+        self.assertSameRenders(rset, [(0, 0), (1, 0), (0, 0)],
+                               [rendermodes.normal, rendermodes.nether])
+        # the stone is drawn
+        self.assertNotEqual(self.render(rset, 1, 0, rendermodes.nether).getbbox(), None)
+
+    def test_structure_overlays(self):
+        # stone on top of stone is red in one overlay, and stone with air
+        # above it is green in the other
+        stone = numpy.zeros((16, 16, 16))
+        stone[:8] = 1
+        pillars = numpy.zeros((16, 16, 16))
+        pillars[:, ::2, ::2] = 1
+        rset = benchmark.PreloadedRegionSet({
+            (0, 0): {"Biomes": numpy.ones((256,)),
+                     "Sections": [make_section(0, stone), make_section(1, pillars)]},
+            (1, 0): {"Biomes": numpy.ones((256,)),
+                     "Sections": [make_section(0, pillars), make_section(1, stone)]},
+        })
+        stacked = rendermodes.StructureOverlay(
+            structures=[(((0, 0, 0, 1), (0, -1, 0, 1)), (255, 0, 0, 255))])
+        capped = rendermodes.StructureOverlay(
+            structures=[(((0, 0, 0, 1), (0, 1, 0, 0)), (0, 255, 0, 255))])
+        self.assertSameRenders(rset, [(0, 0), (1, 0), (0, 0), (1, 0)],
+                               [[rendermodes.Base(), stacked], [rendermodes.Base(), capped]])
+
+    def test_atlas(self):
+        # the sprites drawn from the native atlas look the same as the ones
+        # drawn from the blockmap's images
+        rnd = numpy.random.RandomState(0)
+        # stone, grass, dirt, water, sand, logs, leaves, glass, tall grass, ice
+        palette = numpy.array([0, 1, 2, 3, 8, 9, 12, 17, 18, 20, 31, 79])
+        chunks = {}
+        for x in range(2):
+            blocks = palette[rnd.randint(0, len(palette), (16, 16, 16))]
+            blocks[:, :, 12:] = 0
+            chunks[(x, 0)] = {"Biomes": numpy.full((256,), x + 1), "Sections": [
+                make_section(0, numpy.full((16, 16, 16), 1), skylight=0,
+                             blocklight=rnd.randint(0, 16, (16, 16, 16))),
+                make_section(1, blocks, skylight=rnd.randint(0, 16, (16, 16, 16)),
+                             blocklight=rnd.randint(0, 16, (16, 16, 16)))]}
+        rset = benchmark.PreloadedRegionSet(chunks)
+
+        fallback = object.__new__(type(self.tex))
+        fallback.__dict__.update(self.tex.__dict__)
+        fallback.atlas = fallback.atlas_light = fallback.atlas_index = None
+        self.assertIsNotNone(self.tex.atlas)
+
+        for name in ["normal", "lighting", "smooth_lighting", "night", "cave"]:
+            mode = getattr(rendermodes, name)
+            for x, z in chunks:
+                expected = self.render(rset, x, z, mode, fallback)
+                self.assertNotEqual(expected.getbbox(), None)
+                self.assertEqual(self.render(rset, x, z, mode).tobytes(), expected.tobytes(),
+                                 "chunk %d,%d in %s" % (x, z, name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,360 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import numpy
+from PIL import Image
+
+from overviewer_core import textures
+from overviewer_core.textures import TextureException
+
+
+def make_sprite(color, size=(24, 24)):
+    return Image.new("RGBA", size, color)
+
+
+class AtlasTest(unittest.TestCase):
+    def setUp(self):
+        self.tex = textures.Textures()
+        self.tex.blockmap = [None] * textures.max_blockid * textures.max_data
+
+    def test_atlas_layout(self):
+        stone = self.tex.generate_texture_tuple(make_sprite((120, 120, 120, 255)))
+        glass = self.tex.generate_texture_tuple(make_sprite((200, 220, 255, 10)))
+        self.tex.blockmap[1 * textures.max_data] = stone
+        self.tex.blockmap[20 * textures.max_data] = glass
+        self.tex.build_atlas()
+
+        self.assertEqual(self.tex.atlas.shape, (2, 24, 24, 4))
+        self.assertEqual(self.tex.atlas_light.shape, (2, 24, 24))
+        self.assertEqual(self.tex.atlas_index.dtype, numpy.int32)
+        self.assertEqual(len(self.tex.atlas_index), len(self.tex.blockmap))
+
+        stone_index = self.tex.atlas_index[1 * textures.max_data]
+        glass_index = self.tex.atlas_index[20 * textures.max_data]
+        self.assertEqual(tuple(self.tex.atlas[stone_index, 0, 0]), (120, 120, 120, 255))
+        self.assertEqual(tuple(self.tex.atlas[glass_index, 0, 0]), (200, 220, 255, 10))
+        self.assertEqual(self.tex.atlas_light[stone_index, 0, 0], 255)
+        self.assertEqual(self.tex.atlas_light[glass_index, 0, 0], 100)
+        self.assertEqual(self.tex.atlas_index[2 * textures.max_data], -1)
+
+    def test_shared_images_stored_once(self):
+        img = make_sprite((1, 2, 3, 255))
+        for data in range(4):
+            self.tex.blockmap[5 * textures.max_data + data] = self.tex.generate_texture_tuple(img)
+        self.tex.build_atlas()
+
+        self.assertEqual(self.tex.atlas.shape[0], 1)
+        self.assertEqual(set(self.tex.atlas_index[5 * textures.max_data:][:4]), {0})
+
+    def test_odd_sprites_left_out(self):
+        # anything not matching the atlas layout is drawn from the PIL tuple
+        self.tex.blockmap[1 * textures.max_data] = self.tex.generate_texture_tuple(
+            make_sprite((0, 0, 0, 255), size=(32, 32)))
+        self.tex.build_atlas()
+
+        self.assertEqual(self.tex.atlas.shape[0], 0)
+        self.assertEqual(self.tex.atlas_index[1 * textures.max_data], -1)
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.tex = textures.Textures(cachedir=self.cachedir)
+        self.tex.blockmap = [None] * textures.max_blockid * textures.max_data
+        self.tex.blockmap[1 * textures.max_data] = self.tex.generate_texture_tuple(
+            make_sprite((120, 120, 120, 255)))
+        self.tex.blockmap[20 * textures.max_data + 3] = self.tex.generate_texture_tuple(
+            make_sprite((200, 220, 255, 10)))
+        self.tex.biome_grass_texture = make_sprite((0, 255, 0, 255))
+        self.tex.grasscolor = [(1, 2, 3, 255), (4, 5, 6, 255)]
+        self.tex.build_atlas()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_roundtrip(self):
+        self.tex.save_cache()
+
+        loaded = textures.Textures(cachedir=self.cachedir)
+        self.assertTrue(loaded.load_cache())
+        self.assertEqual(len(loaded.blockmap), len(self.tex.blockmap))
+        for orig, new in zip(self.tex.blockmap, loaded.blockmap):
+            if orig is None:
+                self.assertIsNone(new)
+            else:
+                self.assertEqual(orig[0].tobytes(), new[0].tobytes())
+                self.assertEqual(orig[1].tobytes(), new[1].tobytes())
+        self.assertTrue((loaded.atlas_index == self.tex.atlas_index).all())
+        self.assertEqual(loaded.biome_grass_texture.tobytes(),
+                         self.tex.biome_grass_texture.tobytes())
+        self.assertEqual(loaded.grasscolor, self.tex.grasscolor)
+        self.assertFalse(hasattr(loaded, "foliagecolor"))
+
+    def test_keyed_on_options(self):
+        self.tex.save_cache()
+
+        rotated = textures.Textures(cachedir=self.cachedir, northdirection=1)
+        self.assertFalse(rotated.load_cache())
+        colored = textures.Textures(cachedir=self.cachedir, bgcolor=(0, 0, 0, 0))
+        self.assertFalse(colored.load_cache())
+
+    def test_keyed_on_files_used(self):
+        packdir = os.path.join(self.cachedir, "pack")
+        os.makedirs(packdir)
+        dirt = os.path.join(packdir, "dirt.png")
+        with open(dirt, "wb") as f:
+            f.write(b"dirt")
+        self.tex.find_file_local_path = packdir
+        with mock.patch("os.walk", side_effect=AssertionError("walked a directory")):
+            self.tex.find_file("dirt.png").close()
+            self.tex.save_cache()
+
+        def load():
+            loaded = textures.Textures(texturepath=packdir, cachedir=self.cachedir)
+            return loaded.load_cache()
+        self.assertTrue(load())
+        # a file that's used changes
+        with open(dirt, "wb") as f:
+            f.write(b"new dirt")
+        self.assertFalse(load())
+        self.tex.file_stats.clear()
+        self.tex.find_file("dirt.png").close()
+        self.tex.save_cache()
+        self.assertTrue(load())
+        # a file that wasn't there before takes precedence over a jar
+        self.tex.find_file("water.png").close()
+        self.tex.save_cache()
+        self.assertTrue(load())
+        with open(os.path.join(packdir, "water.png"), "wb") as f:
+            f.write(b"water")
+        self.assertFalse(load())
+
+    def test_stale_caches_removed(self):
+        self.tex.save_cache()
+        rotated = textures.Textures(cachedir=self.cachedir, northdirection=1)
+        rotated.set_atlas(self.tex.atlas, self.tex.atlas_light, self.tex.atlas_index)
+        rotated.biome_grass_texture = self.tex.biome_grass_texture
+        rotated.save_cache()
+        # a newer version of the same textures replaces the first
+        newer = textures.Textures(cachedir=self.cachedir)
+        newer.set_atlas(self.tex.atlas, self.tex.atlas_light, self.tex.atlas_index)
+        newer.biome_grass_texture = self.tex.biome_grass_texture
+        newer.fingerprint = self.tex.get_fingerprint().split("-")[0] + "-newer"
+        newer.save_cache()
+        self.assertEqual(sorted(os.listdir(self.cachedir)),
+                         sorted([os.path.basename(newer.get_cache_path()),
+                                 os.path.basename(rotated.get_cache_path())]))
+
+    def test_fingerprint_survives_pickle(self):
+        fingerprint = self.tex.get_fingerprint()
+        self.tex.generated = False
+        copy = pickle.loads(pickle.dumps(self.tex))
+        self.assertEqual(copy.fingerprint, fingerprint)
+
+
+class ShareTest(unittest.TestCase):
+    def setUp(self):
+        self.tex = textures.Textures()
+        self.tex.blockmap = [None] * textures.max_blockid * textures.max_data
+        self.tex.blockmap[1 * textures.max_data] = self.tex.generate_texture_tuple(
+            make_sprite((120, 120, 120, 255)))
+        self.tex.blockmap[20 * textures.max_data + 3] = self.tex.generate_texture_tuple(
+            make_sprite((200, 220, 255, 10)))
+        self.tex.biome_grass_texture = make_sprite((0, 255, 0, 255))
+        self.tex.grasscolor = [(1, 2, 3, 255), (4, 5, 6, 255)]
+        self.tex.build_atlas()
+        self.tex.generated = True
+
+    def tearDown(self):
+        self.tex.unshare()
+
+    def test_pickled_copy_maps_shared_atlas(self):
+        self.assertTrue(self.tex.share())
+        copy = pickle.loads(pickle.dumps(self.tex))
+
+        self.assertIsNotNone(copy.shared_memory)
+        self.assertFalse(copy.atlas.flags.writeable)
+        self.assertTrue((copy.atlas == self.tex.atlas).all())
+        self.assertTrue((copy.atlas_index == self.tex.atlas_index).all())
+        stone = copy.blockmap[1 * textures.max_data]
+        self.assertEqual(stone[0].tobytes(), self.tex.blockmap[1 * textures.max_data][0].tobytes())
+        self.assertEqual(copy.grasscolor, self.tex.grasscolor)
+        self.assertEqual(copy.biome_grass_texture.tobytes(),
+                         self.tex.biome_grass_texture.tobytes())
+
+        # copies of the copy map the same segment
+        copy2 = pickle.loads(pickle.dumps(copy))
+        self.assertEqual(copy2.shared_memory.name, self.tex.shared_memory.name)
+
+    def test_falls_back_to_generate(self):
+        self.assertTrue(self.tex.share())
+        state = self.tex.__getstate__()
+        self.tex.unshare()
+
+        copy = textures.Textures.__new__(textures.Textures)
+        generated = []
+        copy.generate = lambda: generated.append(True)
+        copy.__setstate__(state)
+        self.assertEqual(generated, [True])
+        self.assertIsNone(copy.shared_memory)
+
+
+class LazyTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict(textures.blockmap_generators)
+        textures.blockmap_generators.clear()
+        self.calls = []
+
+        def gen(tex, blockid, data):
+            self.calls.append((blockid, data))
+            return make_sprite((blockid, data, 0, 255))
+        for key in [(1, 0), (5, 0), (5, 1), (20, 0)]:
+            textures.blockmap_generators[key] = gen
+
+        self.tex = textures.Textures(lazy=True)
+        # skip loading the color maps, generate() only needs the generators
+        self.tex.load_foliage_color = self.tex.load_grass_color = lambda: None
+        self.tex.build_block = lambda top, side: make_sprite((0, 255, 0, 255))
+        self.tex.load_image_texture = lambda filename: None
+        self.tex.generate()
+
+    def tearDown(self):
+        textures.blockmap_generators.clear()
+        textures.blockmap_generators.update(self.saved)
+
+    def test_generate_leaves_placeholders(self):
+        self.assertEqual(self.calls, [])
+        self.assertIs(self.tex.blockmap[5 * textures.max_data + 1], Ellipsis)
+        self.assertIsNone(self.tex.blockmap[2 * textures.max_data])
+        self.assertEqual(self.tex.atlas_index[5 * textures.max_data + 1], -2)
+        self.assertEqual(self.tex.atlas_index[2 * textures.max_data], -1)
+
+    def test_generate_slot(self):
+        tex = self.tex.generate_slot(5 * textures.max_data + 1)
+        self.assertEqual(self.calls, [(5, 1)])
+        self.assertIs(self.tex.blockmap[5 * textures.max_data + 1], tex)
+        self.assertEqual(tex[0].getpixel((0, 0)), (5, 1, 0, 255))
+
+    def test_failed_slot_not_retried(self):
+        def broken(tex, blockid, data):
+            raise TextureException("missing")
+        textures.blockmap_generators[(1, 0)] = broken
+        with self.assertRaises(TextureException):
+            self.tex.generate_slot(1 * textures.max_data)
+        self.assertIsNone(self.tex.blockmap[1 * textures.max_data])
+
+    def test_pregenerate(self):
+        self.tex.pregenerate({5, 7})
+        self.assertEqual(sorted(self.calls), [(5, 0), (5, 1)])
+        self.assertIs(self.tex.blockmap[1 * textures.max_data], Ellipsis)
+        self.assertGreaterEqual(self.tex.atlas_index[5 * textures.max_data], 0)
+        self.assertGreaterEqual(self.tex.atlas_index[5 * textures.max_data + 1], 0)
+        self.assertEqual(self.tex.atlas_index[1 * textures.max_data], -2)
+
+    def test_set_atlas_keeps_placeholders(self):
+        self.tex.pregenerate({5})
+        copy = textures.Textures()
+        copy.set_atlas(self.tex.atlas, self.tex.atlas_light, self.tex.atlas_index)
+        self.assertIs(copy.blockmap[1 * textures.max_data], Ellipsis)
+        self.assertIsNone(copy.blockmap[2 * textures.max_data])
+        self.assertEqual(copy.blockmap[5 * textures.max_data][0].getpixel((0, 0)),
+                         (5, 0, 0, 255))
+        self.assertTrue(copy.atlas_is_complete())
+
+
+class FindFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldhome = os.environ.get("HOME")
+        os.environ["HOME"] = self.tmpdir
+        versions = os.path.join(self.tmpdir, ".minecraft", "versions")
+        self.make_zip(os.path.join(versions, "1.14", "1.14.jar"), {
+            "assets/minecraft/textures/block/stone.png": b"new stone",
+            "assets/minecraft/textures/block/dirt.png": b"jar dirt"})
+        self.make_zip(os.path.join(versions, "1.13", "1.13.jar"), {
+            "assets/minecraft/textures/block/stone.png": b"old stone",
+            "assets/minecraft/textures/block/old.png": b"old"})
+
+    def tearDown(self):
+        if self.oldhome is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.oldhome
+        shutil.rmtree(self.tmpdir)
+
+    def make_zip(self, path, files):
+        os.makedirs(os.path.dirname(path))
+        with zipfile.ZipFile(path, "w") as z:
+            for name, data in files.items():
+                z.writestr(name, data)
+
+    def read(self, tex, filename):
+        with tex.find_file(filename) as f:
+            return f.read()
+
+    def test_newest_jar_first(self):
+        tex = textures.Textures()
+        self.assertEqual(self.read(tex, "assets/minecraft/textures/block/stone.png"), b"new stone")
+        self.assertEqual(self.read(tex, "assets/minecraft/textures/block/old.png"), b"old")
+        # the bundled textures are found too
+        self.assertTrue(self.read(tex, "water.png").startswith(b"\x89PNG"))
+
+    def test_pack_takes_precedence(self):
+        pack = os.path.join(self.tmpdir, "pack", "pack.zip")
+        self.make_zip(pack, {"assets/minecraft/textures/block/dirt.png": b"pack dirt"})
+        tex = textures.Textures(texturepath=pack)
+        self.assertEqual(self.read(tex, "assets/minecraft/textures/block/dirt.png"), b"pack dirt")
+        self.assertEqual(self.read(tex, "assets/minecraft/textures/block/stone.png"), b"new stone")
+
+    def test_pack_directory(self):
+        packdir = os.path.join(self.tmpdir, "packdir")
+        blockdir = os.path.join(packdir, "assets", "minecraft", "textures", "block")
+        os.makedirs(blockdir)
+        with open(os.path.join(blockdir, "dirt.png"), "wb") as f:
+            f.write(b"dir dirt")
+        tex = textures.Textures(texturepath=packdir)
+        self.assertEqual(self.read(tex, "assets/minecraft/textures/block/dirt.png"), b"dir dirt")
+
+    def test_program_dir(self):
+        # extracted textures next to overviewer.py come before the jars
+        programdir = os.path.join(self.tmpdir, "program")
+        blockdir = os.path.join(programdir, "assets", "minecraft", "textures", "block")
+        os.makedirs(blockdir)
+        with open(os.path.join(blockdir, "stone.png"), "wb") as f:
+            f.write(b"extracted stone")
+        with open(os.path.join(programdir, "loose.png"), "wb") as f:
+            f.write(b"loose")
+        with mock.patch("overviewer_core.util.get_program_path", return_value=programdir):
+            tex = textures.Textures()
+            self.assertEqual(self.read(tex, "assets/minecraft/textures/block/stone.png"),
+                             b"extracted stone")
+            self.assertEqual(self.read(tex, "loose.png"), b"loose")
+            self.assertEqual(self.read(tex, "assets/minecraft/textures/block/dirt.png"),
+                             b"jar dirt")
+            # and the fingerprint covers the same sources
+            self.assertIn(programdir, tex.get_file_sources())
+
+    def test_misses_are_cached(self):
+        tex = textures.Textures()
+        with self.assertRaises(TextureException):
+            tex.find_file("assets/minecraft/textures/block/missing.png")
+        self.assertIsNone(tex.file_index["assets/minecraft/textures/block/missing.png"])
+        tex.locate_file = None
+        with self.assertRaises(TextureException):
+            tex.find_file("assets/minecraft/textures/block/missing.png")
+
+    def test_index_not_pickled(self):
+        tex = textures.Textures()
+        self.read(tex, "assets/minecraft/textures/block/dirt.png")
+        copy = pickle.loads(pickle.dumps(tex))
+        self.assertIsNone(copy.file_index)
+        self.assertEqual(self.read(copy, "assets/minecraft/textures/block/dirt.png"), b"jar dirt")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -63,6 +63,13 @@ class FakeRegionset(object):
         except KeyError:
             return None
 
+    def get_chunk_blockids(self, x, z):
+        # a block of its own for each chunk
+        return set([x * 10 + z])
+
+class FakeTextures(object):
+    preflight = True
+
 class FakeAssetmanager(object):
     def __init__(self, lastrendertime):
         self.lrm = lastrendertime
@@ -275,3 +282,64 @@ class TilesetTest(unittest.TestCase):
 
         for tilepath in expected:
             self.assertTrue(tilepath in paths, "%s was expected to be returned but wasn't: %s" % (tilepath, paths))
+
+    def test_preflight_blockids(self):
+        """Tests that the chunk scan notes the blocks of the chunks that
+        may need rendering in every rendercheck mode, for the texture
+        preflight
+
+        """
+        self.rs.chunks.update({(0,0): 6, (2,3): 6})
+        def preprocess(ts):
+            ts.textures = FakeTextures()
+            ts.last_rendertime = 5
+        updated = self.get_tileset({'renderchecks': 0}, self.get_outputdir(), preprocess)
+        self.assertEqual(updated.seen_blockids, set([0, 23]))
+        # --check-tiles decides by the tiles on disk while rendering, so
+        # every chunk may be rendered, the same as for --forcerender
+        everything = set(x * 10 + z for x, z in self.rs.chunks)
+        for mode in (1, 2):
+            ts = self.get_tileset({'renderchecks': mode}, self.get_outputdir(), preprocess)
+            self.assertEqual(ts.seen_blockids, everything)
+
+        # nothing is read without a preflight
+        ts = self.get_tileset({'renderchecks': 1}, self.get_outputdir())
+        self.assertEqual(ts.seen_blockids, set())
+
+    def test_share_renders(self):
+        """Tests that tilesets rendering the same regionset are grouped, and
+        that the group's work items cover the tiles each of them needs
+
+        """
+        self.rs.chunks.update({(0,0): 6})
+        everything = self.get_tileset({'renderchecks': 2, 'name': 'all'}, self.get_outputdir())
+        updated = self.get_tileset({'renderchecks': 0, 'name': 'updated'}, self.get_outputdir(),
+                lambda ts: setattr(ts, 'last_rendertime', 5))
+        tileset.share_renders([everything, updated])
+
+        self.assertEqual(everything.render_group, [everything, updated])
+        self.assertIs(updated.render_leader, everything)
+        self.assertEqual(list(updated.iterate_work_items(0)), [])
+        self.assertEqual(updated.get_phase_length(0), 0)
+
+        items = list(everything.iterate_work_items(0))
+        self.assertEqual(everything.get_phase_length(0), len(items))
+        members = dict(item for item, _ in items)
+        self.assertEqual(set(members), set(get_tile_set(chunks)))
+        expected = get_tile_set({(0,0): 6})
+        for tilepath, m in members.items():
+            self.assertEqual(m, (0, 1) if tilepath in expected else (0,))
+
+        # dependencies name the work items of the children exactly
+        for (tilepath, _), deps in items:
+            for childpath, m in deps:
+                if childpath in members:
+                    self.assertEqual(m, members[childpath])
+
+    def test_share_renders_checktiles(self):
+        """Tilesets in --check-tiles mode are left on their own"""
+        a = self.get_tileset({'renderchecks': 2}, self.get_outputdir())
+        b = self.get_tileset({'renderchecks': 1}, self.get_outputdir())
+        tileset.share_renders([a, b])
+        self.assertIsNone(a.render_group)
+        self.assertIsNone(b.render_leader)
@@ -1,8 +1,18 @@
 import unittest
 
+import argparse
 import os
+import shutil
+import struct
+import tempfile
+from unittest import mock
 
-from overviewer_core import world
+import numpy
+
+import contrib.benchmark as benchmark
+from overviewer_core import nbt, world
+
+from .test_nbt import CHUNK, encode_nbt
 
 class ExampleWorldTest(unittest.TestCase):
     @unittest.skip("Broken old garbage, find a newer world")
@@ -30,5 +40,332 @@ class ExampleWorldTest(unittest.TestCase):
         
          
 
+class BlockStatesTest(unittest.TestCase):
+    def setUp(self):
+        self.rset = world.RegionSet(tempfile.gettempdir(), "region", filenames=[])
+
+    def unpack(self, long_array):
+        return self.rset._packed_longarray_to_shorts(long_array, 4096).tolist()
+
+    def test_all_ones(self):
+        # every bit set, so the longs are all -1 as NBT stores them
+        for bits in range(4, 13):
+            self.assertEqual(set(self.unpack([-1] * (bits * 64))), set([2 ** bits - 1]),
+                             "%d bits per block" % bits)
+
+    def test_vectors(self):
+        # 0, 1, 2, ... packed into the first longs with 7 and 11 bits per
+        # block, values spanning the longs like 1.13 to 1.15 do; the rest
+        # of the blocks are 0
+        sevens = [-0x77f1e7d7bf9f7f80, -0x776fe1c7973e9d7c, 0x668c982e58a94264,
+                  0x446890a03e78e9c3, 0x6ac56a94a84e992a, -0x2654b993674fa147,
+                  0x7ef9ebc76e9cb86e]
+        values = self.unpack(sevens + [0] * (7 * 64 - 7))
+        self.assertEqual(values[:64], list(range(64)))
+        self.assertEqual(set(values[64:]), set([0]))
+
+        elevens = [0x280400600800800, 0x160280480800e018, -0x77effe1fc7f97f40,
+                   -0x1fa7f57ebfd9fb80, -0x7e3fc9f97f37e7fe, 0x881082003e0780e,
+                   0x2804e09812824046, -0x47e97d3fa9f57eb8, 0x40660c81883005e0,
+                   -0x7e37c7f91f27e57d, 0x7e0f81e83c0760e]
+        values = self.unpack(elevens + [0] * (11 * 64 - 11))
+        self.assertEqual(values[:64], list(range(64)))
+        self.assertEqual(set(values[64:]), set([0]))
+
+
+class FakeRegionSet(object):
+    def __init__(self):
+        self.reads = 0
+
+    def get_chunk(self, x, z):
+        self.reads += 1
+        blocks = numpy.arange(4096, dtype=numpy.uint16).reshape((16, 16, 16))
+        section = {"Y": 0, "Blocks": blocks, "Data": blocks % 16,
+                   "SkyLight": blocks % 15, "BlockLight": blocks % 14}
+        return {"xPos": x, "zPos": z, "Sections": [section],
+                "Biomes": numpy.arange(256).reshape((16, 16))}
+
+
+class RotatedRegionSetTest(unittest.TestCase):
+    def test_rotation(self):
+        for north_dir in range(4):
+            rset = world.RotatedRegionSet(FakeRegionSet(), north_dir)
+            chunk = rset.get_chunk(*rset.rotate(3, 5))
+            self.assertEqual((chunk["xPos"], chunk["zPos"]), (3, 5))
+            # arrays are Y, Z, X; rotating them means rotating in the ZX plane
+            blocks = numpy.arange(4096, dtype=numpy.uint16).reshape((16, 16, 16))
+            expected = numpy.swapaxes(numpy.rot90(numpy.swapaxes(blocks, 0, 2), north_dir), 0, 2)
+            self.assertTrue((chunk["Sections"][0]["Blocks"] == expected).all())
+
+    def test_cached(self):
+        fake = FakeRegionSet()
+        rset = world.RotatedRegionSet(fake, 1)
+        chunk = rset.get_chunk(0, 0)
+        self.assertIs(rset.get_chunk(0, 0), chunk)
+        self.assertEqual(fake.reads, 1)
+        rset.get_chunk(0, 1)
+        self.assertEqual(fake.reads, 2)
+
+
+class FakeChunkList(object):
+    """A regionset with a chunk at every point in a 96x96 square, that keeps
+    track of which regions were asked about"""
+    def __init__(self):
+        self.regions = set()
+
+    def iterate_chunks(self, bounds=None):
+        for x in range(-48, 48):
+            for z in range(-48, 48):
+                if bounds is not None and not world.in_bounds(x // 32, z // 32, [
+                        (xmin // 32, zmin // 32, xmax // 32, zmax // 32)
+                        for xmin, zmin, xmax, zmax in bounds]):
+                    continue
+                self.regions.add((x // 32, z // 32))
+                if bounds is None or world.in_bounds(x, z, bounds):
+                    yield x, z, 0
+
+
+class BoundsTest(unittest.TestCase):
+    def test_regions(self):
+        rset = world.RegionSet.__new__(world.RegionSet)
+        rset.regionfiles = dict(((x, z), "r.%d.%d.mca" % (x, z))
+                                for x in range(-2, 2) for z in range(-2, 2))
+        regions = dict(rset._iterate_regions([(-5, 0, 5, 20), (40, 40, 40, 40)]))
+        self.assertEqual(sorted(regions), [(-1, 0), (0, 0), (1, 1)])
+        self.assertEqual(len(dict(rset._iterate_regions(None))), 16)
+
+    def test_cropped(self):
+        fake = FakeChunkList()
+        rset = world.CroppedRegionSet(fake, 0, 0, 100, 200)
+        chunks = set((x, z) for x, z, _ in rset.iterate_chunks())
+        self.assertEqual(chunks, set((x, z) for x in range(0, 7) for z in range(0, 13)))
+        self.assertEqual(fake.regions, set([(0, 0)]))
+
+        # bounds given to the cropped set are cut down to the crop
+        chunks = set((x, z) for x, z, _ in rset.iterate_chunks([(5, -10, 40, 1)]))
+        self.assertEqual(chunks, set([(5, 0), (5, 1), (6, 0), (6, 1)]))
+
+    def test_rotated(self):
+        for north_dir in range(4):
+            fake = FakeChunkList()
+            rset = world.RotatedRegionSet(world.CroppedRegionSet(fake, -40, 16, 100, 200), north_dir)
+            everything = world.RotatedRegionSet(FakeChunkList(), north_dir)
+            expected = set((x, z) for x, z, _ in everything.iterate_chunks()
+                           if -3 <= everything.unrotate(x, z)[0] <= 6 and
+                           1 <= everything.unrotate(x, z)[1] <= 12)
+            self.assertEqual(set((x, z) for x, z, _ in rset.iterate_chunks()), expected)
+            self.assertEqual(fake.regions, set([(-1, 0), (0, 0)]))
+
+            bounds = [(-10, -10, 2, 3)]
+            expected = set(c for c in expected if world.in_bounds(c[0], c[1], bounds))
+            self.assertEqual(set((x, z) for x, z, _ in rset.iterate_chunks(bounds)), expected)
+
+
+class ScanWorldTest(unittest.TestCase):
+    def setUp(self):
+        self.worlddir = tempfile.mkdtemp()
+        for d, names in [("region", ["r.0.0.mca", "r.-1.0.mca", "level.dat"]),
+                         ("DIM-1/region", ["r.0.0.mca"]),
+                         ("DIM-1/poi", ["r.0.0.mca"]),
+                         ("playerdata", ["x.mca"]),
+                         ("empty", [])]:
+            os.makedirs(os.path.join(self.worlddir, d))
+            for name in names:
+                open(os.path.join(self.worlddir, d, name), "w").close()
+        self.age_dirs()
+
+    def tearDown(self):
+        shutil.rmtree(self.worlddir)
+
+    def age_dirs(self):
+        # listings of recently changed directories aren't kept
+        for root, dirs, files in os.walk(self.worlddir):
+            os.utime(root, (1000000000, 1000000000))
+
+    def scan(self, listings=None, newlistings=None):
+        return dict((os.path.relpath(path, self.worlddir), sorted(mcas)) for path, mcas in
+                    world.scan_world_dirs(self.worlddir, listings, newlistings))
+
+    def test_scan(self):
+        self.assertEqual(self.scan(), {
+            ".": [], "region": ["r.-1.0.mca", "r.0.0.mca"], "DIM-1": [],
+            "DIM-1/region": ["r.0.0.mca"], "DIM-1/poi": ["r.0.0.mca"], "empty": []})
+
+    def test_nested_dimension(self):
+        # only the directories at the top of the world are skipped, a
+        # datapack's dimension may be called anything
+        regiondir = os.path.join(self.worlddir, "dimensions", "mypack", "stats", "region")
+        os.makedirs(regiondir)
+        open(os.path.join(regiondir, "r.0.0.mca"), "w").close()
+        self.assertEqual(self.scan()["dimensions/mypack/stats/region"], ["r.0.0.mca"])
+
+    def test_world_regionsets(self):
+        worlddir = os.path.join(self.worlddir, "world")
+        benchmark.generate_world(worlddir, argparse.Namespace(
+            chunks=1, sections=1, density=0.5, palette=5, corruption=0.0, seed=1))
+        for d in ["DIM-1/region", "DIM-1/poi", "dimensions/mypack/stats/region"]:
+            os.makedirs(os.path.join(worlddir, d))
+            open(os.path.join(worlddir, d, "r.0.0.mca"), "w").close()
+        rsets = world.World(worlddir).get_regionsets()
+        self.assertEqual(sorted(rset.get_type() or "" for rset in rsets),
+                         ["", "DIM-1", "dimensions/mypack/stats"])
+
+    def test_listings(self):
+        listings = {}
+        expected = self.scan(newlistings=listings)
+        self.assertEqual(sorted(listings), sorted(expected))
+
+        # unchanged directories aren't listed again
+        open(os.path.join(self.worlddir, "region", "r.5.5.mca"), "w").close()
+        self.age_dirs()
+        self.assertEqual(self.scan(listings), expected)
+
+        os.utime(os.path.join(self.worlddir, "region"), (2000000000, 2000000000))
+        self.assertEqual(self.scan(listings)["region"], ["r.-1.0.mca", "r.0.0.mca", "r.5.5.mca"])
+
+    def test_recent(self):
+        os.utime(os.path.join(self.worlddir, "region"), None)
+        listings = {}
+        self.scan(newlistings=listings)
+        self.assertTrue("DIM-1" in listings)
+        self.assertFalse("region" in listings)
+
+
+def write_region(path, chunks):
+    """Writes a region file holding the given chunks, a dict mapping local
+    chunk coordinates to (timestamp, zlib compressed data)"""
+    locations = [0] * 1024
+    timestamps = [0] * 1024
+    sectors = []
+    for (x, z), (timestamp, data) in chunks.items():
+        data = struct.pack(">I B", len(data) + 1, 2) + data
+        data += b"\0" * (-len(data) % 4096)
+        locations[x + z * 32] = ((2 + len(sectors)) << 8) | (len(data) // 4096)
+        timestamps[x + z * 32] = timestamp
+        sectors.append(data)
+    with open(path, "wb") as f:
+        f.write(struct.pack(">1024I", *locations))
+        f.write(struct.pack(">1024i", *timestamps))
+        f.write(b"".join(sectors))
+
+class QuarantineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.regiondir = os.path.join(self.tmpdir, "region")
+        os.mkdir(self.regiondir)
+        self.write_region(100)
+        self.path = os.path.join(self.tmpdir, "corruptchunks")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_region(self, timestamp):
+        # chunk 0,0 isn't valid zlib data
+        write_region(os.path.join(self.regiondir, "r.0.0.mca"),
+                     {(0, 0): (timestamp, b"not zlib!!")})
+
+    def get_chunk(self, rset):
+        with mock.patch("time.sleep") as sleep:
+            self.assertRaises(nbt.CorruptionError, rset.get_chunk, 0, 0)
+        return sleep.call_count
+
+    def test_file(self):
+        quarantine = world.ChunkQuarantine(self.path)
+        quarantine.add("r.0.0.mca", 1, 2, 100)
+        other = world.ChunkQuarantine(self.path)
+        self.assertEqual(other.get("r.0.0.mca", 1, 2), 100)
+        self.assertEqual(other.get("r.0.0.mca", 2, 1), None)
+
+        quarantine.add("r.0.0.mca", 2, 1, 200)
+        with open(self.path, "a") as f:
+            f.write('["r.0.0.mca", 3')
+        other.refresh()
+        self.assertEqual(other.get("r.0.0.mca", 2, 1), 200)
+
+    def test_get_chunk(self):
+        rset = world.RegionSet(self.regiondir, "region",
+                               quarantine=world.ChunkQuarantine(self.path))
+        other = world.RegionSet(self.regiondir, "region",
+                                quarantine=world.ChunkQuarantine(self.path))
+        self.assertEqual(self.get_chunk(rset), 4)
+        # given up on right away from now on, in this process and others
+        self.assertEqual(self.get_chunk(rset), 0)
+        self.assertEqual(self.get_chunk(other), 0)
+        rset = world.RegionSet(self.regiondir, "region",
+                               quarantine=world.ChunkQuarantine(self.path))
+        self.assertEqual(self.get_chunk(rset), 0)
+
+        # until the chunk changes
+        self.write_region(101)
+        rset = world.RegionSet(self.regiondir, "region",
+                               quarantine=world.ChunkQuarantine(self.path))
+        self.assertEqual(self.get_chunk(rset), 4)
+
+    def test_prune(self):
+        regionfile = os.path.join(self.regiondir, "r.0.0.mca")
+        rset = world.RegionSet(self.regiondir, "region",
+                               quarantine=world.ChunkQuarantine(self.path))
+        self.get_chunk(rset)
+        quarantine = world.ChunkQuarantine(self.path)
+        # a chunk that isn't there anymore, in a region that is and one
+        # that isn't
+        quarantine.add(regionfile, 1, 1, 100)
+        quarantine.add(os.path.join(self.regiondir, "r.1.0.mca"), 32, 0, 100)
+        quarantine.prune()
+        self.assertEqual(list(quarantine.entries), [(regionfile, 0, 0)])
+        self.assertEqual(list(world.ChunkQuarantine(self.path).entries), [(regionfile, 0, 0)])
+
+        # new entries still reach the others
+        other = world.ChunkQuarantine(self.path)
+        quarantine.add(regionfile, 2, 2, 100)
+        other.refresh()
+        self.assertEqual(other.get(regionfile, 2, 2), 100)
+
+        # the chunk changed
+        self.write_region(101)
+        quarantine = world.ChunkQuarantine(self.path)
+        quarantine.prune()
+        self.assertEqual(quarantine.entries, {})
+        self.assertEqual(world.ChunkQuarantine(self.path).entries, {})
+
+
+class EntitiesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        carved = dict(CHUNK, Level=dict(CHUNK["Level"], Status="carved"))
+        write_region(os.path.join(self.tmpdir, "r.-1.0.mca"),
+                     {(31, 2): (100, encode_nbt(CHUNK)), (30, 2): (100, encode_nbt(carved))})
+        self.rset = world.RegionSet(self.tmpdir, "region")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_entities(self):
+        self.assertEqual(self.rset.get_chunk_entities(-1, 2), {
+            "Entities": CHUNK["Level"]["Entities"],
+            "TileEntities": CHUNK["Level"]["TileEntities"]})
+        self.assertRaises(world.ChunkDoesntExist, self.rset.get_chunk_entities, -1, 3)
+        self.assertRaises(world.ChunkDoesntExist, self.rset.get_chunk_entities, 0, 2)
+
+    def test_not_generated(self):
+        # not rendered, so no markers either
+        self.assertRaises(world.ChunkDoesntExist, self.rset.get_chunk, -2, 2)
+        self.assertRaises(world.ChunkDoesntExist, self.rset.get_chunk_entities, -2, 2)
+
+    def test_blockids(self):
+        stone = self.rset._get_block({"Name": "minecraft:stone"})[0]
+        self.assertEqual(self.rset.get_chunk_blockids(-1, 2), {stone, 0})
+        # chunks that won't be rendered don't use any blocks
+        self.assertEqual(self.rset.get_chunk_blockids(-2, 2), set())
+        self.assertEqual(self.rset.get_chunk_blockids(-1, 3), set())
+        self.assertEqual(self.rset.get_chunk_blockids(0, 2), set())
+
+    def test_wrappers(self):
+        rotated = world.RotatedRegionSet(self.rset, world.LOWER_RIGHT)
+        self.assertEqual(rotated.get_chunk_entities(1, -2)["TileEntities"][0]["Text1"], "hello")
+        cropped = world.CroppedRegionSet(self.rset, 0, 0, 100, 100)
+        self.assertRaises(world.ChunkDoesntExist, cropped.get_chunk_entities, -1, 2)
+
+
 if __name__ == "__main__":
     unittest.main()